@@ -11,10 +11,14 @@ import CircularProgress from "@mui/material/CircularProgress";
 // Initialize a query client
 const queryClient = new QueryClient();
 
+// Each browser tab has its own chat session, and with it its own chat history on the server
+const sessionId = crypto.randomUUID();
+
 // Function to perform the POST request
 const postChat = async (inputVal) => {
   const { data } = await axios.post("http://localhost:3000/api/chat", {
     input_val: inputVal,
+    session_id: sessionId,
   });
   return data;
 };
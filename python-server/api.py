@@ -1,40 +1,118 @@
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import hmac
 import json
 import os
 import time
+import uuid
+from psycopg2.extras import RealDictCursor
+from db import get_pool
+from filters import compile_availability, compile_filters, parse_date_range, split_text_filters
 # Load environment variables from .env file
 load_dotenv()
 
 def get_env_vars(*args):
     return [os.getenv(arg) for arg in args]
 
-DB_HOST, DB_NAME, DB_USERNAME, DB_PASSWORD, DB_PORT = get_env_vars('DB_HOST', 'DB_NAME', 'DB_USERNAME', 'DB_PASSWORD', 'DB_PORT')
-conn = psycopg2.connect(
-    dbname=DB_NAME,
-    user=DB_USERNAME,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT
-)
+from embedding_cache import EmbeddingCache, FakeEmbeddings, normalize_text
+from result_cache import ResultCache
+from backpressure import InflightLimiter
+from lazy import resource, stats as resource_stats, warm_up as warm_up_resources
+from metrics import instrument_app, log, metrics
+from pagination import decode_page_token, encode_page_token, parse_page_size, query_fingerprint
+
+# the pool, clients and caches below are built on first use or by warm_up(), not on import, so a worker starts
+# fast and survives a database that is briefly down, see lazy.py
+
+# connections are checked out of get_pool() per request, see db.py for the DB_* and DB_POOL_* settings
+
+# run repeated listing searches as server-side prepared statements
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() == "true"
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+@resource("embedding_cache")
+def get_embedding_cache():
+    # set EMBEDDING_PROVIDER=fake to run without calling OpenAI
+    if os.getenv("EMBEDDING_PROVIDER", "openai") == "fake":
+        embeddings = FakeEmbeddings()
+    else:
+        # langchain_openai takes most of a second to import
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    return EmbeddingCache(
+        embeddings,
+        model_name=EMBEDDING_MODEL,
+        max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("EMBEDDING_CACHE_TTL", 86400)),
+        disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+        batch_window=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 10)) / 1000,
+    )
+
+# LISTINGS_BACKEND=numpy answers semantic searches from an in-memory copy of the embeddings (see vector_store.py)
+# and only fetches the final rows from the database by primary key
+LISTINGS_BACKEND = os.getenv("LISTINGS_BACKEND", "sql")
+
+@resource("vector_store")
+def get_vector_store():
+    """the vector store, or None with LISTINGS_BACKEND=sql"""
+    if LISTINGS_BACKEND != "numpy":
+        return None
+    from vector_store import NumpyVectorStore
+    vector_store = NumpyVectorStore(os.getenv("VECTOR_STORE_PATH", "vector_store"), dtype=os.getenv("VECTOR_STORE_DTYPE", "float32"))
+    if not vector_store.reload_if_changed():
+        print("Building the vector store, this can take a minute...")
+        vector_store.build(get_pool())
+    return vector_store
+
+# cached listing search results, invalidated through /api/listings/refresh
+# LISTINGS_CACHE_PATH shares the cache between the API workers on a host, without it a refresh only reaches the worker
+# that handles it
+@resource("listings_cache")
+def get_listings_cache():
+    return ResultCache(
+        max_entries=int(os.getenv("LISTINGS_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("LISTINGS_CACHE_TTL", 300)),
+        shared_path=os.getenv("LISTINGS_CACHE_PATH") or None,
+    )
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
+@resource("pgvector_version")
+def get_pgvector_version():
+    """the (major, minor) version of the vector extension, (0, 0) if it isn't installed"""
+    with get_pool().cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+    # YugabyteDB reports versions like 0.4.4-yb-1.2
+    return tuple(int(part) for part in row[0].split("-")[0].split(".")[:2]) if row else (0, 0)
+
+# /api/listings/refresh needs "Authorization: Bearer <LISTINGS_REFRESH_TOKEN>" and is disabled while it isn't set
+LISTINGS_REFRESH_TOKEN = os.getenv("LISTINGS_REFRESH_TOKEN", "")
+
+def warm_up():
+    """builds everything a request needs and checks that the database answers, returns the build time of each
+    in ms. Runs before a worker accepts requests (see serve.py) and on /readyz, raises if something is unavailable"""
+    timings = warm_up_resources(get_pool, get_embedding_cache, get_listings_cache, get_vector_store, get_pgvector_version)
+    with get_pool().cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT 1")
+    return timings
 
 def get_embedding(embedding_text: str):
     """this function generates text embeddings to be used in PostgreSQL database queries with pgvector"""
-    # startTime = time.time()
-    response = embeddings.embed_query(embedding_text)
-    # print("Duration getting embeddings: ", time.time() - startTime)
-    # print("length of embeddings response: ", len(response))
-    # This returns a list of embeddings; we assume one input text for simplicity
-    return response
+    # repeated phrases are served from the cache, concurrent misses are batched into one embed_documents call
+    with metrics.time("embedding"):
+        return get_embedding_cache().get(embedding_text)
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, stream_with_context
 
 app = Flask(__name__)
+# requests over API_MAX_INFLIGHT per worker get a 429 instead of queueing, see backpressure.py
+app.wsgi_app = InflightLimiter(app.wsgi_app, int(os.getenv("API_MAX_INFLIGHT", 64)),
+                               exempt_paths=["/metrics", "/healthz", "/readyz", "/api/pool/stats", "/api/listings/cache/stats", "/api/embeddings/stats"])
+# trace ids, Server-Timing headers and latency per stage, scraped from /metrics. A scrape doesn't build anything
+instrument_app(app, lambda: {"pool": get_pool().stats() if get_pool.built else {},
+                             "embedding_cache": get_embedding_cache().stats() if get_embedding_cache.built else {},
+                             "listings_cache": get_listings_cache().stats() if get_listings_cache.built else {},
+                             "inflight": app.wsgi_app.stats()})
 
 # Define a custom error handler for 404 Not Found errors
 @app.errorhandler(404)
@@ -47,51 +125,217 @@ def internal_error(error):
     return jsonify({"error": "An unexpected error occurred"}), 500
 
 
-def create_airbnb_select_query(filters, embedding):
-    query_base = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings"
-    query_conditions = []
-    params = []
+LISTINGS_BY_ID_QUERY = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings WHERE listing_id = ANY(%s)"
 
-    if(len(filters) > 0):
-        for key, value in filters.items():
-            # For each key-value pair, add a condition to the list
+# two stage search modes: the compact codes from sql/quantized_embeddings.sql are scanned for candidates,
+# which are then re-ranked against the full description_embedding
+QUANTIZED_ORDER_BY = {
+    "halfvec": "description_embedding_half <=> %s::vector::halfvec(1536)",
+    "binary": "description_embedding_bits <~> binary_quantize(%s::vector)::bit(1536)",
+}
+SEARCH_MODES = ["exact", *QUANTIZED_ORDER_BY, "hybrid"]
+DEFAULT_SEARCH_MODE = os.getenv("DEFAULT_SEARCH_MODE", "exact")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 50))
+# candidates fetched per signal before fusion in the "hybrid" search mode
+HYBRID_FUSION_DEPTH = int(os.getenv("HYBRID_FUSION_DEPTH", 50))
+# rows per page of /api/listings and GET /api/bookings, unless the request asks for another "page_size"
+LISTINGS_PAGE_SIZE = int(os.getenv("LISTINGS_PAGE_SIZE", 5))
+MAX_LISTINGS_PAGE_SIZE = 50
+BOOKINGS_PAGE_SIZE = int(os.getenv("BOOKINGS_PAGE_SIZE", 100))
+MAX_BOOKINGS_PAGE_SIZE = 1000
 
-            if(hasattr(value, "symbol")):
-                symbol = value["symbol"]
-            else:
-                symbol = "="
-
-            if(value['type'] == "text"):
-                # notice the double %% used to escape the % character in this case
-                # this executes a similarity search on the text using pg_trgm
-                query_conditions.append(f"{key} %% %s")
-            elif(value['type'] == 'number'):
-                query_conditions.append(f"{key} {symbol} %s")
-            elif(value['type'] == 'currency'):
-                query_conditions.append(f"{key}::MONEY::NUMERIC {symbol} %s")
-            elif(value['type'] == 'boolean'):
-                query_conditions.append(f"{key} = %s")
-
-            # query_conditions.append(f"{key} = %s")
-            params.append(value['value'])
-            
-        query_base += ' WHERE '
-        # Join all conditions with 'AND' and combine with the base query
-        query = query_base + ' AND '.join(query_conditions)
+def create_airbnb_select_query(filters, embedding, search_mode="exact", candidates=RERANK_CANDIDATES, dates=None, page_size=5, after=None):
+    """builds the listings search query, raises ValueError if the filters are invalid.
+    With dates, listings booked during any of them are left out.
+
+    Rows are sorted by their "distance" to the embedding, or by listing_id without one. The query returns up to
+    page_size + 1 rows, so the caller knows if there is a next page, after the sort key `after` of the last row of
+    the previous page. page_size=None returns all rows, and candidates=None re-ranks every listing instead of the
+    candidates of a quantized search mode.
+    """
+    # column names and types are validated against a whitelist in filters.py
+    query_conditions, params = compile_filters(filters)
+    availability_conditions, availability_params = compile_availability(dates)
+    query_conditions += availability_conditions
+    params += availability_params
+    limit = f' LIMIT {int(page_size) + 1}' if page_size is not None else ''
+
+    if embedding == None:
+        if after:
+            query_conditions.append('listing_id > %s')
+            params.append(after[0])
+        query = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings"
+        if len(query_conditions) > 0:
+            # Join all conditions with 'AND' and combine with the base query
+            query += ' WHERE ' + ' AND '.join(query_conditions)
+        return {"query": query + ' ORDER BY listing_id' + limit, "params": params}
+
+    # pgvector's text format, which also binds cleanly to a prepared statement parameter
+    embedding = '[' + ','.join(map(str, embedding)) + ']'
+    select = "SELECT listing_id,name,description,price,neighbourhood,description_embedding <=> %s::vector AS distance"
+    where = ' WHERE ' + ' AND '.join(query_conditions) if len(query_conditions) > 0 else ''
+    rerank = search_mode in QUANTIZED_ORDER_BY and candidates is not None
+    if rerank:
+        candidates_query = (f"SELECT listing_id,name,description,price,neighbourhood,description_embedding FROM airbnb_listings{where}"
+                            f" ORDER BY {QUANTIZED_ORDER_BY[search_mode]}, listing_id LIMIT %s")
+        query = f"{select} FROM ({candidates_query}) AS candidates"
+        params = [embedding] + params + [embedding, candidates]
+    else:
+        query = f"{select} FROM airbnb_listings{where}"
+        params = [embedding] + params
+    if after:
+        # the same order as the sort, ties on the distance are broken by listing_id
+        query += (' AND ' if where and not rerank else ' WHERE ') + '(description_embedding <=> %s::vector, listing_id) > (%s, %s)'
+        params += [embedding, *after]
+
+    return {"query": query + ' ORDER BY distance, listing_id' + limit, "params": params}
+
+# must match the expression of the full-text index in sql/hybrid_search.sql
+LISTING_DOCUMENT = "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || neighbourhood)"
+
+def create_hybrid_select_query(filters, embedding, lexical_text, options, dates=None, page_size=5, after=None):
+    """builds a single query that ranks listings by vector similarity, trigram similarity of the text filters
+    and full-text relevance, and fuses the three rankings.
+
+    Text filters become ranking signals instead of hard conditions, so a slightly misspelled neighbourhood
+    still finds the right listings. Non-text filters stay hard conditions. Pages work like in create_airbnb_select_query,
+    sorted by score and listing_id. A fusion_depth of None fuses every match of each signal instead.
+    """
+    text_filters, other_filters = split_text_filters(filters)
+    hard_conditions, hard_params = compile_filters(other_filters)
+    availability_conditions, availability_params = compile_availability(dates)
+    hard_conditions += availability_conditions
+    hard_params += availability_params
+    where = ' AND '.join(hard_conditions)
+    # LIMIT NULL is the same as no LIMIT in Postgres
+    depth = options["fusion_depth"]
+
+    signals = []
+    ctes = []
+    params = []
 
     if embedding != None:
-        if 'query' in locals(): 
-            query += ' ORDER BY '
-        else:    
-            query = query_base + ' ORDER BY '
-        query += 'description_embedding <=> %s::vector'
-        params.append(embedding) 
+        signals.append("vector")
+        ctes.append(f"""vector AS (
+            SELECT listing_id, 1 - distance AS score, row_number() OVER (ORDER BY distance, listing_id) AS rank FROM (
+                SELECT listing_id, description_embedding <=> %s::vector AS distance FROM airbnb_listings
+                {'WHERE ' + where if where else ''} ORDER BY distance, listing_id LIMIT %s) AS nearest)""")
+        params += ['[' + ','.join(map(str, embedding)) + ']', *hard_params, depth]
+
+    if len(text_filters) > 0:
+        # the text filters were already checked by compile_filters, so the keys are known column names
+        text_conditions, text_params = compile_filters(text_filters)
+        similarity = ' + '.join(f"similarity({key}, %s)" for key in text_filters)
+        signals.append("trigram")
+        ctes.append(f"""trigram AS (
+            SELECT listing_id, score, row_number() OVER (ORDER BY score DESC, listing_id) AS rank FROM (
+                SELECT listing_id, ({similarity}) / {len(text_filters)} AS score FROM airbnb_listings
+                WHERE ({' OR '.join(text_conditions)}) {'AND ' + where if where else ''}
+                ORDER BY score DESC, listing_id LIMIT %s) AS matches)""")
+        params += [*text_params, *text_params, *hard_params, depth]
+
+    if lexical_text:
+        # any of the words may match, the ranking decides which listings match best
+        signals.append("fulltext")
+        ctes.append(f"""fulltext AS (
+            SELECT listing_id, score, row_number() OVER (ORDER BY score DESC, listing_id) AS rank FROM (
+                SELECT listing_id, ts_rank({LISTING_DOCUMENT}, search.query) AS score
+                FROM airbnb_listings, (SELECT replace(plainto_tsquery('english', %s)::text, '&', '|')::tsquery AS query) AS search
+                WHERE {LISTING_DOCUMENT} @@ search.query {'AND ' + where if where else ''}
+                ORDER BY score DESC, listing_id LIMIT %s) AS matches)""")
+        params += [lexical_text, *hard_params, depth]
+
+    if len(signals) == 0:
+        return create_airbnb_select_query(filters, embedding, dates=dates, page_size=page_size, after=after)
+
+    # the fused score is numeric, which would reach the JSON response and the page tokens as a string
+    if options["fusion"] == "rrf":
+        # reciprocal rank fusion only depends on the rank within each signal, so the score scales don't matter
+        score = ' + '.join(f"%s * coalesce(1.0 / (%s + {signal}.rank), 0)" for signal in signals)
+        score_params = [value for signal in signals for value in (options[f"{signal}_weight"], options["rrf_k"])]
+    else:
+        score = ' + '.join(f"%s * coalesce({signal}.score, 0)" for signal in signals)
+        score_params = [options[f"{signal}_weight"] for signal in signals]
+
+    query = f"""WITH {', '.join(ctes)}
+        SELECT * FROM (
+            SELECT listing_id,name,description,price,neighbourhood, ({score})::float8 AS score,
+                {', '.join(f"{signal}.score AS {signal}_score" for signal in signals)}
+            FROM ({' UNION '.join(f"SELECT listing_id FROM {signal}" for signal in signals)}) AS candidates
+            JOIN airbnb_listings USING (listing_id)
+            {' '.join(f"LEFT JOIN {signal} USING (listing_id)" for signal in signals)}) AS ranked
+        {'WHERE score < %s OR (score = %s AND listing_id > %s)' if after else ''}
+        ORDER BY score DESC, listing_id{f' LIMIT {int(page_size) + 1}' if page_size is not None else ''}"""
+
+    return {"query": query, "params": params + score_params + ([after[0], after[0], after[1]] if after else [])}
 
-    query += ' LIMIT 5'
 
 
-    return {"query": query, "params": params}
+# per-request knobs for the vector index, trading recall for latency (see sql/vector_index.sql)
+# maps the "search_params" key to the database setting and its allowed range
+VECTOR_SEARCH_SETTINGS = {
+    "ef_search": ("hnsw.ef_search", 1, 1000),
+    "probes": ("ivfflat.probes", 1, 32768),
+}
 
+# pgvector 0.8 can keep scanning the HNSW index until enough rows pass the WHERE conditions (hnsw.iterative_scan),
+# scanning at most VECTOR_MAX_SCAN_TUPLES index entries per search
+ITERATIVE_SCAN_VERSION = (0, 8)
+VECTOR_MAX_SCAN_TUPLES = int(os.getenv("VECTOR_MAX_SCAN_TUPLES", 100000))
+
+def parse_search_params(search_params):
+    """validates the optional "search_params" object of a listings request and returns the settings to apply"""
+    if search_params is not None and not isinstance(search_params, dict):
+        raise ValueError("search_params must be an object")
+    settings = {}
+    for key, value in (search_params or {}).items():
+        if key in SEARCH_OPTIONS or key == "fusion":
+            # handled by parse_search_options
+            continue
+        if key == "exact":
+            # skips the vector index entirely, useful to compare recall against an exact scan
+            if value is True:
+                settings["enable_indexscan"] = "off"
+            continue
+        if key not in VECTOR_SEARCH_SETTINGS:
+            raise ValueError(f"Unknown search param: {key}")
+        name, minimum, maximum = VECTOR_SEARCH_SETTINGS[key]
+        if not isinstance(value, int) or isinstance(value, bool) or not minimum <= value <= maximum:
+            raise ValueError(f"{key} must be an integer between {minimum} and {maximum}")
+        settings[name] = str(value)
+    return settings
+
+# options of the search modes, with their default and allowed range
+SEARCH_OPTIONS = {
+    "candidates": (int, RERANK_CANDIDATES, 5, 1000),
+    "fusion_depth": (int, HYBRID_FUSION_DEPTH, 5, 1000),
+    "rrf_k": (int, 60, 1, 1000),
+    "vector_weight": (float, 1.0, 0, 10),
+    "trigram_weight": (float, 1.0, 0, 10),
+    "fulltext_weight": (float, 1.0, 0, 10),
+}
+
+def parse_search_options(data):
+    """validates the optional "search_mode" of a listings request and the options of that mode in "search_params" """
+    search_params = data.get("search_params") or {}
+    if not isinstance(search_params, dict):
+        raise ValueError("search_params must be an object")
+    options = {"mode": data.get("search_mode", DEFAULT_SEARCH_MODE), "fusion": search_params.get("fusion", "rrf")}
+    if options["mode"] not in SEARCH_MODES:
+        raise ValueError(f"search_mode must be one of {', '.join(SEARCH_MODES)}")
+    if options["fusion"] not in ("rrf", "weighted"):
+        raise ValueError("fusion must be one of rrf, weighted")
+    for key, (value_type, default, minimum, maximum) in SEARCH_OPTIONS.items():
+        value = search_params.get(key, default)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or (value_type is int and not isinstance(value, int)) or not minimum <= value <= maximum:
+            raise ValueError(f"{key} must be a{'n integer' if value_type is int else ' number'} between {minimum} and {maximum}")
+        options[key] = value
+    return options
+
+def apply_search_settings(cur, settings):
+    # is_local=true scopes the setting to the current transaction, so it never leaks to other requests on the pooled connection
+    for name, value in settings.items():
+        cur.execute("SELECT set_config(%s, %s, true)", [name, value])
 
 
 # Home route
@@ -99,65 +343,312 @@ def create_airbnb_select_query(filters, embedding):
 def home():
     return "Welcome to the REST Server running on port 8000!"
 
-@app.route('/api/listings', methods=['POST'])
-def get_listings():
-    data = request.get_json()  # Get data sent in request body
-    # Perform operations with the data (this example just returns it)
+def to_json_data(rows):
+    """converts database rows to plain JSON types: dates, decimals and money become strings.
+    This is the data contract shared by the HTTP routes and the in-process tool transport (see transport.py),
+    so the rows are encoded to JSON at most once, by the HTTP response.
+    """
+    if rows is None:
+        return None
+    if isinstance(rows, dict):
+        return {key: value if value is None or isinstance(value, (str, int, float, bool)) else str(value) for key, value in rows.items()}
+    return [to_json_data(row) for row in rows]
 
-    # print("this is is the data object in /api/data")
-    # print(data)
+def build_listings_query(data, search_options, embedding, page_size, after=None, seen=0):
+    """the query of a validated listings search, for the page after the sort key `after` and `seen` rows.
+    The re-ranked candidates grow with the rows already returned, so deeper pages are complete. The hybrid mode
+    keeps its fusion_depth instead, its scores depend on which candidates were fused"""
+    dates = data.get("dates")
+    if search_options["mode"] == "hybrid":
+        # the text filters and embedding text also drive the lexical signals
+        lexical_text = ' '.join([data.get("embedding_text", "")] + [str(value.get("value", "")) for value in split_text_filters(data.get("query_params") or {})[0].values()])
+        return create_hybrid_select_query(data.get("query_params") or {}, embedding, lexical_text.strip(), search_options, dates, page_size, after)
+    # query = "SELECT name, description from airbnb_listings ORDER BY description_embedding <=> %s::vector LIMIT 5"
+    candidates = search_options["candidates"] + seen if search_options["candidates"] is not None else None
+    return create_airbnb_select_query(data.get("query_params") or {}, embedding, search_options["mode"],
+                                      candidates, dates, page_size, after)
 
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+def sort_key(row):
+    """the keyset of a listing row, in the order of the search that returned it"""
+    if "score" in row:
+        return [row["score"], row["listing_id"]]
+    if "distance" in row:
+        return [row["distance"], row["listing_id"]]
+    return [row["listing_id"]]
 
+def search_listings(data, search_settings, search_options, page):
+    """runs a validated listings search and returns a page of rows as plain JSON data,
+    with the token of the next page or None if this is the last one"""
     embedding = None
     if 'embedding_text' in data: 
         embedding = get_embedding(data["embedding_text"])
-    # query = "SELECT name, description from airbnb_listings ORDER BY description_embedding <=> %s::vector LIMIT 5"
-    query_and_params = create_airbnb_select_query(data.get("query_params", {}), embedding)
-    print("query_and_params: ", query_and_params)
-    cur.execute(query_and_params["query"], query_and_params["params"])
-    rows = cur.fetchall()
-    # Optionally, convert to JSON
-    rows_json = json.dumps(rows, default=str)  # `default=str` to handle datetime and other non-serializable types
-    print(rows_json)
-    cur.close()
-    return jsonify({"data": rows_json, "status": "this is the response from the get listings endpoint"})
+
+    page_size, after, seen = page["page_size"], page["after"], page["seen"]
+    # the keyset of a later page is a condition on the rows like the filters
+    filtered = bool(data.get("query_params")) or data.get("dates") is not None or bool(after)
+    if after and len(after) != (2 if embedding is not None or search_options["mode"] == "hybrid" else 1):
+        raise ValueError("Invalid page_token")
+    query_and_params = build_listings_query(data, search_options, embedding, page_size, after, seen)
+    log("listings_query", query=query_and_params["query"], search_mode=search_options["mode"])
+    listing_ids = None
+    # the vector store doesn't know about bookings, searches for dates run in the database.
+    # It pages by the number of rows returned, its tokens have no sort key
+    vector_store = get_vector_store()
+    if vector_store is not None and search_options["mode"] != "hybrid" and data.get("dates") is None and not after:
+        with metrics.time("vector_store"):
+            listing_ids = vector_store.search(embedding, data.get("query_params") or {}, k=seen + page_size + 1)
+        if listing_ids is not None:
+            listing_ids = listing_ids[seen:]
+    if listing_ids is None and seen and not after:
+        raise ValueError("page_token has expired, search again")
+
+    # includes checking a connection out of the pool
+    with metrics.time("sql"), get_pool().cursor() as cur:
+        if listing_ids is not None:
+            cur.execute(LISTINGS_BY_ID_QUERY, [listing_ids])
+            rows_by_id = {row["listing_id"]: row for row in cur.fetchall()}
+            # keep the ranking from the vector store
+            rows = [rows_by_id[listing_id] for listing_id in listing_ids if listing_id in rows_by_id]
+        else:
+            apply_search_settings(cur, page_search_settings(search_settings, embedding, index_depth(search_options, page_size, seen), filtered))
+            if DB_PREPARED_STATEMENTS:
+                get_pool().execute_prepared(cur, query_and_params["query"], query_and_params["params"])
+            else:
+                cur.execute(query_and_params["query"], query_and_params["params"])
+            rows = cur.fetchall()
+
+    next_page_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last_key = sort_key(rows[-1]) if listing_ids is None else []
+        depth = search_options["fusion_depth"] if search_options["mode"] == "hybrid" else None
+        next_page_token = encode_page_token(last_key, seen + page_size, page["fingerprint"], depth)
+    with metrics.time("serialize"):
+        for row in rows:
+            row.pop("distance", None)
+        rows = to_json_data(rows)
+    log("listings_rows", rows=len(rows))
+    return {"data": rows, "next_page_token": next_page_token}
+
+def index_depth(search_options, page_size, seen):
+    """the most rows a page of a search reads from the vector index"""
+    if search_options["mode"] == "hybrid":
+        return search_options["fusion_depth"]
+    if search_options["mode"] in QUANTIZED_ORDER_BY:
+        # the candidate scan over the compact codes
+        return search_options["candidates"] + seen
+    return seen + page_size + 1
+
+def page_search_settings(search_settings, embedding, depth, filtered=False):
+    """the database settings of a search that reads `depth` rows.
+
+    The HNSW index returns at most hnsw.ef_search rows, so it is raised for pages deeper than that. Those rows are
+    only filtered afterwards, so a selective filter or a later page would come back short: filtered searches keep
+    scanning the index with pgvector 0.8 and later, and scan exactly with older versions.
+    """
+    if embedding is None or "enable_indexscan" in search_settings:
+        return search_settings
+    settings = dict(search_settings)
+    if filtered:
+        if get_pgvector_version() < ITERATIVE_SCAN_VERSION:
+            return {**settings, "enable_indexscan": "off"}
+        # strict_order keeps the exact distance order the page tokens rely on
+        settings.setdefault("hnsw.iterative_scan", "strict_order")
+        settings.setdefault("hnsw.max_scan_tuples", str(VECTOR_MAX_SCAN_TUPLES))
+    if "hnsw.ef_search" not in settings and depth > 40:
+        settings["hnsw.ef_search"] = str(min(depth, VECTOR_SEARCH_SETTINGS["ef_search"][2]))
+    return settings
+
+def listings_query_key(data):
+    """the parts of a listings request that determine its results, across all pages.
+    The embedding is fingerprinted by its normalized text, so a cache hit also skips generating the embedding.
+    """
+    return {
+        "query_params": data.get("query_params") or {},
+        "embedding": [EMBEDDING_MODEL, normalize_text(data["embedding_text"])] if 'embedding_text' in data else None,
+        "search_mode": data.get("search_mode", DEFAULT_SEARCH_MODE),
+        "search_params": data.get("search_params") or {},
+        "dates": data.get("dates"),
+    }
+
+def listings_cache_key(data):
+    """the parts of a listings request that determine its result"""
+    return {**listings_query_key(data), "page_size": data.get("page_size"), "page_token": data.get("page_token")}
+
+def parse_listings_request(data):
+    """validates a listings request, returns its search settings, search options and page"""
+    search_settings = parse_search_params(data.get("search_params"))
+    search_options = parse_search_options(data)
+    compile_filters(data.get("query_params"))
+    if data.get("dates") is not None:
+        parse_date_range(data["dates"])
+    fingerprint = query_fingerprint(listings_query_key(data))
+    after, seen, depth = decode_page_token(data["page_token"], fingerprint) if data.get("page_token") else (None, 0, None)
+    if depth is not None:
+        # HYBRID_FUSION_DEPTH may have changed since the first page
+        if search_options["mode"] != "hybrid" or not SEARCH_OPTIONS["fusion_depth"][2] <= depth <= SEARCH_OPTIONS["fusion_depth"][3]:
+            raise ValueError("Invalid page_token")
+        search_options["fusion_depth"] = depth
+    page = {"page_size": parse_page_size(data.get("page_size"), LISTINGS_PAGE_SIZE, MAX_LISTINGS_PAGE_SIZE),
+            "after": after, "seen": seen, "fingerprint": fingerprint}
+    return search_settings, search_options, page
+
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", 500))
+
+def stream_query(query, params, search_settings=None):
+    """yields the rows of a query as NDJSON lines. A server-side cursor fetches STREAM_FETCH_SIZE rows at a time,
+    so memory stays flat however many rows there are. A pooled connection is held until the stream ends."""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            apply_search_settings(cur, search_settings or {})
+        # named cursors are server-side cursors in psycopg2
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_FETCH_SIZE
+            cur.execute(query, params)
+            for row in cur:
+                row.pop("distance", None)
+                yield json.dumps(to_json_data(row)) + "\n"
+
+# service functions: the routes below wrap these in HTTP, the in-process transport in transport.py calls them directly.
+# They return plain JSON data and raise ValueError for invalid input
+
+def find_listings(data):
+    """validates and runs a listings search, serving repeated searches from the listings cache.
+    Returns {"data": rows, "next_page_token": token}, pass the token as "page_token" with the same search for the next page"""
+    # everything is validated up front, so that only valid searches are cached
+    search_settings, search_options, page = parse_listings_request(data)
+    if data.get("dates") is not None:
+        # availability changes with every booking, so these results aren't cached
+        return search_listings(data, search_settings, search_options, page)
+    return get_listings_cache().get_or_compute(listings_cache_key(data), lambda: search_listings(data, search_settings, search_options, page))
+
+def stream_listings(data):
+    """validates a listings search and returns a generator of all its rows as NDJSON lines, without pages or caching"""
+    search_settings, search_options, _ = parse_listings_request(data)
+    # every match is streamed, not only the candidates a page is cut from
+    search_options = {**search_options, "candidates": None, "fusion_depth": None}
+    embedding = get_embedding(data["embedding_text"]) if 'embedding_text' in data else None
+    query_and_params = build_listings_query(data, search_options, embedding, None)
+    if embedding is not None:
+        # every match is read, the vector index could only leave some out
+        search_settings = {**search_settings, "enable_indexscan": "off"}
+    return stream_query(query_and_params["query"], query_and_params["params"], search_settings)
+
+class BookingConflict(ValueError):
+    """raised when a listing is already booked for some of the requested dates"""
+
+def insert_booking(data):
+    """creates a booking and returns the new row, raises BookingConflict if it overlaps another booking of the listing"""
+    for key in ["listing_id", "customer_id"]:
+        if key not in data:
+            raise ValueError(f"Missing {key}")
+
+    # the insert is committed when the block exits, or rolled back if it raises
+    with metrics.time("sql"), get_pool().cursor() as cur:
+        if 'start_date' in data and 'end_date' in data:
+            start_date, end_date = parse_date_range(data)
+            # locking the listing serializes concurrent bookings of it, so two overlapping ones can't both pass the check
+            cur.execute("SELECT listing_id FROM airbnb_listings WHERE listing_id = %s FOR UPDATE", [data["listing_id"]])
+            if cur.fetchone() is None:
+                raise ValueError(f"Listing {data['listing_id']} does not exist")
+            cur.execute("SELECT start_date, end_date FROM bookings WHERE listing_id = %s AND end_date > %s AND start_date < %s LIMIT 1",
+                        [data["listing_id"], start_date, end_date])
+            conflict = cur.fetchone()
+            if conflict is not None:
+                raise BookingConflict(f"Listing {data['listing_id']} is already booked from {conflict['start_date']} to {conflict['end_date']}, "
+                                      "search for listings available on the requested dates instead")
+            query = "INSERT INTO bookings (listing_id, customer_id, start_date, end_date) VALUES(%s, %s, %s, %s) RETURNING *"
+            cur.execute(query, [data["listing_id"], data["customer_id"], start_date, end_date])
+        else:
+            query = "INSERT INTO bookings (listing_id, customer_id) VALUES(%s, %s) RETURNING *"
+            cur.execute(query, [data["listing_id"], data["customer_id"]])
+        row = cur.fetchone()
+    return to_json_data(row)
+
+def create_bookings_query(customer_id=None, after=None):
+    """the bookings of a customer, or of all customers when customer_id is None, by booking_id after `after`"""
+    if customer_id is None:
+        query = "select booking_id, airbnb_listings.name as listing_name from bookings JOIN airbnb_listings ON bookings.listing_id = airbnb_listings.listing_id"
+        conditions, params = [], []
+    else:
+        query = "select booking_id, customer_id, start_date, end_date, airbnb_listings.name as listing_name, airbnb_listings.price as listing_price, airbnb_listings.neighbourhood as listing_neighborhood from bookings JOIN airbnb_listings ON bookings.listing_id = airbnb_listings.listing_id"
+        conditions, params = ["customer_id = %s"], [customer_id]
+    if after is not None:
+        conditions.append("booking_id > %s")
+        params.append(after)
+    if conditions:
+        query += " where " + " AND ".join(conditions)
+    return query + " ORDER BY booking_id", params
+
+def find_bookings(customer_id=None, page_size=None, page_token=None):
+    """a page of the bookings of a customer, or of all customers when customer_id is None.
+    Returns {"data": rows, "next_page_token": token}"""
+    page_size = parse_page_size(page_size, BOOKINGS_PAGE_SIZE, MAX_BOOKINGS_PAGE_SIZE)
+    fingerprint = query_fingerprint("bookings", customer_id)
+    after = decode_page_token(page_token, fingerprint)[0] if page_token else [None]
+    if len(after) != 1 or not isinstance(after[0], (int, type(None))):
+        raise ValueError("Invalid page_token")
+    query, params = create_bookings_query(customer_id, after[0])
+
+    with metrics.time("sql"), get_pool().cursor() as cur:
+        cur.execute(query + f" LIMIT {page_size + 1}", params)
+        rows = cur.fetchall()
+    next_page_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_page_token = encode_page_token([rows[-1]["booking_id"]], 0, fingerprint)
+    with metrics.time("serialize"):
+        rows = to_json_data(rows)
+    log("bookings_rows", rows=len(rows))
+    return {"data": rows, "next_page_token": next_page_token}
+
+def stream_bookings(customer_id=None):
+    """a generator of all bookings of a customer, or of all customers, as NDJSON lines"""
+    query, params = create_bookings_query(customer_id)
+    return stream_query(query, params)
+
+def remove_booking(booking_id, customer_id):
+    """deletes a booking of a customer, returns [booking_id], or None if there was no such booking"""
+    query = "DELETE FROM bookings where booking_id = %s AND customer_id = %s RETURNING booking_id"
+    with metrics.time("sql"), get_pool().cursor(cursor_factory=None) as cur:
+        cur.execute(query, [booking_id, customer_id])
+        deleted_record = cur.fetchone()
+    return list(deleted_record) if deleted_record is not None else None
+
+@app.route('/api/listings', methods=['POST'])
+def get_listings():
+    data = request.get_json()  # Get data sent in request body
+    try:
+        if data.get("stream") is True:
+            # one listing per line, every match without pages
+            return Response(stream_with_context(stream_listings(data)), mimetype="application/x-ndjson")
+        page = find_listings(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return jsonify({**page, "status": "this is the response from the get listings endpoint"})
 
 @app.route('/api/bookings', methods=['POST'])
 def create_booking():
     data = request.get_json()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    if 'start_date' in data and 'end_date' in data:
-        query = "INSERT INTO bookings (listing_id, customer_id, start_date, end_date) VALUES(%s, %s, %s, %s) RETURNING *"
-        cur.execute(query, [data["listing_id"], data["customer_id"], data["start_date"], data["end_date"]])
-    else:
-        query = "INSERT INTO bookings (listing_id, customer_id) VALUES(%s, %s) RETURNING *"
-        cur.execute(query, [data["listing_id"], data["customer_id"]])
-    
-    rows = cur.fetchone()
-    rows_json = json.dumps(rows, default=str)
-    conn.commit()
-    cur.close()
-    return jsonify({"data": rows_json, "status": "this is the response from the bookings endpoint"})
+    try:
+        row = insert_booking(data)
+    except BookingConflict as e:
+        return {"error": str(e)}, 409
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return jsonify({"data": row, "status": "this is the response from the bookings endpoint"})
 
 @app.route('/api/bookings', methods=['GET'])
 def get_bookings():
     customer_id = request.args.get('customer_id', None, type=int)
-    if customer_id is None:
-        query = "select booking_id, airbnb_listings.name as listing_name from bookings JOIN airbnb_listings ON bookings.listing_id = airbnb_listings.listing_id;"
-    else:
-        query = "select booking_id, customer_id, start_date, end_date, airbnb_listings.name as listing_name, airbnb_listings.price as listing_price, airbnb_listings.neighbourhood as listing_neighborhood from bookings JOIN airbnb_listings ON bookings.listing_id = airbnb_listings.listing_id where customer_id = %s;"
-        params = [customer_id]
-
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    # Optionally, convert to JSON
-    rows_json = json.dumps(rows, default=str)  # `default=str` to handle datetime and other non-serializable types
-    print(rows_json)
-    cur.close()
-    return jsonify({"data": rows_json, "status": "this is the response from the get bookings endpoint"})
+    if request.args.get('stream') == 'true':
+        # one booking per line, all of them without pages
+        return Response(stream_with_context(stream_bookings(customer_id)), mimetype="application/x-ndjson")
+    try:
+        page = find_bookings(customer_id, request.args.get('page_size'), request.args.get('page_token'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return jsonify({**page, "status": "this is the response from the get bookings endpoint"})
 
 @app.route('/api/bookings/<int:booking_id>', methods=['DELETE'])
 def delete_booking(booking_id):
@@ -165,13 +656,56 @@ def delete_booking(booking_id):
     if customer_id is None:
         return {"error": "Missing customer_id query parameter"}, 400
     
-    cur = conn.cursor()
-    query = "DELETE FROM bookings where booking_id = %s AND customer_id = %s RETURNING booking_id"
-    cur.execute(query, [booking_id, customer_id])
-    deleted_record = cur.fetchone()
-    conn.commit()
-    cur.close()
+    deleted_record = remove_booking(booking_id, customer_id)
     return jsonify({"data": deleted_record, "status": "this is the response from the delete bookings endpoint"})
 
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(get_pool().stats())
+
+@app.route('/api/listings/refresh', methods=['POST'])
+def refresh_listings():
+    """call this after listings changed: invalidates cached search results and rebuilds the vector store.
+    Other workers reload the vector store on their next search. They only drop their cached results with
+    LISTINGS_CACHE_PATH, otherwise they keep serving them for up to LISTINGS_CACHE_TTL seconds.
+    """
+    if not LISTINGS_REFRESH_TOKEN:
+        return {"error": "Set LISTINGS_REFRESH_TOKEN to enable /api/listings/refresh"}, 403
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {LISTINGS_REFRESH_TOKEN}".encode()):
+        return {"error": "Missing or invalid refresh token"}, 401
+    get_listings_cache().invalidate()
+    scope = "all workers" if get_listings_cache().shared is not None else "this worker, set LISTINGS_CACHE_PATH for all workers"
+    vector_store = get_vector_store()
+    if vector_store is None:
+        return jsonify({"data": get_listings_cache().stats(), "status": f"invalidated cached listings of {scope}"})
+    count = vector_store.build(get_pool())
+    return jsonify({"data": vector_store.stats(), "status": f"refreshed {count} listings"})
+
+@app.route('/api/listings/cache/stats', methods=['GET'])
+def get_listings_cache_stats():
+    return jsonify(get_listings_cache().stats())
+
+@app.route('/api/embeddings/stats', methods=['GET'])
+def get_embedding_stats():
+    return jsonify(get_embedding_cache().stats())
+
+# liveness: the worker answers requests, whatever the state of the database
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# readiness: everything a request needs is built and the database answers, anything missing is built now
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    try:
+        warm_up()
+    except Exception as e:
+        return jsonify({"ready": False, "error": str(e)}), 503
+    return jsonify({"ready": True, "startup_ms": resource_stats()})
+
 if __name__ == '__main__':
+    try:
+        warm_up()
+    except Exception as e:
+        print("Warm-up failed, the server starts anyway and retries on the first request:", e)
     app.run(port=8000, debug=True)
\ No newline at end of file
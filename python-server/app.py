@@ -1,8 +1,20 @@
-from flask import Flask, jsonify, request
-from agent import handle_agent_input
+import os
+from flask import Flask, Response, jsonify, request, stream_with_context
+from agent import get_session_store, get_turn_cache, handle_agent_input, warm_up
 from flask_cors import CORS
+from streaming import stream_agent_run
+from backpressure import InflightLimiter
+from metrics import instrument_app
+from lazy import stats as resource_stats
 
 app = Flask(__name__)
+# each chat holds a slot until its response is sent or streamed, chats over CHAT_MAX_INFLIGHT per worker get a 429
+app.wsgi_app = InflightLimiter(app.wsgi_app, int(os.getenv("CHAT_MAX_INFLIGHT", 32)),
+                               exempt_paths=["/metrics", "/healthz", "/readyz", "/api/chat/cache/stats"], extra_headers=[("Access-Control-Allow-Origin", "*")])
+# trace ids, Server-Timing headers and latency per stage, scraped from /metrics. A scrape doesn't build anything
+instrument_app(app, lambda: {"inflight": app.wsgi_app.stats(),
+                             "sessions": get_session_store().stats() if get_session_store.built else {},
+                             "turn_cache": get_turn_cache().stats() if get_turn_cache.built and get_turn_cache() is not None else {}})
 
 CORS(app)
 
@@ -15,9 +27,45 @@ def home():
 @app.route('/api/chat', methods=['POST'])
 def chat():
     data = request.get_json()
-    result = handle_agent_input(data['input_val'])
-    response = {"output": result["output"]}
+    # each browser session keeps its own chat history
+    result = handle_agent_input(data['input_val'], data.get('session_id', 'default'))
+    response = {"output": result["output"], "token_usage": result.get("token_usage")}
     return jsonify(response)
 
+# Streams the agent run as Server-Sent Events: tool_start/tool_end, listings as soon as GetListings returns,
+# LLM tokens, and a final event with the same output as /api/chat
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json()
+    session_id = data.get('session_id', 'default')
+    events = stream_agent_run(lambda callbacks: handle_agent_input(data['input_val'], session_id, callbacks))
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/chat/cache/stats', methods=['GET'])
+def get_turn_cache_stats():
+    turn_cache = get_turn_cache()
+    if turn_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **turn_cache.stats()})
+
+# liveness: the worker answers requests
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# readiness: the agent and everything a chat needs are built, anything missing is built now
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    try:
+        warm_up()
+    except Exception as e:
+        return jsonify({"ready": False, "error": str(e)}), 503
+    return jsonify({"ready": True, "startup_ms": resource_stats()})
+
 if __name__ == '__main__':
+    try:
+        warm_up()
+    except Exception as e:
+        print("Warm-up failed, the server starts anyway and retries on the first request:", e)
     app.run(port=3000, debug=True)
@@ -0,0 +1,74 @@
+import json
+import threading
+
+
+class InflightLimiter:
+    """WSGI middleware that bounds the requests a worker process handles at once.
+
+    Requests over max_inflight are answered right away with 429 and a Retry-After header, instead of queueing
+    behind chats that can take many seconds. A request counts until its response body is closed, so streamed
+    responses hold their slot while they stream. Paths in exempt_paths, i.e. stats, are never rejected.
+    extra_headers are added to the 429 responses, which bypass the app, i.e. for CORS. max_inflight=0 disables the limit.
+    """
+
+    def __init__(self, app, max_inflight, retry_after=1, exempt_paths=(), extra_headers=()):
+        self.app = app
+        self.max_inflight = max_inflight
+        self.retry_after = retry_after
+        self.exempt_paths = set(exempt_paths)
+        self.extra_headers = list(extra_headers)
+        self._slots = threading.BoundedSemaphore(max_inflight) if max_inflight > 0 else None
+        self._lock = threading.Lock()
+        self._stats = {"inflight": 0, "peak_inflight": 0, "accepted": 0, "rejected": 0}
+
+    def __call__(self, environ, start_response):
+        if self._slots is None or environ.get("PATH_INFO") in self.exempt_paths:
+            return self.app(environ, start_response)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            body = json.dumps({"error": "The server is busy, please try again shortly"}).encode("utf-8")
+            start_response("429 Too Many Requests", [("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+                                                     ("Retry-After", str(self.retry_after))] + self.extra_headers)
+            return [body]
+
+        with self._lock:
+            self._stats["accepted"] += 1
+            self._stats["inflight"] += 1
+            self._stats["peak_inflight"] = max(self._stats["peak_inflight"], self._stats["inflight"])
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self._release()
+            raise
+        return ReleasingIterable(response, self._release)
+
+    def _release(self):
+        with self._lock:
+            self._stats["inflight"] -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {"max_inflight": self.max_inflight, **self._stats}
+
+
+class ReleasingIterable:
+    """passes a response body through and calls `release` once, when the server closes it"""
+
+    def __init__(self, response, release):
+        self.response = response
+        self.release = release
+        self._released = False
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, "close"):
+                self.response.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self.release()
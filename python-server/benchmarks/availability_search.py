@@ -0,0 +1,138 @@
+"""latency of listing searches for dates against a large bookings table, with the index from sql/availability.sql.
+
+Adds --bookings synthetic bookings (status 'benchmark', customer 1 from data.sql) spread over the past five years and
+the next one, unless that many are there already, then times searches for a stay next month. Run from the
+python-server directory:
+    python -m benchmarks.availability_search --bookings 5000000 --iterations 50
+Pass --cleanup to delete the synthetic bookings afterwards. Exits with a non-zero status if a search doesn't use the
+bookings index or its p95 is over --max-p95-ms.
+"""
+import argparse
+from datetime import date, timedelta
+import json
+import sys
+import time
+
+from dotenv import load_dotenv
+import numpy as np
+
+from db import ConnectionPool
+from filters import compile_availability, compile_filters
+
+SELECT = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings WHERE "
+BOOKINGS_INDEX = "bookings_listing_end_date_idx"
+BATCH = 500_000
+
+FILTERS = {
+    "dates only": {},
+    "dates, 3+ bedrooms, price <= 200": {"bedrooms": {"value": 3, "type": "number", "symbol": ">="},
+                                          "price": {"value": 200, "type": "currency", "symbol": "<="}},
+}
+
+
+def plan_indexes(plan):
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from plan_indexes(child)
+
+
+def uses_bookings_index(pool, query, params):
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return BOOKINGS_INDEX in set(plan_indexes(plan[0]["Plan"]))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def timed(pool, query, params, iterations):
+    latencies = []
+    for _ in range(iterations):
+        with pool.cursor(cursor_factory=None) as cur:
+            start = time.perf_counter()
+            cur.execute(query, params)
+            cur.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def seed_bookings(pool, count):
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT count(*) FROM bookings WHERE status = 'benchmark'")
+        existing = cur.fetchone()[0]
+    start = time.perf_counter()
+    while existing < count:
+        size = min(BATCH, count - existing)
+        with pool.cursor(cursor_factory=None) as cur:
+            # overlapping synthetic bookings are fine here, they only make the anti-join do more work
+            cur.execute("""
+                INSERT INTO bookings (listing_id, customer_id, start_date, end_date, status)
+                SELECT listing_id, 1, start_date, start_date + nights, 'benchmark' FROM (
+                    SELECT ids[1 + floor(random() * n)::int] AS listing_id,
+                        current_date - 1825 + floor(random() * 2190)::int AS start_date,
+                        1 + floor(random() * 14)::int AS nights
+                    FROM (SELECT array_agg(listing_id) AS ids, count(*) AS n FROM airbnb_listings) AS listings,
+                        generate_series(1, %s)) AS generated
+            """, [size])
+        existing += size
+        print(f"{existing} benchmark bookings, {existing / (time.perf_counter() - start):,.0f} rows/s", end="\r")
+    print()
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("ANALYZE bookings")
+        cur.execute("SELECT count(*) FROM bookings")
+        return cur.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-p95-ms", type=float, default=250)
+    parser.add_argument("--cleanup", action="store_true", help="delete the benchmark bookings at the end")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+    total = seed_bookings(pool, args.bookings)
+    print(f"{total} bookings in total")
+
+    start_date = date.today() + timedelta(days=30)
+    dates = {"start_date": start_date.isoformat(), "end_date": (start_date + timedelta(days=5)).isoformat()}
+    availability, availability_params = compile_availability(dates)
+    workloads = {}
+    for label, filters in FILTERS.items():
+        conditions, params = compile_filters(filters)
+        workloads[label] = (SELECT + " AND ".join(conditions + availability) + " LIMIT 5", params + availability_params)
+    # the semantic search has to check the availability of every listing it ranks
+    embedding = np.random.default_rng(0).standard_normal(1536)
+    workloads["dates, semantic search"] = (SELECT + availability[0] + " ORDER BY description_embedding <=> %s::vector LIMIT 5",
+                                           availability_params + ['[' + ','.join(map(str, embedding)) + ']'])
+
+    failures = []
+    for label, (query, params) in workloads.items():
+        indexed = uses_bookings_index(pool, query, params)
+        latencies = timed(pool, query, params, args.iterations)
+        p95 = percentile(latencies, 95)
+        print(f"{label:<36} index={indexed!s:<5}  p50={percentile(latencies, 50):.2f}ms  p95={p95:.2f}ms")
+        if not indexed:
+            failures.append(f"{label} doesn't use {BOOKINGS_INDEX}, run sql/availability.sql")
+        if p95 > args.max_p95_ms:
+            failures.append(f"{label} p95 is {p95:.0f}ms")
+
+    if args.cleanup:
+        with pool.cursor(cursor_factory=None) as cur:
+            cur.execute("DELETE FROM bookings WHERE status = 'benchmark'")
+        print("deleted the benchmark bookings")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""load test for a running app.py: how many concurrent chats it sustains per core.
+
+Start app.py with the fake providers, so the numbers measure the server and not OpenAI, i.e.
+    LLM_PROVIDER=fake EMBEDDING_PROVIDER=fake FAKE_LLM_LATENCY_MS=500 python app.py
+    LLM_PROVIDER=fake EMBEDDING_PROVIDER=fake FAKE_LLM_LATENCY_MS=500 python serve.py app --workers 4
+then, from the python-server directory:
+    python -m benchmarks.chat_load --concurrency 1,8,32,128 --duration 10
+Each level keeps that many chats open for --duration seconds. A level is sustained while no request fails and p95
+stays within --slo times the p50 of the first level. 429 responses from the in-flight limit count as rejected.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def client(url, deadline, results, lock):
+    session = requests.Session()
+    session_id = str(uuid.uuid4())
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.post(url, json={"input_val": "find me a quiet place to stay", "session_id": session_id}, timeout=120)
+            outcome = {200: "ok", 429: "rejected"}.get(response.status_code, "error")
+        except requests.RequestException:
+            outcome = "error"
+        latency = (time.perf_counter() - start) * 1000
+        with lock:
+            results[outcome].append(latency)
+        if outcome == "rejected":
+            time.sleep(0.1)
+
+
+def run_level(url, concurrency, duration):
+    results = {"ok": [], "rejected": [], "error": []}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client, url, deadline, results, lock)
+    return results, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:3000/api/chat")
+    parser.add_argument("--concurrency", default="1,8,32,128")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--slo", type=float, default=2.0)
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="cores available to the server")
+    args = parser.parse_args()
+
+    baseline = None
+    sustained = 0
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        results, elapsed = run_level(args.url, concurrency, args.duration)
+        ok = results["ok"]
+        if not ok:
+            print(f"concurrency={concurrency:<4} no successful chats, {len(results['rejected'])} rejected, {len(results['error'])} errors")
+            break
+        p50, p95 = percentile(ok, 50), percentile(ok, 95)
+        baseline = baseline or p50
+        print(f"concurrency={concurrency:<4} chats/s={len(ok) / elapsed:.1f}  p50={p50:.0f}ms  p95={p95:.0f}ms  "
+              f"rejected={len(results['rejected'])}  errors={len(results['error'])}")
+        if results["error"] or results["rejected"] or p95 > baseline * args.slo:
+            break
+        sustained = concurrency
+    print(f"sustained {sustained} concurrent chats on {args.cores} cores = {sustained / args.cores:.1f} per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""recall of filtered listing searches: every page of a search with filters, run on the vector index the way api.py
+runs it, against the same search as an exact scan.
+
+The HNSW index hands at most hnsw.ef_search rows to the WHERE conditions, so without the iterative scan from
+sql/vector_index.sql a selective filter finds only a few of its matches. Run from the python-server directory:
+    python -m benchmarks.filtered_recall --queries 20 --page-size 25
+    python -m benchmarks.filtered_recall --modes exact,halfvec,binary
+The halfvec and binary modes need sql/quantized_embeddings.sql, their candidate scans are compared the same way.
+Existing listing embeddings are used as queries, so no embedding provider is needed. Exits with a non-zero status if
+the recall of a search is below --min-recall or it returns fewer rows than the exact scan.
+"""
+import argparse
+import json
+import sys
+import time
+
+from benchmarks.availability_search import percentile
+
+SEARCHES = {
+    "Mission Bay, price <= 200": {"neighbourhood": {"value": "Mission Bay", "type": "text"},
+                                  "price": {"value": 200, "type": "currency", "symbol": "<="}},
+    "price >= 1000": {"price": {"value": 1000, "type": "currency", "symbol": ">="}},
+    "4+ bedrooms, superhost": {"bedrooms": {"value": 4, "type": "number", "symbol": ">="},
+                               "host_is_superhost": {"value": True, "type": "boolean"}},
+    "the ballpark, 1 km": {"location": {"type": "near", "value": "the ballpark", "radius_km": 1}},
+}
+EXACT = {"enable_indexscan": "off"}
+
+
+def search_ids(api, query_params, embedding, mode, page_size, max_pages, settings=None):
+    """(listing ids of all pages, ms per page) of a search, paging by sort key like api.search_listings.
+    Runs with the settings api.py picks for it unless `settings` are given"""
+    data = {"query_params": query_params}
+    options = api.parse_search_options({"search_mode": mode})
+    ids, latencies, after, seen = [], [], None, 0
+    for _ in range(max_pages):
+        query = api.build_listings_query(data, options, embedding, page_size, after, seen)
+        with api.get_pool().cursor() as cur:
+            start = time.perf_counter()
+            depth = api.index_depth(options, page_size, seen)
+            api.apply_search_settings(cur, settings or api.page_search_settings({}, embedding, depth, True))
+            cur.execute(query["query"], query["params"])
+            rows = cur.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+        ids += [row["listing_id"] for row in rows[:page_size]]
+        if len(rows) <= page_size:
+            break
+        after, seen = api.sort_key(rows[page_size - 1]), seen + page_size
+    return ids, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20, help="number of listings used as query vectors")
+    parser.add_argument("--page-size", type=int, default=25)
+    parser.add_argument("--pages", type=int, default=10, help="most pages read per search")
+    parser.add_argument("--modes", default="exact", help="comma separated search modes")
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    args = parser.parse_args()
+
+    # api.py loads the .env file on import
+    import api
+    print(f"pgvector {'.'.join(map(str, api.get_pgvector_version()))}, settings of a filtered search: "
+          f"{api.page_search_settings({}, [0.0], args.page_size + 1, True)}")
+    with api.get_pool().cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT description_embedding::text FROM airbnb_listings WHERE description_embedding IS NOT NULL "
+                    "ORDER BY random() LIMIT %s", [args.queries])
+        embeddings = [json.loads(row[0]) for row in cur.fetchall()]
+
+    failures = []
+    for mode in args.modes.split(","):
+        for label, query_params in SEARCHES.items():
+            recalls, latencies, exact_latencies, rows, exact_rows = [], [], [], 0, 0
+            for embedding in embeddings:
+                expected, elapsed = search_ids(api, query_params, embedding, mode, args.page_size, args.pages, EXACT)
+                exact_latencies += elapsed
+                ids, elapsed = search_ids(api, query_params, embedding, mode, args.page_size, args.pages)
+                latencies += elapsed
+                recalls.append(len(set(ids) & set(expected)) / len(expected) if expected else 1.0)
+                rows += len(ids)
+                exact_rows += len(expected)
+            recall = sum(recalls) / len(recalls)
+            print(f"{mode:<8} {label:<28} recall={recall:.3f}  rows={rows / len(embeddings):.0f} of "
+                  f"{exact_rows / len(embeddings):.0f}  p95={percentile(latencies, 95):.2f}ms  "
+                  f"exact p95={percentile(exact_latencies, 95):.2f}ms")
+            if recall < args.min_recall:
+                failures.append(f"{mode} {label} has a recall of {recall:.3f}")
+            if rows < exact_rows:
+                failures.append(f"{mode} {label} returns {exact_rows - rows} rows fewer than the exact scan")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""index usage and latency of filtered listing searches, before and after sql/filter_indexes.sql.
+
+Compares the old price::MONEY::NUMERIC predicate with the compiled filters from filters.py, and plain execution
+with server-side prepared statements. Run from the python-server directory:
+    python -m benchmarks.filtered_search --iterations 100
+Exits with a non-zero status if a compiled filter does not use an index.
+"""
+import argparse
+import json
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from db import ConnectionPool
+from filters import compile_filters
+
+SELECT = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings WHERE "
+
+# selective filters, where an index scan is the better plan
+WORKLOADS = {
+    "price >= 1000": {"price": {"value": 1000, "type": "currency", "symbol": ">="}},
+    "price = 150, 4+ bedrooms": {"price": {"value": 150, "type": "currency", "symbol": "="},
+                                 "bedrooms": {"value": 4, "type": "number", "symbol": ">="}},
+    "neighbourhood ~ Mission Bay": {"neighbourhood": {"value": "Mission Bay", "type": "text"}},
+}
+
+# the predicates create_airbnb_select_query used to generate for the same filters
+LEGACY = {
+    "price >= 1000": ("price::MONEY::NUMERIC >= %s", [1000]),
+    "price = 150, 4+ bedrooms": ("price::MONEY::NUMERIC = %s AND bedrooms >= %s", [150, 4]),
+    "neighbourhood ~ Mission Bay": ("neighbourhood %% %s", ["Mission Bay"]),
+}
+
+
+def plan_nodes(plan):
+    yield plan["Node Type"]
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def uses_index(pool, query, params):
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return any("Index" in node for node in plan_nodes(plan[0]["Plan"]))
+
+
+def timed(pool, query, params, iterations, prepared=False):
+    latencies = []
+    for _ in range(iterations):
+        with pool.cursor(cursor_factory=None) as cur:
+            start = time.perf_counter()
+            if prepared:
+                pool.execute_prepared(cur, query, params)
+            else:
+                cur.execute(query, params)
+            cur.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+
+    failures = []
+    for label, filters in WORKLOADS.items():
+        conditions, params = compile_filters(filters)
+        query = SELECT + " AND ".join(conditions) + " LIMIT 5"
+        legacy_condition, legacy_params = LEGACY[label]
+        legacy_query = SELECT + legacy_condition + " LIMIT 5"
+
+        indexed = uses_index(pool, query, params)
+        if not indexed:
+            failures.append(label)
+        print(f"{label}")
+        print(f"  before:   index={uses_index(pool, legacy_query, legacy_params)!s:<5}  "
+              f"p50={timed(pool, legacy_query, legacy_params, args.iterations):.2f}ms")
+        print(f"  after:    index={indexed!s:<5}  p50={timed(pool, query, params, args.iterations):.2f}ms")
+        print(f"  prepared: index={indexed!s:<5}  p50={timed(pool, query, params, args.iterations, prepared=True):.2f}ms")
+
+    if failures:
+        print(f"no index used for: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
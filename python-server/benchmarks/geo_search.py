@@ -0,0 +1,106 @@
+"""latency of "location" searches with the grid cell index from sql/geo_index.sql, against a full scan computing the
+distance of every listing.
+
+Seed a database with `python -m benchmarks.seed --scale 1M --indexes` (or load the dataset and run geo_index.sql),
+then from the python-server directory:
+    python -m benchmarks.geo_search --iterations 50
+Each search runs as compiled by filters.py and as a scan with only the exact distance condition, which must return
+the same listings. Exits with a non-zero status if they differ, if a radius search doesn't use the index, or if it is
+slower than the scan.
+"""
+import argparse
+import json
+import sys
+
+from dotenv import load_dotenv
+import numpy as np
+
+from benchmarks.availability_search import percentile, plan_indexes, timed
+from db import ConnectionPool
+from filters import HAVERSINE_KM, compile_filters
+from landmarks import resolve_landmark
+
+SELECT = "SELECT listing_id FROM airbnb_listings WHERE "
+LOCATION_INDEX = "airbnb_listings_location_cell_idx"
+
+SEARCHES = {
+    "Union Square, 0.5 km": {"location": {"type": "near", "value": "Union Square", "radius_km": 0.5}},
+    "the ballpark, 1 km": {"location": {"type": "near", "value": "the ballpark", "radius_km": 1}},
+    "Golden Gate Park, 3 km": {"location": {"type": "near", "value": "Golden Gate Park", "radius_km": 3}},
+    "Union Square, 1 km, price <= 200": {"location": {"type": "near", "value": "Union Square", "radius_km": 1},
+                                         "price": {"value": 200, "type": "currency", "symbol": "<="}},
+    "box around SoMa": {"location": {"type": "box", "value": {"south": 37.770, "west": -122.410, "north": 37.785, "east": -122.390}}},
+}
+
+
+def scan_condition(location):
+    """the same area without the cell and range conditions, so every listing is checked"""
+    if location["type"] == "box":
+        box = location["value"]
+        return ("latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s",
+                [box["south"], box["north"], box["west"], box["east"]])
+    latitude, longitude = resolve_landmark(location["value"])
+    return f"{HAVERSINE_KM} <= %s", [latitude, latitude, longitude, location["radius_km"]]
+
+
+def query_indexes(pool, query, params):
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return set(plan_indexes(plan[0]["Plan"]))
+
+
+def listing_ids(pool, query, params):
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute(query, params)
+        return {row[0] for row in cur.fetchall()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT count(*) FROM airbnb_listings")
+        print(f"{cur.fetchone()[0]} listings")
+
+    failures = []
+    for label, filters in SEARCHES.items():
+        conditions, params = compile_filters(filters)
+        indexed = (SELECT + " AND ".join(conditions), params)
+        other_conditions, other_params = compile_filters({key: value for key, value in filters.items() if key != "location"})
+        condition, condition_params = scan_condition(filters["location"])
+        scan = (SELECT + " AND ".join([condition] + other_conditions), condition_params + other_params)
+
+        matches = listing_ids(pool, *indexed)
+        if matches != listing_ids(pool, *scan):
+            failures.append(f"{label} returns other listings than the scan")
+        uses_index = LOCATION_INDEX in query_indexes(pool, *indexed)
+        if not uses_index and filters["location"]["type"] == "near":
+            failures.append(f"{label} doesn't use {LOCATION_INDEX}, run sql/geo_index.sql")
+        indexed_p95 = percentile(timed(pool, *indexed, args.iterations), 95)
+        scan_p95 = percentile(timed(pool, *scan, args.iterations), 95)
+        print(f"{label:<36} {len(matches):>6} listings  index={uses_index!s:<5}  p95={indexed_p95:.2f}ms  "
+              f"scan p95={scan_p95:.2f}ms  ({scan_p95 / indexed_p95:.1f}x)")
+        if uses_index and indexed_p95 > scan_p95:
+            failures.append(f"{label} is slower with the index than the scan")
+
+    # the location filter and the vector ranking in one query
+    conditions, params = compile_filters(SEARCHES["the ballpark, 1 km"])
+    embedding = '[' + ','.join(map(str, np.random.default_rng(0).standard_normal(1536))) + ']'
+    query = SELECT + " AND ".join(conditions) + " ORDER BY description_embedding <=> %s::vector LIMIT 5"
+    latencies = timed(pool, query, params + [embedding], args.iterations)
+    print(f"{'the ballpark, 1 km, semantic search':<36} p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""hit ratio and latency savings of the listings result cache on a skewed, repeating workload.
+
+Replays GetListings-style requests where a few popular searches dominate, once with the cache disabled and once
+enabled, through the Flask test client. Uses the fake embedding provider unless EMBEDDING_PROVIDER is set.
+Run from the python-server directory against a loaded database:
+    python -m benchmarks.listings_cache --requests 500
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+
+import api  # noqa: E402
+
+SEARCHES = [
+    {"query_params": {"neighbourhood": {"value": "Mission District", "type": "text"},
+                      "price": {"value": 200, "type": "currency", "symbol": "<="}},
+     "embedding_text": "place near dining and nightlife"},
+    {"query_params": {"neighbourhood": {"value": "SoMa", "type": "text"}}, "embedding_text": "quiet studio for work"},
+    {"query_params": {"bedrooms": {"value": 3, "type": "number", "symbol": ">="}}, "embedding_text": "family friendly house"},
+    {"query_params": {}, "embedding_text": "view of the golden gate bridge"},
+    {"query_params": {"price": {"value": 100, "type": "currency", "symbol": "<="}}, "embedding_text": "cheap room"},
+    {"query_params": {"neighbourhood": {"value": "Noe Valley", "type": "text"}}, "embedding_text": "garden and parking"},
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(client, workload):
+    latencies = []
+    for body in workload:
+        start = time.perf_counter()
+        response = client.post("/api/listings", json=body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # zipf-like popularity, the first searches are requested far more often than the last
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(len(SEARCHES))]
+    workload = rng.choices(SEARCHES, weights=weights, k=args.requests)
+    client = api.app.test_client()
+
+    max_entries = api.get_listings_cache().max_entries
+    api.get_listings_cache().max_entries = 0
+    uncached = run(client, workload)
+    api.get_listings_cache().max_entries = max_entries
+    api.get_listings_cache().invalidate()
+    cached = run(client, workload)
+
+    stats = api.get_listings_cache().stats()
+    print(f"uncached  p50={percentile(uncached, 50):.2f}ms  p95={percentile(uncached, 95):.2f}ms  "
+          f"total={sum(uncached):.0f}ms")
+    print(f"cached    p50={percentile(cached, 50):.2f}ms  p95={percentile(cached, 95):.2f}ms  "
+          f"total={sum(cached):.0f}ms")
+    print(f"hit ratio={stats['hit_ratio']:.3f}  saved={stats['saved_ms']:.0f}ms of database and embedding time")
+
+
+if __name__ == "__main__":
+    main()
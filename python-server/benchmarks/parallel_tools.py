@@ -0,0 +1,92 @@
+"""step latency of ParallelAgentExecutor compared to AgentExecutor, with tools that sleep instead of doing I/O.
+
+A scripted agent asks for all the tool calls in one step and then finishes, so no LLM or database is needed.
+Read-only calls should take about as long as the slowest one in parallel mode, and as long as their sum
+serially. Bookings are still run one at a time, and a tool slower than --timeout is reported as timed out.
+Run from the python-server directory:
+    python -m benchmarks.parallel_tools --calls 4 --delay 0.2
+"""
+import argparse
+import time
+
+from langchain.agents import AgentExecutor, BaseMultiActionAgent
+from langchain.tools import StructuredTool
+from langchain_core.agents import AgentAction, AgentFinish
+
+from parallel_executor import ParallelAgentExecutor
+
+
+class ScriptedAgent(BaseMultiActionAgent):
+    """asks for `actions` in the first step and returns the observations in the second"""
+
+    actions: list
+
+    @property
+    def input_keys(self):
+        return ["input"]
+
+    def plan(self, intermediate_steps, callbacks=None, **kwargs):
+        if intermediate_steps:
+            return AgentFinish({"output": [observation for _, observation in intermediate_steps]}, "")
+        return [AgentAction(tool, tool_input, "") for tool, tool_input in self.actions]
+
+    async def aplan(self, intermediate_steps, callbacks=None, **kwargs):
+        return self.plan(intermediate_steps, callbacks, **kwargs)
+
+
+def sleep_tool(name, log):
+    def run(seconds: float, label: str):
+        start = time.perf_counter()
+        time.sleep(seconds)
+        log.append((name, start, time.perf_counter()))
+        return label
+    return StructuredTool.from_function(func=run, name=name, description=f"sleeps, standing in for {name}")
+
+
+def run_step(executor_class, actions, log, **kwargs):
+    tools = [sleep_tool(name, log) for name in ["GetListings", "TavilySearch", "CreateBooking"]]
+    executor = executor_class(agent=ScriptedAgent(actions=actions), tools=tools, **kwargs)
+    start = time.perf_counter()
+    output = executor.invoke({"input": ""})["output"]
+    return (time.perf_counter() - start) * 1000, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=4, help="read-only tool calls in the step")
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds each tool sleeps")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    # different delays, so that finishing order differs from call order
+    actions = [("GetListings" if i % 2 == 0 else "TavilySearch", {"seconds": args.delay * (1 + i % 3) / 2, "label": f"call {i}"})
+               for i in range(args.calls)]
+    labels = [tool_input["label"] for _, tool_input in actions]
+    expected_serial = sum(tool_input["seconds"] for _, tool_input in actions) * 1000
+    expected_parallel = max(tool_input["seconds"] for _, tool_input in actions) * 1000
+
+    serial_ms, output = run_step(AgentExecutor, actions, [])
+    assert output == labels, output
+    parallel_ms, output = run_step(ParallelAgentExecutor, actions, [], max_parallel_tools=args.calls)
+    assert output == labels, output
+    print(f"{args.calls} read-only calls  serial={serial_ms:.0f}ms (sum {expected_serial:.0f}ms)  "
+          f"parallel={parallel_ms:.0f}ms (max {expected_parallel:.0f}ms)")
+
+    # bookings split the step: reads before, the bookings one at a time, then reads after
+    log = []
+    booking_actions = [actions[0], ("CreateBooking", {"seconds": args.delay, "label": "booking 1"}),
+                       ("CreateBooking", {"seconds": args.delay, "label": "booking 2"}), actions[1]]
+    parallel_ms, output = run_step(ParallelAgentExecutor, booking_actions, log)
+    assert output == [tool_input["label"] for _, tool_input in booking_actions], output
+    bookings = [(start, end) for name, start, end in log if name == "CreateBooking"]
+    assert bookings[0][1] <= bookings[1][0], "bookings overlapped"
+    print(f"reads around 2 bookings  parallel={parallel_ms:.0f}ms, bookings ran one after another")
+
+    slow_actions = [("GetListings", {"seconds": args.timeout * 2, "label": "slow"}), actions[0]]
+    parallel_ms, output = run_step(ParallelAgentExecutor, slow_actions, [], tool_timeout=args.timeout)
+    assert "did not respond" in output[0] and output[1] == actions[0][1]["label"], output
+    print(f"slow tool with a {args.timeout}s timeout  step took {parallel_ms:.0f}ms: {output[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""load test of the connection pool in db.py: many threads checking out connections for short queries at once.
+
+Runs --threads threads against a pool of DB_POOL_MAX connections (or --maxconn), each running --iterations
+queries that hold their connection for --hold-ms. Run from the python-server directory:
+    python -m benchmarks.pool_load --threads 50 --maxconn 10 --iterations 200
+Reports throughput, checkout wait and query latency percentiles, and the pool stats. Exits with a non-zero status if
+a checkout times out, the pool opens more than maxconn connections or keeps one checked out after the load, or the
+median or p99 wait is longer than the queueing of --threads on maxconn connections explains, i.e. some threads starve.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from benchmarks.availability_search import percentile
+from db import ConnectionPool, PoolTimeout
+
+
+def worker(pool, iterations, hold_seconds, waits, latencies, errors):
+    for _ in range(iterations):
+        start = time.perf_counter()
+        try:
+            conn = pool.getconn()
+        except PoolTimeout as e:
+            errors.append(str(e))
+            continue
+        waited = time.perf_counter() - start
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_sleep(%s)", [hold_seconds])
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+        waits.append(waited * 1000)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--maxconn", type=int, default=int(os.getenv("DB_POOL_MAX", 10)))
+    parser.add_argument("--iterations", type=int, default=200, help="queries per thread")
+    parser.add_argument("--hold-ms", type=float, default=5, help="how long each query holds its connection")
+    parser.add_argument("--timeout", type=float, default=30, help="DB_POOL_TIMEOUT of the pool")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env(maxconn=args.maxconn, timeout=args.timeout)
+    waits, latencies, errors = [], [], []
+    threads = [threading.Thread(target=worker, args=(pool, args.iterations, args.hold_ms / 1000, waits, latencies, errors))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stats = pool.stats()
+    pool.closeall()
+
+    print(f"{len(latencies)} queries from {args.threads} threads on {args.maxconn} connections in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed:,.0f}/s)")
+    if latencies:
+        print(f"wait     p50={percentile(waits, 50):.2f}ms  p95={percentile(waits, 95):.2f}ms  p99={percentile(waits, 99):.2f}ms")
+        print(f"latency  p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms  p99={percentile(latencies, 99):.2f}ms")
+    print(f"pool     connects={stats['connects']}  discarded={stats['discarded']}  timeouts={stats['timeouts']}  "
+          f"per host={stats['connections_per_host']}")
+
+    failures = []
+    if errors:
+        failures.append(f"{len(errors)} checkouts timed out, i.e. {errors[0]}")
+    if stats["connects"] - stats["discarded"] > args.maxconn:
+        failures.append(f"the pool opened {stats['connects']} connections for maxconn={args.maxconn}")
+    if stats["in_use"] != 0:
+        failures.append(f"{stats['in_use']} connections are still checked out after the load")
+    if latencies:
+        # with more threads than connections, a checkout waits for the threads queued ahead of it on each connection
+        service = percentile(latencies, 50) - percentile(waits, 50)
+        expected_wait = max(args.threads / args.maxconn - 1, 0) * service
+        if percentile(waits, 50) > 2 * expected_wait + args.hold_ms:
+            failures.append(f"the median wait of {percentile(waits, 50):.1f}ms is longer than {expected_wait:.1f}ms of queueing")
+        # checkouts are served in order, no thread should wait much longer than the others
+        if percentile(waits, 99) > 3 * expected_wait + 10 * args.hold_ms:
+            failures.append(f"the p99 wait of {percentile(waits, 99):.1f}ms is longer than {expected_wait:.1f}ms of queueing, "
+                            "threads are starved")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
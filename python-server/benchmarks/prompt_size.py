@@ -0,0 +1,62 @@
+"""prompt size regression check: fails if the system message or history of typical turns grows past a threshold.
+
+Builds the system message for a set of representative turns and replays a long conversation through the session
+store, printing the tokens per section. Exits with status 1 if any prompt is over --max-system-tokens or any history
+over --max-history-tokens, so it can run in CI. No database or LLM is needed.
+Run from the python-server directory:
+    python -m benchmarks.prompt_size
+"""
+import argparse
+import sys
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from prompt_builder import PromptBuilder, history_tokens
+from session_store import SessionStore
+
+TURNS = [
+    "find me a cheap place in the mission near nightlife",
+    "what neighborhoods are good for families?",
+    "2 bedroom house with parking and good reviews in noe valley",
+    "somewhere within walking distance of the ballpark under $250",
+    "book the second one from 2024-05-01 to 2024-05-04",
+    "show my bookings",
+    "cancel booking 12",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-system-tokens", type=int, default=900)
+    parser.add_argument("--max-history-tokens", type=int, default=2200)
+    parser.add_argument("--budget", type=int, default=1200, help="PROMPT_TOKEN_BUDGET of the builder")
+    args = parser.parse_args()
+
+    failures = []
+    builder = PromptBuilder(token_budget=args.budget)
+    for turn in TURNS:
+        _, report = builder.build(turn)
+        sections = "  ".join(f"{name}={tokens}" for name, tokens in report["sections"].items())
+        print(f"{report['total']:>5} tokens  {turn!r:<64} {sections}")
+        if report["total"] > args.max_system_tokens:
+            failures.append(f"system message for {turn!r} takes {report['total']} tokens")
+
+    # a long session: the history stays within its budget, with the older turns summarized
+    store = SessionStore(token_budget=2000, summary_budget=200)
+    for i in range(40):
+        store.append("check", HumanMessage(content=f"{TURNS[i % len(TURNS)]}, take {i}"),
+                     AIMessage(content='{"summary": "' + "Here are some listings that match what you asked for. " * 4 + '", "results_to_display": []}'),
+                     AIMessage(content=f"These are the corresponding listing IDs for the returned listings: {[{'listing_id': i * 10 + j} for j in range(5)]}"))
+    history = store.get_history("check")
+    tokens = history_tokens(history)
+    print(f"{tokens:>5} tokens  history of 40 turns, {len(history)} messages, summary: {history[0].content[:80]!r}...")
+    if tokens > args.max_history_tokens:
+        failures.append(f"history takes {tokens} tokens")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
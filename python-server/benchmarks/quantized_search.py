@@ -0,0 +1,88 @@
+"""memory footprint, latency and recall@5 of the halfvec and binary search modes compared to exact search.
+
+Run from the python-server directory after sql/quantized_embeddings.sql:
+    python -m benchmarks.quantized_search --queries 50 --candidates 20,50,100
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from db import ConnectionPool
+
+EXACT_QUERY = "SELECT listing_id FROM airbnb_listings ORDER BY description_embedding <=> %s::vector LIMIT 5"
+# same shape as the two stage query built by api.create_airbnb_select_query
+RERANK_QUERY = ("SELECT listing_id FROM (SELECT listing_id, description_embedding FROM airbnb_listings "
+                "ORDER BY {order_by} LIMIT %s) AS candidates ORDER BY description_embedding <=> %s::vector LIMIT 5")
+ORDER_BY = {
+    "halfvec": "description_embedding_half <=> %s::vector::halfvec(1536)",
+    "binary": "description_embedding_bits <~> binary_quantize(%s::vector)::bit(1536)",
+}
+FOOTPRINT_QUERY = """
+SELECT
+    sum(pg_column_size(description_embedding)),
+    sum(pg_column_size(description_embedding_half)),
+    sum(pg_column_size(description_embedding_bits))
+FROM airbnb_listings
+"""
+INDEX_SIZE_QUERY = """
+SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes
+WHERE relname = 'airbnb_listings' AND indexrelname LIKE 'airbnb_listings_description_embedding%%'
+"""
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def timed_ids(pool, query, params):
+    with pool.cursor(cursor_factory=None) as cur:
+        start = time.perf_counter()
+        cur.execute(query, params)
+        ids = [row[0] for row in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--candidates", default="20,50,100", help="comma separated numbers of candidates to re-rank")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute(FOOTPRINT_QUERY)
+        full, half, bits = cur.fetchone()
+        print(f"column size: vector={full / 2**20:.1f}MB  halfvec={half / 2**20:.1f}MB  bit={bits / 2**20:.1f}MB")
+        cur.execute(INDEX_SIZE_QUERY)
+        for name, size in cur.fetchall():
+            print(f"index size: {name}={size / 2**20:.1f}MB")
+        cur.execute("SELECT description_embedding::text FROM airbnb_listings WHERE description_embedding IS NOT NULL "
+                    "ORDER BY random() LIMIT %s", [args.queries])
+        embeddings = [row[0] for row in cur.fetchall()]
+
+    exact_results = []
+    latencies = []
+    for embedding in embeddings:
+        ids, elapsed = timed_ids(pool, EXACT_QUERY, [embedding])
+        exact_results.append(ids)
+        latencies.append(elapsed)
+    print(f"{'exact':<24} recall@5=1.000  p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+    for mode, order_by in ORDER_BY.items():
+        for candidates in map(int, filter(None, args.candidates.split(","))):
+            recalls = []
+            latencies = []
+            for embedding, expected in zip(embeddings, exact_results):
+                ids, elapsed = timed_ids(pool, RERANK_QUERY.format(order_by=order_by), [embedding, candidates, embedding])
+                recalls.append(len(set(ids) & set(expected)) / 5)
+                latencies.append(elapsed)
+            print(f"{f'{mode} ({candidates} candidates)':<24} recall@5={sum(recalls) / len(recalls):.3f}  "
+                  f"p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
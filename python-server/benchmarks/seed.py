@@ -0,0 +1,209 @@
+"""seeds a local Postgres + pgvector database with synthetic listings for benchmarks and load tests.
+
+Start a throwaway database and point the DB_* variables of .env at it, i.e.
+    docker run -d --name pgvector -p 5432:5432 -e POSTGRES_PASSWORD=password pgvector/pgvector:pg16
+then, from the python-server directory:
+    python -m benchmarks.seed --scale 100k --indexes
+This runs sql/schema.sql and sql/data.sql, which DROP the existing tables, and loads --scale listings (10k, 100k, 1M
+or a number) with COPY. Every NOT NULL column of schema.sql gets a value, the ones the agent searches on are
+realistic: neighbourhoods, prices, bedrooms, room types and descriptions built from templates, with embeddings
+clustered per description template. The same --seed always produces the same rows. --indexes applies
+filter_indexes.sql, vector_index.sql, hybrid_search.sql and geo_index.sql after loading, which is faster than indexing
+row by row.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+import numpy as np
+import psycopg2
+
+from load_listings import listing_columns
+from prompt_builder import NEIGHBOURHOODS
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sql")
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DIMENSIONS = 1536
+
+PROPERTY_TYPES = ("Apartment", "House", "Condominium", "Guest suite", "Loft", "Townhouse", "Bungalow")
+ROOM_TYPES = ("Entire home/apt", "Private room", "Shared room")
+ADJECTIVES = ("Sunny", "Quiet", "Cozy", "Modern", "Spacious", "Charming", "Bright", "Stylish")
+FEATURES = ("close to dining and nightlife", "with a garden and free parking", "with a dedicated desk for remote work",
+            "with views of the bay", "steps from public transit", "perfect for families with kids",
+            "near parks and hiking trails", "with a rooftop deck")
+AMENITIES = '{Wifi,Kitchen,"Free parking on premises",Heating,Washer,Dryer,"Laptop friendly workspace",TV}'
+
+# values of the NOT NULL columns without a generator below, by type. Not empty, an empty CSV field is NULL
+TYPE_DEFAULTS = (("bigint", 0), ("integer", 0), ("decimal", 0), ("boolean", "f"),
+                 ("timestamp", "2024-01-01 00:00:00"), ("varchar", "none"), ("text", "none"))
+
+
+def type_default(column_type):
+    for prefix, value in TYPE_DEFAULTS:
+        if column_type.startswith(prefix):
+            return value
+    raise ValueError(f"No default for column type {column_type}")
+
+
+# one % operation per vector is about twice as fast as formatting each number
+VECTOR_FORMAT = "[" + ",".join(["%.5f"] * DIMENSIONS) + "]"
+
+
+def format_vector(vector):
+    return VECTOR_FORMAT % tuple(vector.tolist())
+
+
+class ListingGenerator:
+    """generates batches of synthetic listings as dicts of column values"""
+
+    def __init__(self, seed=42):
+        self.rng = np.random.default_rng(seed)
+        # one centroid per (adjective, feature) template, so similar descriptions have similar embeddings
+        self.centroids = self.rng.standard_normal((len(ADJECTIVES) * len(FEATURES), DIMENSIONS)).astype(np.float32)
+        self.centroids /= np.linalg.norm(self.centroids, axis=1, keepdims=True)
+
+    def batch(self, first_id, size):
+        rng = self.rng
+        templates = rng.integers(0, len(self.centroids), size)
+        embeddings = self.centroids[templates] + rng.standard_normal((size, DIMENSIONS)).astype(np.float32) * 0.02
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        neighbourhoods = rng.integers(0, len(NEIGHBOURHOODS), size)
+        property_types = rng.integers(0, len(PROPERTY_TYPES), size)
+        room_types = rng.choice(len(ROOM_TYPES), size, p=(0.6, 0.35, 0.05))
+        bedrooms = rng.integers(0, 5, size)
+        prices = np.round(rng.lognormal(5.0, 0.6, size)).clip(20, 9999)
+        ratings = rng.integers(60, 101, size)
+        reviews = rng.poisson(30, size)
+        latitudes = rng.uniform(37.70, 37.81, size)
+        longitudes = rng.uniform(-122.51, -122.37, size)
+
+        for i in range(size):
+            listing_id = first_id + i
+            adjective = ADJECTIVES[templates[i] // len(FEATURES)]
+            feature = FEATURES[templates[i] % len(FEATURES)]
+            neighbourhood = NEIGHBOURHOODS[neighbourhoods[i]]
+            property_type = PROPERTY_TYPES[property_types[i]]
+            name = f"{adjective} {property_type.lower()} in {neighbourhood}"
+            yield {
+                "listing_id": listing_id,
+                "listing_url": f"https://www.airbnb.com/rooms/{listing_id}",
+                "name": name,
+                "summary": name,
+                "description": f"{name} {feature}. Sleeps {int(bedrooms[i]) * 2 + 1}, {int(bedrooms[i])} bedrooms.",
+                "picture_url": f"https://example.com/pictures/{listing_id}.jpg",
+                "host_id": listing_id % 50_000 + 1,
+                "host_name": f"Host {listing_id % 50_000 + 1}",
+                "host_response_time": "within an hour",
+                "host_response_rate": "100%",
+                "street": f"{neighbourhood}, San Francisco, CA, United States",
+                "neighbourhood": neighbourhood,
+                "neighbourhood_cleansed": neighbourhood,
+                "city": "San Francisco",
+                "state": "CA",
+                "smart_location": "San Francisco, CA",
+                "country_code": "US",
+                "country": "United States",
+                "latitude": f"{latitudes[i]:.5f}",
+                "longitude": f"{longitudes[i]:.5f}",
+                "property_type": property_type,
+                "room_type": ROOM_TYPES[room_types[i]],
+                "accommodates": int(bedrooms[i]) * 2 + 1,
+                "bathrooms": max(1, int(bedrooms[i])),
+                "bedrooms": int(bedrooms[i]),
+                "beds": max(1, int(bedrooms[i])),
+                "bed_type": "Real Bed",
+                "amenities": AMENITIES,
+                "price": f"${int(prices[i]):,}.00",
+                "guests_included": 1,
+                "extra_people": "$0.00",
+                "minimum_nights": 1,
+                "maximum_nights": 365,
+                "has_availability": "t",
+                "availability_365": 200,
+                "number_of_reviews": int(reviews[i]),
+                "review_scores_rating": int(ratings[i]) if reviews[i] else None,
+                "cancellation_policy": "moderate",
+                "description_embedding": format_vector(embeddings[i]),
+            }
+
+
+def run_sql_file(conn, name):
+    with open(os.path.join(SQL_DIR, name)) as f:
+        statements = f.read()
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(statements)
+    conn.commit()
+    print(f"applied {name} in {time.perf_counter() - start:.1f}s")
+
+
+def load_listings(conn, rows, batch_size, seed):
+    """COPYs `rows` synthetic listings in batches of batch_size, returning the rows per second"""
+    # generated columns and the NOT NULL columns of the schema, named explicitly since the migrations add columns
+    columns = listing_columns()
+    generator = ListingGenerator(seed)
+    sample = next(ListingGenerator(seed).batch(1, 1))
+    names = [name for name, _, not_null in columns if not_null or name in sample]
+    defaults = {name: type_default(column_type) for name, column_type, not_null in columns if not_null}
+    copy = f"COPY airbnb_listings ({','.join(names)}) FROM STDIN WITH (FORMAT csv)"
+
+    start = time.perf_counter()
+    loaded = 0
+    while loaded < rows:
+        size = min(batch_size, rows - loaded)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for listing in generator.batch(loaded + 1, size):
+            writer.writerow([listing[name] if name in listing else defaults[name] for name in names])
+        buffer.seek(0)
+        with conn.cursor() as cursor:
+            cursor.copy_expert(copy, buffer)
+        conn.commit()
+        loaded += size
+        elapsed = time.perf_counter() - start
+        print(f"{loaded:>9} listings  {loaded / elapsed:,.0f} rows/s", end="\r")
+    print()
+    return rows / (time.perf_counter() - start)
+
+
+def parse_scale(value):
+    value = value.lower()
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", default="10k", help="10k, 100k, 1M or a number of listings")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--indexes", action="store_true", help="apply the filter, vector, full-text and location index migrations")
+    args = parser.parse_args()
+
+    load_dotenv()
+    rows = parse_scale(args.scale)
+    conn = psycopg2.connect(dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USERNAME"), password=os.getenv("DB_PASSWORD"),
+                            host=os.getenv("DB_HOST", "localhost").split(",")[0].split(":")[0], port=os.getenv("DB_PORT", 5432))
+    try:
+        run_sql_file(conn, "schema.sql")
+        run_sql_file(conn, "data.sql")
+        rate = load_listings(conn, rows, args.batch_size, args.seed)
+        print(f"loaded {rows} listings at {rate:,.0f} rows/s")
+        if args.indexes:
+            for name in ("filter_indexes.sql", "vector_index.sql", "hybrid_search.sql", "geo_index.sql"):
+                run_sql_file(conn, name)
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE airbnb_listings")
+        conn.commit()
+    except psycopg2.Error as e:
+        print("Failed to seed the database:", e)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""isolation and memory of the chat session store in session_store.py.
+
+Isolation: --threads threads chat in their own sessions through two stores sharing one backend, like two workers,
+and every history must hold exactly the messages of its session, in order. All threads also append to a few shared
+sessions at once, which both stores must then read back alike with every message once, and which a new store must
+read back the same when --threads threads ask it for them at once, like a double submit.
+Memory: an in-memory store with CHAT_MAX_SESSIONS=--sessions is filled, then --rounds more rounds of as many new
+sessions go through it. Once it is full, the traced memory must not grow by more than --max-growth-mb.
+Run from the python-server directory:
+    python -m benchmarks.session_store --sessions 10000
+    python -m benchmarks.session_store --backend postgres
+The postgres backend uses the chat_messages table from sql/schema.sql and deletes its sessions at the end.
+Exits with a non-zero status if a check fails.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage
+
+from session_store import PostgresSessionBackend, SessionStore, SQLiteSessionBackend
+
+PREFIX = "benchmark-"
+
+
+def stores(backend_name, max_messages):
+    """two stores sharing a backend, or one in-memory store twice"""
+    if backend_name == "memory":
+        store = SessionStore(max_messages=max_messages, token_budget=10**9, summary_budget=0)
+        return [store, store]
+    if backend_name == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(), "chat_sessions.sqlite3")
+        backends = [SQLiteSessionBackend(path), SQLiteSessionBackend(path)]
+    else:
+        from db import get_pool
+        backends = [PostgresSessionBackend(get_pool())] * 2
+    return [SessionStore(max_messages=max_messages, token_budget=10**9, summary_budget=0, backend=backend)
+            for backend in backends]
+
+
+class SlowBackend:
+    """a backend whose reads take --read-ms, like a database across the network, so concurrent reads overlap"""
+
+    def __init__(self, backend, read_seconds):
+        self.backend = backend
+        self.read_seconds = read_seconds
+
+    def load(self, session_id, after_seq, limit):
+        rows = self.backend.load(session_id, after_seq, limit)
+        time.sleep(self.read_seconds)
+        return rows
+
+    def append(self, session_id, messages):
+        self.backend.append(session_id, messages)
+
+
+def contents(store, session_id):
+    return [message.content for message in store.get_history(session_id)]
+
+
+def chat(pair, thread, sessions, turns, shared, failures):
+    """alternates the stores turn by turn, checking that each one sees the whole session so far"""
+    for turn in range(turns):
+        for index in range(sessions):
+            session_id = f"{PREFIX}{thread}-{index}"
+            writer, reader = pair[turn % 2], pair[(turn + 1) % 2]
+            writer.append(session_id, HumanMessage(content=f"{session_id} q{turn}"), AIMessage(content=f"{session_id} a{turn}"))
+            expected = [f"{session_id} {kind}{earlier}" for earlier in range(turn + 1) for kind in "qa"]
+            if contents(reader, session_id) != expected:
+                failures.append(f"{session_id} has other messages than its own after turn {turn}")
+                return
+        for session_id in shared:
+            pair[turn % 2].append(session_id, HumanMessage(content=f"{thread} {turn}"))
+
+
+def check_isolation(backend_name, threads, sessions, turns, shared_sessions, read_seconds):
+    shared = [f"{PREFIX}shared-{index}" for index in range(shared_sessions)]
+    pair = stores(backend_name, max(2 * turns, threads * turns))
+    failures = []
+    workers = [threading.Thread(target=chat, args=(pair, thread, sessions, turns, shared, failures))
+               for thread in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    expected = sorted(f"{thread} {turn}" for thread in range(threads) for turn in range(turns))
+    for session_id in shared:
+        first, second = contents(pair[0], session_id), contents(pair[1], session_id)
+        if sorted(first) != expected:
+            failures.append(f"{session_id} lost or repeated messages of concurrent appends")
+        elif first != second:
+            failures.append(f"the stores read {session_id} in different orders")
+        elif pair[0].backend is not None:
+            # room for every message twice, so repeated ones aren't pushed out of the deque
+            fresh = SessionStore(max_messages=2 * pair[0].max_messages, token_budget=10**9, summary_budget=0,
+                                 backend=SlowBackend(pair[0].backend, read_seconds))
+            histories = []
+            readers = [threading.Thread(target=lambda: histories.append(contents(fresh, session_id)))
+                       for _ in range(threads)]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            if any(history != first for history in histories):
+                failures.append(f"concurrent reads of {session_id} in a new store repeat or lose messages")
+    appends = threads * turns * (sessions + shared_sessions)
+    print(f"isolation {backend_name:<8} {threads} threads, {threads * sessions + shared_sessions} sessions, "
+          f"{appends} appends in {elapsed:.1f}s ({appends / elapsed:,.0f}/s)")
+    return pair, failures
+
+
+def check_memory(sessions, rounds, messages, max_growth_mb):
+    """(MB traced after filling the store, after each further round)"""
+    store = SessionStore(max_sessions=sessions, summary_budget=0)
+    tracemalloc.start()
+    usage = []
+    for round_number in range(rounds + 1):
+        for index in range(sessions):
+            session_id = f"{PREFIX}{round_number}-{index}"
+            for turn in range(messages // 2):
+                store.append(session_id, HumanMessage(content=f"show me listings in the Mission, turn {turn}"),
+                             AIMessage(content=f"Here are five listings in the Mission for turn {turn}."))
+            store.get_history(session_id)
+        usage.append(tracemalloc.get_traced_memory()[0] / 2**20)
+    tracemalloc.stop()
+    stats = store.stats()
+    print(f"memory    {sessions} sessions of {messages} messages: " + " ".join(f"{mb:.1f}MB" for mb in usage) +
+          f"  ({stats['sessions']} sessions kept, {stats['evictions']} evicted)")
+    failures = []
+    if stats["sessions"] > sessions:
+        failures.append(f"the store keeps {stats['sessions']} sessions, more than {sessions}")
+    if max(usage) - usage[0] > max_growth_mb:
+        failures.append(f"memory grew by {max(usage) - usage[0]:.1f}MB after the store was full")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sessions-per-thread", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--shared-sessions", type=int, default=2)
+    parser.add_argument("--read-ms", type=float, default=10, help="delay of the reads by concurrent threads")
+    parser.add_argument("--sessions", type=int, default=10000, help="CHAT_MAX_SESSIONS of the memory check")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=6, help="messages per session in the memory check")
+    parser.add_argument("--max-growth-mb", type=float, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    pair, failures = check_isolation(args.backend, args.threads, args.sessions_per_thread, args.turns, args.shared_sessions,
+                                      args.read_ms / 1000)
+    if args.backend == "postgres":
+        with pair[0].backend.pool.cursor(cursor_factory=None) as cur:
+            cur.execute("DELETE FROM chat_messages WHERE session_id LIKE %s", [PREFIX + "%"])
+    failures += check_memory(args.sessions, args.rounds, args.messages, args.max_growth_mb)
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
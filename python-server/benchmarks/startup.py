@@ -0,0 +1,127 @@
+"""cold start of the servers: the import time of api.py, agent.py and app.py, and the time from launching a
+`python serve.py` worker to its first answered request, with and without the warm-up hook (SERVER_WARM_UP).
+
+Runs every measurement in a new process, with the offline stand-ins unless the environment says otherwise. From the
+python-server directory:
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --importtime agent
+The first request is a chat for app.py, which needs no database with the fake LLM, and /readyz for api.py, which
+answers 503 without a database but is timed all the same. Exits with a non-zero status if a module takes longer than
+--max-import-ms to import or a server doesn't answer within --timeout seconds.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+MODULES = ["api", "agent", "app"]
+# app.py answers chats without OpenAI or api.py with the fake LLM, FAKE_LLM_TOOL_CALLS is empty by default
+ENV = {"LLM_PROVIDER": "fake", "EMBEDDING_PROVIDER": "fake", "FAKE_LLM_LATENCY_MS": "0", "OPENAI_API_KEY": "benchmark"}
+FIRST_REQUESTS = {
+    "app": ("POST", "/api/chat", {"input_val": "hello", "session_id": "startup"}),
+    "api": ("GET", "/readyz", None),
+}
+
+
+def environment(**overrides):
+    return {**ENV, **os.environ, **overrides}
+
+
+def import_ms(module):
+    code = f"import time; start = time.perf_counter(); import {module}; print((time.perf_counter() - start) * 1000)"
+    output = subprocess.run([sys.executable, "-c", code], env=environment(), capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module, count=15):
+    """(cumulative ms, module) of the slowest imports of a module, from python -X importtime"""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=environment(),
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def first_request(server, warm_up, timeout):
+    """(ms to the first answered /healthz, ms of the first request, its status) of a new one worker server"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "serve.py", server, "--workers", "1", "--port", str(port)],
+                               env=environment(SERVER_WARM_UP=str(warm_up).lower()),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - start > timeout:
+                return None, None, None
+            try:
+                if requests.get(base_url + "/healthz", timeout=timeout).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                time.sleep(0.02)
+        live_ms = (time.perf_counter() - start) * 1000
+        method, path, body = FIRST_REQUESTS[server]
+        request_start = time.perf_counter()
+        response = requests.request(method, base_url + path, json=body, timeout=timeout)
+        return live_ms, (time.perf_counter() - request_start) * 1000, response.status_code
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--servers", default="app,api", help="comma separated, app and/or api")
+    parser.add_argument("--max-import-ms", type=float, default=1500)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--importtime", choices=MODULES, help="only list the slowest imports of a module")
+    args = parser.parse_args()
+
+    if args.importtime:
+        for cumulative, name in slowest_imports(args.importtime):
+            print(f"{cumulative:>9.1f}ms  {name}")
+        return
+
+    failures = []
+    for module in MODULES:
+        timings = [import_ms(module) for _ in range(args.repeat)]
+        median = statistics.median(timings)
+        print(f"import {module:<6} median={median:.0f}ms  min={min(timings):.0f}ms  max={max(timings):.0f}ms")
+        if median > args.max_import_ms:
+            failures.append(f"importing {module} takes {median:.0f}ms")
+
+    for server in args.servers.split(","):
+        for warm_up in (True, False):
+            results = [first_request(server, warm_up, args.timeout) for _ in range(args.repeat)]
+            if any(live_ms is None for live_ms, _, _ in results):
+                failures.append(f"{server} didn't answer within {args.timeout:.0f}s")
+                continue
+            live = statistics.median(live_ms for live_ms, _, _ in results)
+            first = statistics.median(request_ms for _, request_ms, _ in results)
+            statuses = sorted({status for _, _, status in results})
+            print(f"serve {server:<4} warm_up={warm_up!s:<5}  live after {live:.0f}ms  first request {first:.0f}ms  "
+                  f"total {live + first:.0f}ms  status {statuses}")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
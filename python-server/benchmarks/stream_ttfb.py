@@ -0,0 +1,106 @@
+"""time to the first event of POST /api/chat/stream with the fake LLM, against the latency of POST /api/chat.
+
+Runs app.py in this process with LLM_PROVIDER=fake, so every LLM call takes FAKE_LLM_LATENCY_MS, and by default
+makes one tool call per chat, a GetBookings against an API that isn't there, which fails at once. From the
+python-server directory:
+    python -m benchmarks.stream_ttfb --chats 20 --llm-latency-ms 300
+    python -m benchmarks.stream_ttfb --tool-calls '[]'
+Reports the time to the empty "start" event, to the first token or tool event, to the final event, and of the
+blocking /api/chat. Exits with a non-zero status if the first event waits for more than one LLM call
+(--max-first-event-ratio times the LLM latency) or, with tool calls, if it doesn't arrive well before the final event.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks.availability_search import percentile
+
+DEFAULT_TOOL_CALLS = [{"name": "GetBookings", "args": {"customer_id": 1}}]
+
+
+def stream_timings(client, input_val, session_id):
+    """ms from the request to the start event, the first event after it and the final event,
+    and the first_event_ms the server sent"""
+    start = time.perf_counter()
+    response = client.post("/api/chat/stream", json={"input_val": input_val, "session_id": session_id}, buffered=False)
+    timings = {}
+    server_first_event = None
+    buffer = ""
+    for chunk in response.response:
+        buffer += chunk.decode("utf-8")
+        while "\n\n" in buffer:
+            message, buffer = buffer.split("\n\n", 1)
+            if not message.startswith("event: "):
+                continue
+            event = message.split("\n", 1)[0][len("event: "):]
+            elapsed = (time.perf_counter() - start) * 1000
+            if event == "start":
+                timings.setdefault("start", elapsed)
+                continue
+            timings.setdefault("first_event", elapsed)
+            if event in ("final", "error"):
+                timings["final"] = elapsed
+                server_first_event = json.loads(message.split("data: ", 1)[1]).get("first_event_ms")
+    response.close()
+    return timings, server_first_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tool-calls", default=json.dumps(DEFAULT_TOOL_CALLS), help="FAKE_LLM_TOOL_CALLS as JSON")
+    parser.add_argument("--max-first-event-ratio", type=float, default=1.5)
+    args = parser.parse_args()
+
+    os.environ.update({"LLM_PROVIDER": "fake", "EMBEDDING_PROVIDER": "fake", "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+                       "FAKE_LLM_TOOL_CALLS": args.tool_calls, "TURN_CACHE_ENABLED": "false"})
+    # the tool calls fail right away instead of waiting on an API
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("API_URL", "http://127.0.0.1:9")
+    os.environ.setdefault("API_RETRIES", "0")
+    import app
+    from agent import warm_up
+    warm_up()
+    client = app.app.test_client()
+
+    results = {"start": [], "first_event": [], "final": [], "chat": []}
+    offsets = []
+    for index in range(args.chats):
+        # a new session per chat, so every chat makes the same calls
+        timings, server_first_event = stream_timings(client, "find me a quiet place to stay", f"ttfb-stream-{index}")
+        for name, ms in timings.items():
+            results[name].append(ms)
+        if server_first_event is not None and "first_event" in timings:
+            offsets.append(timings["first_event"] - server_first_event)
+        start = time.perf_counter()
+        client.post("/api/chat", json={"input_val": "find me a quiet place to stay", "session_id": f"ttfb-chat-{index}"})
+        results["chat"].append((time.perf_counter() - start) * 1000)
+
+    tool_calls = json.loads(args.tool_calls)
+    print(f"{args.chats} chats, {args.llm_latency_ms:.0f}ms per LLM call, {len(tool_calls)} tool calls per chat")
+    labels = {"start": "start event", "first_event": "first event", "final": "final event", "chat": "/api/chat"}
+    for name, label in labels.items():
+        if results[name]:
+            print(f"{label:<12} p50={percentile(results[name], 50):.0f}ms  p95={percentile(results[name], 95):.0f}ms")
+    if offsets:
+        print(f"first_event_ms sent by the server is {percentile(offsets, 50):.1f}ms ahead of the client at p50")
+
+    failures = []
+    if len(results["first_event"]) < args.chats or len(results["final"]) < args.chats:
+        failures.append("some streams ended without a first or final event")
+    else:
+        first, final = percentile(results["first_event"], 50), percentile(results["final"], 50)
+        if first > args.max_first_event_ratio * args.llm_latency_ms:
+            failures.append(f"the first event took {first:.0f}ms, more than one LLM call")
+        if tool_calls and first > 0.75 * final:
+            failures.append(f"the first event at {first:.0f}ms doesn't come well before the final one at {final:.0f}ms")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
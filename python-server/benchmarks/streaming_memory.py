@@ -0,0 +1,109 @@
+"""memory and latency of exporting all bookings: the NDJSON stream of GET /api/bookings?stream=true against one
+fetchall, and the pages of GET /api/bookings against each other.
+
+Adds --bookings synthetic bookings like benchmarks.availability_search, unless that many are there already, then runs
+api.stream_bookings in this process under tracemalloc. Run from the python-server directory:
+    python -m benchmarks.streaming_memory --bookings 1000000
+Exits with a non-zero status if the memory of the stream grows with the rows read by more than --max-growth-mb,
+or if the last pages are more than --max-page-slowdown times slower than the first ones, i.e. the pages don't seek.
+Pass --cleanup to delete the synthetic bookings afterwards.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from benchmarks.availability_search import percentile, seed_bookings
+
+WINDOWS = 10
+
+
+def stream_peaks(stream, total):
+    """(rows, seconds to the first row, peak MB of each tenth of the rows) of consuming an NDJSON stream"""
+    window = max(1, total // WINDOWS)
+    peaks = []
+    rows = 0
+    first_row = None
+    start = time.perf_counter()
+    tracemalloc.reset_peak()
+    for line in stream:
+        if first_row is None:
+            first_row = time.perf_counter() - start
+        rows += 1
+        if rows % window == 0:
+            peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.reset_peak()
+    return rows, first_row or 0.0, peaks
+
+
+def fetchall_peak(api, customer_id):
+    query, params = api.create_bookings_query(customer_id)
+    tracemalloc.reset_peak()
+    with api.get_pool().cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    del rows
+    return peak
+
+
+def page_latencies(api, customer_id, page_size, pages):
+    """ms of the first `pages` pages and of the last `pages` pages of the bookings"""
+    latencies = []
+    token = None
+    while True:
+        start = time.perf_counter()
+        page = api.find_bookings(customer_id, page_size, token)
+        latencies.append((time.perf_counter() - start) * 1000)
+        token = page["next_page_token"]
+        if token is None:
+            return latencies[:pages], latencies[-pages:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=1_000_000)
+    parser.add_argument("--customer-id", type=int, help="export the bookings of one customer, all bookings by default")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-growth-mb", type=float, default=5)
+    parser.add_argument("--max-page-slowdown", type=float, default=3)
+    parser.add_argument("--skip-fetchall", action="store_true", help="don't load every booking at once for comparison")
+    parser.add_argument("--cleanup", action="store_true", help="delete the benchmark bookings at the end")
+    args = parser.parse_args()
+
+    # api.py loads the .env file on import
+    import api
+    total = seed_bookings(api.get_pool(), args.bookings)
+    print(f"{total} bookings in total, streaming {api.STREAM_FETCH_SIZE} rows per fetch")
+
+    failures = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows, first_row, peaks = stream_peaks(api.stream_bookings(args.customer_id), total)
+    elapsed = time.perf_counter() - start
+    print(f"stream    {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s), first row after {first_row * 1000:.0f}ms")
+    print("          peak MB per tenth of the rows: " + " ".join(f"{peak:.1f}" for peak in peaks))
+    growth = max(peaks) - peaks[0] if peaks else 0.0
+    if growth > args.max_growth_mb:
+        failures.append(f"the stream's memory grew by {growth:.1f}MB while reading the rows")
+    if not args.skip_fetchall:
+        peak = fetchall_peak(api, args.customer_id)
+        print(f"fetchall  peak {peak:.1f}MB, {peak / max(max(peaks, default=0), 0.1):.0f}x the stream's")
+    tracemalloc.stop()
+
+    first, last = page_latencies(api, args.customer_id, args.page_size, 10)
+    print(f"pages     first p95={percentile(first, 95):.1f}ms  last p95={percentile(last, 95):.1f}ms  ({args.page_size} rows each)")
+    if percentile(last, 95) > percentile(first, 95) * args.max_page_slowdown:
+        failures.append("the last pages are much slower than the first ones, run sql/bookings_pagination.sql")
+
+    if args.cleanup:
+        with api.get_pool().cursor(cursor_factory=None) as cur:
+            cur.execute("DELETE FROM bookings WHERE status = 'benchmark'")
+        print("deleted the benchmark bookings")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
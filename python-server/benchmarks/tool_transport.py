@@ -0,0 +1,86 @@
+"""per tool call overhead of the in-process and HTTP tool transports.
+
+Serves api.py on a local port in a background thread and times the same tool calls through each transport,
+plus plain requests calls without a keep-alive session as the agent made them before. Listing searches are
+answered from the listings cache after the first call, so the difference between the modes is the transport.
+Uses the fake embedding provider unless EMBEDDING_PROVIDER is set.
+Run from the python-server directory against a loaded database:
+    python -m benchmarks.tool_transport --calls 200
+"""
+import argparse
+import os
+import threading
+import time
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import api  # noqa: E402
+from transport import HttpTransport, InProcessTransport  # noqa: E402
+
+LISTINGS_REQUEST = {"query_params": {"neighbourhood": {"value": "Mission District", "type": "text"}},
+                    "embedding_text": "place near dining and nightlife"}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class NoSessionTransport:
+    """a new connection per call, like the tools before transport.py"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def get_listings(self, data):
+        return {"data": requests.post(self.base_url + "/api/listings", json=data).json()["data"]}
+
+    def get_bookings(self, customer_id):
+        return {"data": requests.get(self.base_url + "/api/bookings", {"customer_id": customer_id}).json()["data"]}
+
+
+def run(call, calls):
+    call()  # warms up the connection and the listings cache
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        result = call()
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert "data" in result, result
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--customer-id", type=int, default=1)
+    args = parser.parse_args()
+
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    transports = {
+        "inprocess": InProcessTransport(),
+        "http (keep-alive)": HttpTransport(base_url),
+        "http (no session)": NoSessionTransport(base_url),
+    }
+    baseline = {}
+    try:
+        for tool, call in [("GetListings", lambda t: t.get_listings(LISTINGS_REQUEST)),
+                           ("GetBookings", lambda t: t.get_bookings(args.customer_id))]:
+            for name, transport in transports.items():
+                latencies = run(lambda: call(transport), args.calls)
+                p50 = percentile(latencies, 50)
+                baseline.setdefault(tool, p50)
+                print(f"{tool:<12} {name:<18} p50={p50:.2f}ms  p95={percentile(latencies, 95):.2f}ms  "
+                      f"overhead vs inprocess={p50 - baseline[tool]:+.2f}ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""checks and hit rate of the semantic turn cache, with a deterministic fake embedder and no LLM.
+
+Checks that paraphrases hit, unrelated questions miss, turns with bookings or tool errors are never cached,
+searches with arguments only hit the same input, entries expire and are evicted, a failing embedding call is a miss and a new listings version drops every entry.
+Then replays a workload of paraphrased questions and reports the hit ratio.
+Exits with status 1 if a check fails. Run from the python-server directory:
+    python -m benchmarks.turn_cache --requests 500
+"""
+import argparse
+import random
+import sys
+import time
+
+from langchain_core.agents import AgentAction
+
+from embedding_cache import BagOfWordsEmbeddings
+from turn_cache import TurnCache
+
+# the fake embedder only knows shared words, so the threshold is lower than for real embeddings
+THRESHOLD = 0.8
+
+QUESTIONS = [
+    ["what can you do?", "what can you do for me", "What can you do?!"],
+    ["tell me about the Mission District", "tell me about the mission district please", "Tell me about the Mission District."],
+    ["what is there to do in North Beach", "what is there to do in north beach?", "what is there to do around North Beach"],
+    ["is the Tenderloin safe", "is the tenderloin safe at night", "Is the Tenderloin safe?"],
+]
+
+
+def turn(tool=None, observation=None, tool_input=None):
+    steps = [(AgentAction(tool, tool_input or {}, ""), observation)] if tool else []
+    return {"output": '{"summary": "...", "results_to_display": []}', "intermediate_steps": steps}
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    failures = []
+    embeddings = BagOfWordsEmbeddings()
+    cache = TurnCache(embeddings.embed_query, threshold=THRESHOLD, max_entries=3, ttl=0.2)
+    cache.store("what can you do?", turn(), [], 1000)
+    check(failures, cache.lookup("What can you do for me?") is not None, "a paraphrase missed")
+    check(failures, cache.lookup("book listing 12 for me") is None, "an unrelated question hit")
+    check(failures, not cache.store("book listing 12", turn("CreateBooking", {"data": {}}), [], 1000), "a booking turn was cached")
+    check(failures, not cache.store("show my bookings", turn("GetBookings", {"data": []}), [], 1000), "a customer's bookings were cached")
+    check(failures, not cache.store("cheap places", turn("GetListings", {"error": "failed"}), [], 1000), "a failed turn was cached")
+    check(failures, cache.store("cheap places", turn("GetListings", {"data": []}), ["ids"], 1000), "a listings turn was not cached")
+    check(failures, cache.lookup("cheap places")["notes"] == ["ids"], "notes were not kept")
+    search = {"data": {"query_params": {"neighbourhood": {"value": "South of Market", "type": "text"},
+                                        "price": {"value": 200, "type": "currency", "symbol": "<="}}}}
+    cache.store("2 bedroom place in SoMa under $200", turn("GetListings", {"data": []}, search), [], 1000)
+    check(failures, cache.lookup("2 bedroom place in SoMa under $400") is None, "a similar search got another search's listings")
+    check(failures, cache.lookup("2 bedroom place in soma under $200.") is not None, "the same search missed")
+    for i in range(4):
+        cache.store(f"question number {i}", turn(), [], 1000)
+    check(failures, cache.stats()["size"] == 3, "the cache grew past max_entries")
+    time.sleep(0.3)
+    check(failures, cache.lookup("question number 3") is None, "an expired entry hit")
+
+    provider_down = [False]
+
+    def flaky_embed(text):
+        if provider_down[0]:
+            raise ConnectionError("embedding provider unavailable")
+        return embeddings.embed_query(text)
+    cache = TurnCache(flaky_embed, threshold=THRESHOLD)
+    cache.store("what can you do?", turn(), [], 1000)
+    provider_down[0] = True
+    check(failures, cache.lookup("What can you do for me?") is None, "a failing embedding call was not a miss")
+    check(failures, not cache.store("cheap places", turn("GetListings", {"data": []}), [], 1000),
+          "a turn was cached without an embedding")
+    check(failures, cache.stats()["errors"] == 2, "embedding errors were not counted")
+
+    listings_version = [0]
+    cache = TurnCache(embeddings.embed_query, threshold=THRESHOLD, listings_version=lambda: listings_version[0])
+    cache.store("cheap places", turn("GetListings", {"data": []}), [], 1000)
+    listings_version[0] += 1
+    check(failures, cache.lookup("cheap places") is None, "a turn was served after the listings were refreshed")
+
+    rng = random.Random(args.seed)
+    cache = TurnCache(embeddings.embed_query, threshold=THRESHOLD)
+    for _ in range(args.requests):
+        question = rng.choice(rng.choice(QUESTIONS))
+        if cache.lookup(question) is None:
+            cache.store(question, turn(), [], 3000)
+    stats = cache.stats()
+    print(f"{args.requests} requests over {len(QUESTIONS)} questions: hit ratio={stats['hit_ratio']:.3f} "
+          f"(exact {stats['exact_hits']}, similar {stats['hits'] - stats['exact_hits']}), "
+          f"{stats['size']} entries, saved {stats['saved_ms'] / 1000:.0f}s of agent time at 3s per turn")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
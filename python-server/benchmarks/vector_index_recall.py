@@ -0,0 +1,77 @@
+"""recall@k vs. latency of the description_embedding index compared to an exact scan.
+
+Run from the python-server directory after building the index with sql/vector_index.sql:
+    python -m benchmarks.vector_index_recall --queries 50 --k 5 --ef-search 10,20,40,80,160
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from db import ConnectionPool
+
+QUERY = "SELECT listing_id FROM airbnb_listings ORDER BY description_embedding <=> %s::vector LIMIT %s"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def search(pool, embedding, k, settings):
+    with pool.cursor(cursor_factory=None) as cur:
+        for name, value in settings.items():
+            cur.execute("SELECT set_config(%s, %s, true)", [name, value])
+        start = time.perf_counter()
+        cur.execute(QUERY, [embedding, k])
+        rows = cur.fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+    return [row[0] for row in rows], elapsed
+
+
+def run(pool, embeddings, k, label, settings, exact_results):
+    recalls = []
+    latencies = []
+    for embedding, expected in zip(embeddings, exact_results):
+        ids, elapsed = search(pool, embedding, k, settings)
+        latencies.append(elapsed)
+        recalls.append(len(set(ids) & set(expected)) / k)
+    print(f"{label:<20} recall@{k}={sum(recalls) / len(recalls):.3f}  "
+          f"p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50, help="number of listings used as query vectors")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--ef-search", default="10,20,40,80,160", help="comma separated hnsw.ef_search values")
+    parser.add_argument("--probes", default="", help="comma separated ivfflat.probes values")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+
+    # existing listing embeddings are used as queries, so the benchmark runs without an embedding provider
+    with pool.cursor(cursor_factory=None) as cur:
+        cur.execute("SELECT description_embedding::text FROM airbnb_listings WHERE description_embedding IS NOT NULL "
+                    "ORDER BY random() LIMIT %s", [args.queries])
+        embeddings = [row[0] for row in cur.fetchall()]
+
+    exact = {"enable_indexscan": "off"}
+    exact_results = []
+    latencies = []
+    for embedding in embeddings:
+        ids, elapsed = search(pool, embedding, args.k, exact)
+        exact_results.append(ids)
+        latencies.append(elapsed)
+    print(f"{'exact':<20} recall@{args.k}=1.000  "
+          f"p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+    for value in filter(None, args.ef_search.split(",")):
+        run(pool, embeddings, args.k, f"ef_search={value}", {"hnsw.ef_search": value}, exact_results)
+    for value in filter(None, args.probes.split(",")):
+        run(pool, embeddings, args.k, f"probes={value}", {"ivfflat.probes": value}, exact_results)
+
+
+if __name__ == "__main__":
+    main()
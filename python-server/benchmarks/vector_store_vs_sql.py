@@ -0,0 +1,80 @@
+"""latency of the numpy listings backend compared to the SQL path, with and without filters.
+
+Run from the python-server directory against a loaded database:
+    python -m benchmarks.vector_store_vs_sql --queries 100
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from db import ConnectionPool
+from filters import compile_filters
+from vector_store import NumpyVectorStore
+
+SQL_QUERY = ("SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings {where} "
+             "ORDER BY description_embedding <=> %s::vector LIMIT 5")
+BY_ID_QUERY = "SELECT listing_id,name,description,price,neighbourhood FROM airbnb_listings WHERE listing_id = ANY(%s)"
+
+WORKLOADS = {
+    "no filters": {},
+    "price <= 200": {"price": {"value": 200, "type": "currency", "symbol": "<="}},
+    "bedrooms >= 2, Mission": {"bedrooms": {"value": 2, "type": "number", "symbol": ">="},
+                               "neighbourhood": {"value": "Mission District", "type": "text"}},
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(label, latencies):
+    print(f"{label:<40} p50={percentile(latencies, 50):.2f}ms  p95={percentile(latencies, 95):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--path", default="vector_store")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the store before running")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pool = ConnectionPool.from_env()
+    store = NumpyVectorStore(args.path, dtype=args.dtype)
+    if args.rebuild or not store.reload_if_changed():
+        start = time.perf_counter()
+        count = store.build(pool)
+        print(f"built store with {count} listings in {time.perf_counter() - start:.1f}s")
+    print(store.stats())
+
+    vectors = store._data[0]
+    rows = store._data[2]["__has_embedding"].nonzero()[0][:args.queries]
+    queries = [vectors[i].astype("float32") for i in rows]
+
+    for label, filters in WORKLOADS.items():
+        conditions, params = compile_filters(filters)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        sql_latencies, store_latencies = [], []
+        for query in queries:
+            embedding = query.tolist()
+            start = time.perf_counter()
+            with pool.cursor() as cur:
+                cur.execute(SQL_QUERY.format(where=where), params + [embedding])
+                cur.fetchall()
+            sql_latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            listing_ids = store.search(embedding, filters)
+            with pool.cursor() as cur:
+                cur.execute(BY_ID_QUERY, [listing_ids])
+                cur.fetchall()
+            store_latencies.append((time.perf_counter() - start) * 1000)
+        report(f"sql    ({label})", sql_latencies)
+        report(f"numpy  ({label})", store_latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""end-to-end workload: replays conversation traces against /api/chat and their listing searches against /api/listings.
+
+Seed a database with `python -m benchmarks.seed`, then start both servers with the offline stand-ins, so the numbers
+measure this code and not OpenAI:
+    EMBEDDING_PROVIDER=fake python api.py
+    LLM_PROVIDER=fake EMBEDDING_PROVIDER=fake FAKE_LLM_SCRIPT=benchmarks/traces.json python app.py
+and from the python-server directory:
+    python -m benchmarks.workload --concurrency 16 --duration 30 --save-baseline baseline.json
+    python -m benchmarks.workload --concurrency 16 --duration 30 --baseline baseline.json
+Each virtual user plays the conversations of --traces one after another, every turn in the same chat session, and
+searches listings with the GetListings arguments of the traces. The report has the throughput and p50/p95/p99 latency
+per endpoint, and the time per stage from the Server-Timing headers. With --baseline, the run exits with status 1 if
+an endpoint's p50 or p95 is over the baseline's by more than --tolerance, its throughput under it by more, or it has
+errors the baseline didn't.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+TRACES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.json")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def parse_server_timing(header):
+    """{stage: ms} of a Server-Timing header like "sql;dur=3.1, total;dur=12.0" """
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name and params.startswith("dur="):
+            stages[name] = float(params[4:])
+    return stages
+
+
+def load_traces(path):
+    with open(path) as f:
+        conversations = json.load(f)["conversations"]
+    searches = [call["args"]["data"] for conversation in conversations for turn in conversation["turns"]
+                for step in turn.get("steps", []) for call in step if call["name"] == "GetListings"]
+    return conversations, searches
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.stages = {}
+
+    def record(self, endpoint, latency, ok, server_timing=None):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(endpoint, []).append(latency)
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            for stage, ms in parse_server_timing(server_timing).items():
+                self.stages.setdefault(endpoint, {}).setdefault(stage, []).append(ms)
+
+
+def request(session, recorder, endpoint, url, body):
+    start = time.perf_counter()
+    try:
+        response = session.post(url, json=body, timeout=120)
+        ok = response.status_code == 200
+        server_timing = response.headers.get("Server-Timing")
+    except requests.RequestException:
+        ok, server_timing = False, None
+    recorder.record(endpoint, (time.perf_counter() - start) * 1000, ok, server_timing)
+
+
+def virtual_user(user, args, conversations, searches, deadline, recorder):
+    session = requests.Session()
+    conversation_cycle = itertools.cycle(conversations[user % len(conversations):] + conversations[:user % len(conversations)])
+    search_cycle = itertools.cycle(searches[user % len(searches):] + searches[:user % len(searches)]) if searches else None
+    while time.monotonic() < deadline:
+        if "chat" in args.endpoints:
+            session_id = str(uuid.uuid4())
+            for turn in next(conversation_cycle)["turns"]:
+                if time.monotonic() >= deadline:
+                    return
+                request(session, recorder, "chat", args.app_url + "/api/chat", {"input_val": turn["input"], "session_id": session_id})
+        if "listings" in args.endpoints and search_cycle is not None:
+            request(session, recorder, "listings", args.api_url + "/api/listings", next(search_cycle))
+
+
+def summarize(recorder, elapsed):
+    report = {}
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies.get(endpoint, [])
+        report[endpoint] = {
+            "requests": len(latencies),
+            "errors": recorder.errors.get(endpoint, 0),
+            "throughput": len(latencies) / elapsed,
+            **{f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+            "stages": {stage: {"mean": sum(values) / len(values), "p95": percentile(values, 95)}
+                       for stage, values in sorted(recorder.stages.get(endpoint, {}).items())},
+        }
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """the regressions of report against baseline, as messages"""
+    regressions = []
+    for endpoint, expected in baseline.items():
+        actual = report.get(endpoint)
+        if actual is None:
+            regressions.append(f"{endpoint}: no requests")
+            continue
+        for key in ("p50", "p95"):
+            if actual[key] > expected[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {actual[key]:.0f}ms, baseline {expected[key]:.0f}ms")
+        if actual["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(f"{endpoint} throughput: {actual['throughput']:.1f}/s, baseline {expected['throughput']:.1f}/s")
+        if actual["errors"] and not expected["errors"]:
+            regressions.append(f"{endpoint}: {actual['errors']} errors")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-url", default="http://127.0.0.1:3000")
+    parser.add_argument("--api-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--traces", default=TRACES)
+    parser.add_argument("--endpoints", default="chat,listings", help="comma separated, chat and/or listings")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--baseline", help="a report saved with --save-baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression against the baseline")
+    parser.add_argument("--save-baseline", help="writes this run's report to the file")
+    args = parser.parse_args()
+    args.endpoints = args.endpoints.split(",")
+
+    conversations, searches = load_traces(args.traces)
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for user in range(args.concurrency):
+            pool.submit(virtual_user, user, args, conversations, searches, deadline, recorder)
+    report = summarize(recorder, time.monotonic() - start)
+
+    for endpoint, result in report.items():
+        print(f"{endpoint:<9} {result['throughput']:.1f} req/s  p50={result['p50']:.0f}ms  p95={result['p95']:.0f}ms  "
+              f"p99={result['p99']:.0f}ms  requests={result['requests']}  errors={result['errors']}")
+        for stage, timing in result["stages"].items():
+            print(f"    {stage:<24} mean={timing['mean']:.1f}ms  p95={timing['p95']:.1f}ms")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved the baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
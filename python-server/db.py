@@ -0,0 +1,337 @@
+from contextlib import contextmanager
+from collections import deque
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from lazy import resource
+
+
+class PoolTimeout(Exception):
+    """raised when no connection could be checked out of the pool in time"""
+
+
+def parse_hosts(host_value, default_port):
+    """parses DB_HOST into a list of (host, port) pairs.
+
+    DB_HOST can be a single host or a comma separated list of nodes, optionally with a port,
+    i.e. "127.0.0.1:5433,127.0.0.1:5434,127.0.0.1:5435" for the 3-node cluster in the README.
+    """
+    hosts = []
+    for entry in (host_value or "127.0.0.1").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if ":" in entry:
+            host, port = entry.rsplit(":", 1)
+        else:
+            host, port = entry, default_port
+        hosts.append((host, int(port or 5433)))
+    return hosts
+
+
+PLACEHOLDER = re.compile(r"%%|%s")
+
+
+def to_server_placeholders(query):
+    """converts a psycopg2 query with %s placeholders to the $1, $2... form used by PREPARE"""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return PLACEHOLDER.sub(replace, query)
+
+
+class ConnectionPool:
+    """a thread-safe psycopg2 connection pool that spreads connections across the cluster nodes.
+
+    Connections are checked out per request with `connection()` or `cursor()`, which commit on success
+    and roll back on error, so one failed transaction never leaks into another request.
+    Broken connections are discarded and replaced on the next checkout.
+    """
+
+    def __init__(self, hosts, dbname, user, password, minconn=1, maxconn=10, timeout=5.0,
+                 health_check_interval=30.0, connect_timeout=5, max_prepared=256):
+        if minconn > maxconn:
+            raise ValueError("minconn must not be greater than maxconn")
+        if not hosts:
+            raise ValueError("at least one host is required")
+        self.hosts = hosts
+        self.dbname = dbname
+        self.user = user
+        self.password = password
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.max_prepared = max_prepared
+
+        self._lock = threading.Condition()
+        # idle connections as (connection, time it was returned to the pool), most recently used last
+        self._idle = deque()
+        self._size = 0
+        self._waiting = 0
+        # tickets of the threads waiting for a connection, served first come first served
+        self._tickets = itertools.count()
+        self._queue = deque()
+        self._host_cycle = itertools.cycle(range(len(hosts)))
+        # the node each open connection belongs to, used for metrics
+        self._conn_hosts = {}
+        # names of the statements prepared on each open connection
+        self._prepared = {}
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_errors": 0,
+            "discarded": 0,
+            "prepared": 0,
+            "total_wait_ms": 0.0,
+        }
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._lock:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """builds a pool from the DB_* and DB_POOL_* environment variables, `overrides` take precedence"""
+        options = dict(
+            hosts=parse_hosts(os.getenv("DB_HOST"), os.getenv("DB_PORT")),
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USERNAME"),
+            password=os.getenv("DB_PASSWORD"),
+            minconn=int(os.getenv("DB_POOL_MIN", 1)),
+            maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+            health_check_interval=float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", 30)),
+        )
+        options.update(overrides)
+        return cls(**options)
+
+    def _connect(self):
+        # try each node once, starting from the next one in round-robin order,
+        # so that a node going down only costs a failed connection attempt
+        last_error = None
+        for _ in range(len(self.hosts)):
+            with self._lock:
+                index = next(self._host_cycle)
+            host, port = self.hosts[index]
+            try:
+                conn = psycopg2.connect(
+                    dbname=self.dbname,
+                    user=self.user,
+                    password=self.password,
+                    host=host,
+                    port=port,
+                    connect_timeout=self.connect_timeout,
+                )
+            except psycopg2.OperationalError as e:
+                last_error = e
+                with self._lock:
+                    self._stats["connect_errors"] += 1
+                continue
+            with self._lock:
+                self._stats["connects"] += 1
+                self._conn_hosts[id(conn)] = f"{host}:{port}"
+            return conn
+        raise last_error
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        with self._lock:
+            self._conn_hosts.pop(id(conn), None)
+            self._prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        """checks a healthy connection out of the pool, waiting up to `timeout` seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._lock:
+            # a thread that just returned a connection queues behind the ones already waiting instead of taking it back
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            self._waiting += 1
+            try:
+                while self._queue[0] != ticket or (not self._idle and self._size >= self.maxconn):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no database connection available after {timeout}s")
+                    self._lock.wait(remaining)
+            finally:
+                self._waiting -= 1
+                self._queue.remove(ticket)
+                # the next thread in line may go ahead
+                self._lock.notify_all()
+
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+                # reserve the slot before connecting outside of the lock
+                self._size += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+        elif not self._is_healthy(conn, idle_since):
+            # reconnect in place of the broken connection
+            self._close(conn)
+            with self._lock:
+                self._stats["discarded"] += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["total_wait_ms"] += (time.monotonic() - start) * 1000
+        return conn
+
+    def _release_slot(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify_all()
+
+    def putconn(self, conn, discard=False):
+        """returns a connection to the pool, closing it if it is broken or `discard` is set"""
+        if not discard and not conn.closed:
+            try:
+                # never hand out a connection in the middle of a transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed:
+            self._close(conn)
+            with self._lock:
+                self._stats["discarded"] += 1
+            self._release_slot()
+            return
+
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify_all()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """checks out a connection for a single transaction, committing on success and rolling back on error"""
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the connection itself is broken, don't put it back in the pool
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    @contextmanager
+    def cursor(self, cursor_factory=RealDictCursor, timeout=None):
+        """shortcut for a cursor inside of `connection()`"""
+        with self.connection(timeout) as conn:
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                yield cur
+
+    def execute_prepared(self, cur, query, params):
+        """executes a query as a server-side prepared statement, preparing it once per connection.
+
+        Repeated query shapes then skip parsing and planning on the server. The query uses the usual %s placeholders.
+        """
+        name = "stmt_" + hashlib.md5(query.encode("utf-8")).hexdigest()[:16]
+        conn_id = id(cur.connection)
+        with self._lock:
+            prepared = self._prepared.setdefault(conn_id, set())
+        if name not in prepared:
+            if len(prepared) >= self.max_prepared:
+                cur.execute("DEALLOCATE ALL")
+                prepared.clear()
+            # PREPARE is not transactional, the statement outlives a rollback of the current request
+            cur.execute(f"PREPARE {name} AS {to_server_placeholders(query)}")
+            prepared.add(name)
+            with self._lock:
+                self._stats["prepared"] += 1
+        if params:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def stats(self):
+        """returns a snapshot of the pool metrics"""
+        with self._lock:
+            per_host = {f"{host}:{port}": 0 for host, port in self.hosts}
+            for host in self._conn_hosts.values():
+                per_host[host] = per_host.get(host, 0) + 1
+            checkouts = self._stats["checkouts"]
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "connections_per_host": per_host,
+                "avg_wait_ms": self._stats["total_wait_ms"] / checkouts if checkouts else 0.0,
+                **{key: value for key, value in self._stats.items() if key != "total_wait_ms"},
+            }
+
+    def closeall(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+
+@resource("pool")
+def get_pool():
+    """the connection pool of the process, built on first use. api.py and the chat session store share it"""
+    return ConnectionPool.from_env()
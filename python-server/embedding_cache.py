@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from metrics import log
+
+
+def normalize_text(text):
+    """normalizes embedding text so that near-identical phrases share a cache entry,
+    i.e. "Place near dining and nightlife." and "place near  dining and nightlife"
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(".!?,;: ")
+
+
+class FakeEmbeddings:
+    """a deterministic embedding provider for running the API and cache offline.
+
+    The same text always maps to the same unit vector, so it can stand in for OpenAIEmbeddings in tests and benchmarks.
+    """
+
+    def __init__(self, size=1536):
+        self.size = size
+        self.calls = 0
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+
+class BagOfWordsEmbeddings(FakeEmbeddings):
+    """a deterministic embedding provider where texts sharing words get similar vectors.
+
+    Each word is hashed to a few signed dimensions, so unlike FakeEmbeddings, paraphrases like "what can you do?"
+    and "what can you do for me" are near neighbours. For testing similarity lookups offline.
+    """
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9']+", text.lower()):
+            digest = hashlib.sha256(word.encode("utf-8")).digest()
+            for i in range(0, 12, 4):
+                index = int.from_bytes(digest[i:i + 3], "little") % self.size
+                vector[index] += 1.0 if digest[i + 3] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class DiskEmbeddingStore:
+    """persistent cache tier, storing vectors as float32 blobs in SQLite keyed by model name and normalized text"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (model, key))"
+        )
+        self._db.commit()
+
+    def get(self, model, key):
+        with self._lock:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE model = ? AND key = ?", (model, key)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_many(self, model, items):
+        now = time.time()
+        rows = [(model, key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+
+
+class EmbeddingCache:
+    """two-tier cache in front of an embedding provider.
+
+    Lookups check an in-process LRU (bounded by max_size and ttl seconds), then the optional disk tier.
+    Misses arriving within batch_window seconds of each other are coalesced into one embed_documents call, a miss
+    waits at most timeout seconds for its batch.
+    """
+
+    def __init__(self, embeddings, model_name, max_size=1024, ttl=3600, disk_path=None, batch_window=0.01,
+                 max_batch_size=64, timeout=60):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.disk = DiskEmbeddingStore(disk_path) if disk_path else None
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        # misses waiting for the next batch, normalized text -> Future
+        self._pending = OrderedDict()
+        self._batch_scheduled = False
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "batches": 0,
+                       "batched_texts": 0, "disk_errors": 0}
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            vector, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                self._stats["evictions"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return vector
+
+    def _memory_put(self, key, vector):
+        with self._lock:
+            self._memory[key] = (vector, time.monotonic() + self.ttl)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get(self, text):
+        """returns the embedding for text as a list of floats"""
+        key = normalize_text(text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            return vector.tolist()
+
+        if self.disk is not None:
+            vector = self.disk.get(self.model_name, key)
+            if vector is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                self._memory_put(key, vector)
+                return vector.tolist()
+
+        return self._enqueue(key).result(timeout=self.timeout).tolist()
+
+    def _enqueue(self, key):
+        with self._lock:
+            self._stats["misses"] += 1
+            future = self._pending.get(key)
+            if future is not None:
+                # the same text is already waiting for the next batch
+                return future
+            future = Future()
+            self._pending[key] = future
+            is_leader = not self._batch_scheduled
+            self._batch_scheduled = True
+
+        if is_leader:
+            # the first miss in a window waits for others to join, then embeds the whole batch
+            time.sleep(self.batch_window)
+            self._flush()
+        return future
+
+    def _flush(self):
+        with self._lock:
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                batch.append(self._pending.popitem(last=False))
+            # anything past max_batch_size is flushed right away by this thread
+            more = bool(self._pending)
+            self._batch_scheduled = more
+            self._stats["batches"] += 1
+            self._stats["batched_texts"] += len(batch)
+
+        keys = [key for key, _ in batch]
+        try:
+            vectors = [np.asarray(v, dtype=np.float32) for v in self.embeddings.embed_documents(keys)]
+            if len(vectors) != len(keys):
+                raise ValueError(f"embed_documents returned {len(vectors)} embeddings for {len(keys)} texts")
+            for key, vector in zip(keys, vectors):
+                self._memory_put(key, vector)
+            # the waiting lookups get their embeddings before the disk write, which can fail or block on the file
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+            if self.disk is not None:
+                try:
+                    self.disk.put_many(self.model_name, zip(keys, vectors))
+                except Exception as e:
+                    log("embedding_cache_disk_error", error=str(e))
+                    with self._lock:
+                        self._stats["disk_errors"] += 1
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # no lookup waits on a batch that ended any other way
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("the embedding batch was not completed"))
+            if more:
+                self._flush()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return {
+                "model": self.model_name,
+                "size": len(self._memory),
+                "max_size": self.max_size,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                **self._stats,
+            }
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import re
+import time
+from typing import Dict, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from embedding_cache import normalize_text
+
+DEFAULT_OUTPUT = json.dumps({"summary": "Here is what I found.", "results_to_display": []})
+
+
+def load_scripts(path):
+    """reads the turns of conversation traces (see benchmarks/traces.json) into scripts for FakeChatModel"""
+    with open(path) as f:
+        traces = json.load(f)
+    scripts = {}
+    for conversation in traces["conversations"]:
+        for turn in conversation["turns"]:
+            output = turn.get("output")
+            scripts[normalize_text(turn["input"])] = {"steps": turn.get("steps", []),
+                                                      "output": output if output is None or isinstance(output, str) else json.dumps(output)}
+    return scripts
+
+
+class FakeChatModel(BaseChatModel):
+    """a deterministic chat model for benchmarks and load tests that waits `latency` seconds per call
+    instead of calling OpenAI.
+
+    If the latest user input is in `scripts` ({normalized input: {"steps": [[{"name", "args"}, ...], ...], "output"}}),
+    each call replays the next step's tool calls, all in one message, and then the output. Other inputs ask for
+    `tool_calls` in one step, if any, and then answer with a JSON summary like the real agent.
+    """
+
+    latency: float = 0.5
+    tool_calls: List[dict] = []
+    scripts: Dict[str, dict] = {}
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        human_index = max([i for i, message in enumerate(messages) if isinstance(message, HumanMessage)], default=-1)
+        input_val = messages[human_index].content if human_index >= 0 else ""
+        # every tool call message after the latest input is a step the agent already took
+        step = sum(1 for message in messages[human_index + 1:] if isinstance(message, AIMessage) and message.additional_kwargs.get("tool_calls"))
+
+        script = self.scripts.get(normalize_text(input_val)) if isinstance(input_val, str) else None
+        if script is None:
+            tools_done = any(isinstance(message, ToolMessage) for message in messages[human_index + 1:])
+            script = {"steps": [self.tool_calls] if self.tool_calls and not tools_done else [], "output": None}
+            step = 0
+
+        if step < len(script["steps"]):
+            message = AIMessage(content="", additional_kwargs={"tool_calls": [
+                {"id": self._call_id(input_val, step, index), "type": "function",
+                 "function": {"name": call["name"], "arguments": json.dumps(call["args"])}}
+                for index, call in enumerate(script["steps"][step])
+            ]})
+        else:
+            message = AIMessage(content=script["output"] or DEFAULT_OUTPUT)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # the same message as _generate after the same latency, the answer word by word like OpenAI streams tokens
+        message = self._generate(messages, stop, run_manager, **kwargs).generations[0].message
+        if message.additional_kwargs.get("tool_calls"):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs=message.additional_kwargs))
+            return
+        for token in re.findall(r"\s*\S+", message.content):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    @staticmethod
+    def _call_id(input_val, step, index):
+        # the same input always produces the same tool call ids, so runs are reproducible
+        return "call_" + hashlib.sha256(f"{input_val}|{step}|{index}".encode("utf-8")).hexdigest()[:24]
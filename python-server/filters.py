@@ -0,0 +1,254 @@
+from datetime import date
+import math
+
+from landmarks import resolve_landmark
+
+# columns of airbnb_listings that can be used in "query_params", by type
+# the type decides how a filter is compiled, regardless of the type the agent sent along with it
+FILTER_COLUMNS = {
+    "name": "text",
+    "neighborhood_overview": "text",
+    "transit": "text",
+    "street": "text",
+    "neighbourhood": "text",
+    "city": "text",
+    "state": "text",
+    "zipcode": "text",
+    "smart_location": "text",
+    "country_code": "text",
+    "country": "text",
+    "property_type": "text",
+    "room_type": "text",
+    "bed_type": "text",
+    "amenities": "text",
+    "calendar_updated": "text",
+    "cancellation_policy": "text",
+    "latitude": "number",
+    "longitude": "number",
+    "accommodates": "number",
+    "bathrooms": "number",
+    "bedrooms": "number",
+    "beds": "number",
+    "minimum_nights": "number",
+    "maximum_nights": "number",
+    "minimum_minimum_nights": "number",
+    "maximum_minimum_nights": "number",
+    "minimum_maximum_nights": "number",
+    "maximum_maximum_nights": "number",
+    "minimum_nights_avg_ntm": "number",
+    "maximum_nights_avg_ntm": "number",
+    "availability_30": "number",
+    "availability_60": "number",
+    "availability_90": "number",
+    "availability_365": "number",
+    "review_scores_rating": "number",
+    "review_scores_accuracy": "number",
+    "review_scores_cleanliness": "number",
+    "review_scores_checkin": "number",
+    "review_scores_communication": "number",
+    "review_scores_location": "number",
+    "review_scores_value": "number",
+    "price": "currency",
+    "weekly_price": "currency",
+    "monthly_price": "currency",
+    "security_deposit": "currency",
+    "cleaning_fee": "currency",
+    "extra_people": "currency",
+    "host_is_superhost": "boolean",
+    "has_availability": "boolean",
+    "is_business_travel_ready": "boolean",
+    "calendar_last_scraped": "date",
+}
+
+# currency columns are stored as text like "$1,200.00", sql/filter_indexes.sql adds an indexed numeric copy of each
+CURRENCY_COLUMNS = {column: f"{column}_numeric" for column, column_type in FILTER_COLUMNS.items() if column_type == "currency"}
+
+SYMBOLS = ("=", "<", "<=", ">", ">=")
+
+
+def parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "t", "yes", "1"):
+        return True
+    if str(value).lower() in ("false", "f", "no", "0"):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+
+def parse_number(key, value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(str(value).replace("$", "").replace(",", ""))
+    except ValueError:
+        raise ValueError(f"Invalid number for {key}: {value}")
+
+
+def compile_filters(filters):
+    """compiles the "query_params" of a listings request into a list of SQL conditions and their params.
+
+    Column names are checked against FILTER_COLUMNS and never taken from the request as-is, and every condition
+    compares a plain column to a param so that it can use an index. Raises ValueError on invalid filters.
+    """
+    if filters is None:
+        filters = {}
+    if not isinstance(filters, dict):
+        raise ValueError("query_params must be an object")
+    conditions = []
+    params = []
+    for key, value in filters.items():
+        if key == LOCATION_FILTER:
+            location_conditions, location_params = compile_location(value)
+            conditions += location_conditions
+            params += location_params
+            continue
+        if key not in FILTER_COLUMNS:
+            raise ValueError(f"Unknown column in query_params: {key}")
+        if not isinstance(value, dict) or "value" not in value:
+            raise ValueError(f"query_params.{key} must be an object with a 'value'")
+
+        column_type = FILTER_COLUMNS[key]
+        symbol = value.get("symbol", "=")
+        if symbol not in SYMBOLS:
+            raise ValueError(f"Invalid symbol for {key}: {symbol}")
+
+        if column_type == "text":
+            # a similarity search on the text using pg_trgm, notice the double %% used to escape the % character
+            conditions.append(f"{key} %% %s")
+            params.append(str(value["value"]))
+        elif column_type == "number":
+            conditions.append(f"{key} {symbol} %s")
+            params.append(parse_number(key, value["value"]))
+        elif column_type == "currency":
+            conditions.append(f"{CURRENCY_COLUMNS[key]} {symbol} %s")
+            params.append(parse_number(key, value["value"]))
+        elif column_type == "boolean":
+            conditions.append(f"{key} = %s")
+            params.append(parse_boolean(value["value"]))
+        elif column_type == "date":
+            try:
+                params.append(date.fromisoformat(str(value["value"])[:10]))
+            except ValueError:
+                raise ValueError(f"Invalid date for {key}: {value['value']}")
+            conditions.append(f"{key} {symbol} %s")
+    return conditions, params
+
+
+# "location" in query_params isn't a column: it filters on latitude and longitude, near a point or in a box
+LOCATION_FILTER = "location"
+DEFAULT_RADIUS_KM = 1.0
+MAX_RADIUS_KM = 25.0
+EARTH_RADIUS_KM = 6371.0
+# must match location_cell() in sql/geo_index.sql: cells of 0.01 degrees, about 1.1km by 0.9km in San Francisco
+CELLS_PER_DEGREE = 100
+# larger areas are filtered on the latitude and longitude alone, a list of cells that long costs more than it saves
+MAX_LOCATION_CELLS = 400
+
+# great-circle distance from a point, in km
+HAVERSINE_KM = (f"2 * {EARTH_RADIUS_KM} * asin(sqrt(power(sin(radians(latitude - %s) / 2), 2) + "
+                "cos(radians(%s)) * cos(radians(latitude)) * power(sin(radians(longitude - %s) / 2), 2)))")
+
+
+def location_cell(latitude, longitude):
+    return math.floor((latitude + 90) * CELLS_PER_DEGREE) * 360 * CELLS_PER_DEGREE + math.floor((longitude + 180) * CELLS_PER_DEGREE)
+
+
+def location_cells(south, west, north, east):
+    """the grid cells covering a box, or None if there are more than MAX_LOCATION_CELLS"""
+    # widened by a hair, so float rounding at the edge of a cell never leaves it out
+    rows = range(math.floor((south + 90) * CELLS_PER_DEGREE - 1e-6), math.floor((north + 90) * CELLS_PER_DEGREE + 1e-6) + 1)
+    columns = range(math.floor((west + 180) * CELLS_PER_DEGREE - 1e-6), math.floor((east + 180) * CELLS_PER_DEGREE + 1e-6) + 1)
+    if len(rows) * len(columns) > MAX_LOCATION_CELLS:
+        return None
+    return [row * 360 * CELLS_PER_DEGREE + column for row in rows for column in columns]
+
+
+def parse_point(value):
+    """(latitude, longitude) of a landmark name or a {"latitude", "longitude"} object"""
+    if isinstance(value, str):
+        return resolve_landmark(value)
+    if not isinstance(value, dict) or "latitude" not in value or "longitude" not in value:
+        raise ValueError("location.value must be a landmark name or an object with a 'latitude' and a 'longitude'")
+    latitude, longitude = parse_number("latitude", value["latitude"]), parse_number("longitude", value["longitude"])
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError(f"Invalid coordinates: {latitude}, {longitude}")
+    return latitude, longitude
+
+
+def compile_location(value):
+    """compiles a "location" filter into conditions and params.
+
+    {"type": "near", "value": "Union Square" or {"latitude", "longitude"}, "radius_km": 1} keeps listings within the
+    radius, {"type": "box", "value": {"south", "west", "north", "east"}} the ones inside the box. The grid cells of
+    the area are looked up in the location_cell index from sql/geo_index.sql, and the exact distance is only
+    computed for the listings in those cells.
+    """
+    if not isinstance(value, dict) or "value" not in value:
+        raise ValueError("query_params.location must be an object with a 'value'")
+    location_type = value.get("type", "near")
+    if location_type == "near":
+        latitude, longitude = parse_point(value["value"])
+        radius_km = parse_number("radius_km", value.get("radius_km", DEFAULT_RADIUS_KM))
+        if not 0 < radius_km <= MAX_RADIUS_KM:
+            raise ValueError(f"radius_km must be between 0 and {MAX_RADIUS_KM:g}")
+        # the box around the circle, a degree of longitude shrinks with the cosine of the latitude
+        delta_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+        delta_longitude = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(latitude)), 0.01)))
+        south, north = latitude - delta_latitude, latitude + delta_latitude
+        west, east = longitude - delta_longitude, longitude + delta_longitude
+        distance_conditions = [f"{HAVERSINE_KM} <= %s"]
+        distance_params = [latitude, latitude, longitude, radius_km]
+    elif location_type == "box":
+        box = value["value"]
+        if not isinstance(box, dict) or any(side not in box for side in ("south", "west", "north", "east")):
+            raise ValueError("a box location must have a 'south', 'west', 'north' and 'east'")
+        south, west, north, east = (parse_number(side, box[side]) for side in ("south", "west", "north", "east"))
+        if south > north or west > east:
+            raise ValueError("a box location must have south <= north and west <= east")
+        distance_conditions, distance_params = [], []
+    else:
+        raise ValueError(f"Invalid location type: {location_type}, use 'near' or 'box'")
+
+    conditions = ["latitude BETWEEN %s AND %s", "longitude BETWEEN %s AND %s"]
+    params = [south, north, west, east]
+    cells = location_cells(south, west, north, east)
+    if cells is not None:
+        conditions.insert(0, "location_cell = ANY(%s)")
+        params.insert(0, cells)
+    return conditions + distance_conditions, params + distance_params
+
+
+# listings without a booking that overlaps the requested stay, a stay ends on the morning of its end_date so
+# back-to-back bookings don't overlap. Uses the (listing_id, end_date) index from sql/availability.sql
+AVAILABILITY_CONDITION = ("NOT EXISTS (SELECT 1 FROM bookings WHERE bookings.listing_id = airbnb_listings.listing_id "
+                          "AND bookings.end_date > %s AND bookings.start_date < %s)")
+
+
+def parse_date_range(dates):
+    """validates a {"start_date", "end_date"} object and returns the dates, raises ValueError if it is invalid"""
+    if not isinstance(dates, dict) or "start_date" not in dates or "end_date" not in dates:
+        raise ValueError("dates must be an object with a 'start_date' and an 'end_date'")
+    try:
+        start_date = date.fromisoformat(str(dates["start_date"])[:10])
+        end_date = date.fromisoformat(str(dates["end_date"])[:10])
+    except ValueError:
+        raise ValueError(f"Invalid dates, use YYYY-MM-DD: {dates['start_date']} to {dates['end_date']}")
+    if end_date <= start_date:
+        raise ValueError("end_date must be after start_date")
+    return start_date, end_date
+
+
+def compile_availability(dates):
+    """the conditions and params that keep only listings available for "dates", if given"""
+    if dates is None:
+        return [], []
+    start_date, end_date = parse_date_range(dates)
+    return [AVAILABILITY_CONDITION], [start_date, end_date]
+
+
+def split_text_filters(filters):
+    """splits filters into text filters, which hybrid search turns into ranking signals, and the remaining hard filters"""
+    text_filters = {key: value for key, value in filters.items() if FILTER_COLUMNS.get(key) == "text"}
+    other_filters = {key: value for key, value in filters.items() if key not in text_filters}
+    return text_filters, other_filters
@@ -0,0 +1,102 @@
+import difflib
+import re
+
+# (latitude, longitude) of places users search near, so "near Union Square" resolves without a geocoding call.
+# Aliases map other names of a place to its name here
+LANDMARKS = {
+    "Union Square": (37.78800, -122.40750),
+    "Powell Street Cable Car Turnaround": (37.78460, -122.40780),
+    "Moscone Center": (37.78420, -122.40160),
+    "SFMOMA": (37.78570, -122.40110),
+    "Yerba Buena Gardens": (37.78500, -122.40240),
+    "Salesforce Tower": (37.78970, -122.39720),
+    "Salesforce Transit Center": (37.78930, -122.39650),
+    "Transamerica Pyramid": (37.79520, -122.40280),
+    "Embarcadero Center": (37.79460, -122.39900),
+    "Ferry Building": (37.79550, -122.39370),
+    "Exploratorium": (37.80170, -122.39730),
+    "Coit Tower": (37.80240, -122.40580),
+    "Chinatown Gate": (37.79060, -122.40580),
+    "Grace Cathedral": (37.79190, -122.41320),
+    "Pier 39": (37.80870, -122.40980),
+    "Alcatraz Ferry": (37.80840, -122.40570),
+    "Fisherman's Wharf": (37.80800, -122.41770),
+    "Ghirardelli Square": (37.80590, -122.42300),
+    "Lombard Street": (37.80210, -122.41870),
+    "Fort Mason": (37.80660, -122.43150),
+    "Marina Green": (37.80660, -122.44180),
+    "Palace of Fine Arts": (37.80290, -122.44840),
+    "Crissy Field": (37.80390, -122.46400),
+    "Golden Gate Bridge": (37.81990, -122.47830),
+    "Lands End": (37.78770, -122.50500),
+    "Japantown Peace Plaza": (37.78530, -122.42940),
+    "City Hall": (37.77930, -122.41930),
+    "Asian Art Museum": (37.78020, -122.41610),
+    "Alamo Square": (37.77630, -122.43280),
+    "Oracle Park": (37.77860, -122.38930),
+    "Caltrain Station": (37.77640, -122.39430),
+    "Chase Center": (37.76800, -122.38770),
+    "UCSF Mission Bay": (37.76800, -122.39200),
+    "Dolores Park": (37.75960, -122.42690),
+    "Mission Dolores": (37.76440, -122.42700),
+    "Castro Theatre": (37.76200, -122.43480),
+    "Haight and Ashbury": (37.76990, -122.44690),
+    "UCSF Parnassus": (37.76310, -122.45860),
+    "Golden Gate Park": (37.76940, -122.48620),
+    "California Academy of Sciences": (37.76990, -122.46610),
+    "de Young Museum": (37.77150, -122.46870),
+    "Twin Peaks": (37.75440, -122.44770),
+    "Bernal Heights Park": (37.74320, -122.41430),
+    "Stern Grove": (37.73560, -122.47730),
+    "Ocean Beach": (37.75940, -122.51070),
+    "San Francisco Zoo": (37.73300, -122.50300),
+    "SFO Airport": (37.62130, -122.37900),
+}
+
+ALIASES = {
+    "ballpark": "Oracle Park",
+    "giants stadium": "Oracle Park",
+    "at&t park": "Oracle Park",
+    "warriors arena": "Chase Center",
+    "moma": "SFMOMA",
+    "museum of modern art": "SFMOMA",
+    "painted ladies": "Alamo Square",
+    "cable car turnaround": "Powell Street Cable Car Turnaround",
+    "crooked street": "Lombard Street",
+    "dragon gate": "Chinatown Gate",
+    "alcatraz": "Alcatraz Ferry",
+    "pier 33": "Alcatraz Ferry",
+    "haight ashbury": "Haight and Ashbury",
+    "cal academy": "California Academy of Sciences",
+    "de young": "de Young Museum",
+    "zoo": "San Francisco Zoo",
+    "airport": "SFO Airport",
+    "sfo": "SFO Airport",
+    "caltrain": "Caltrain Station",
+    "4th and king": "Caltrain Station",
+    "civic center": "City Hall",
+    "financial district": "Transamerica Pyramid",
+    "moscone": "Moscone Center",
+}
+
+
+def normalize_name(name):
+    """lowercase words without "the" or punctuation, so "the Ballpark" and "ballpark" match"""
+    return " ".join(word for word in re.findall(r"[a-z0-9&']+", str(name).lower().replace("'s", "s")) if word != "the")
+
+
+LOOKUP = {normalize_name(name): coordinates for name, coordinates in LANDMARKS.items()}
+LOOKUP.update({normalize_name(alias): LANDMARKS[name] for alias, name in ALIASES.items()})
+
+
+def resolve_landmark(name):
+    """the (latitude, longitude) of a landmark by name or alias, raises ValueError with the closest names if unknown"""
+    key = normalize_name(name)
+    if key in LOOKUP:
+        return LOOKUP[key]
+    suggestions = difflib.get_close_matches(key, LOOKUP, n=3, cutoff=0.6)
+    if len(suggestions) == 1:
+        # a small misspelling, i.e. "Union Sqaure"
+        return LOOKUP[suggestions[0]]
+    hint = f", did you mean {' or '.join(suggestions)}?" if suggestions else ", pass its latitude and longitude instead"
+    raise ValueError(f"Unknown landmark: {name}{hint}")
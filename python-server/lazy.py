@@ -0,0 +1,61 @@
+import functools
+import threading
+import time
+
+# every resource of the process, in the order they were declared
+_resources = []
+
+
+class Resource:
+    """an expensive object, i.e. a client or a connection pool, built on first use and cached for the process.
+
+    Importing a module that declares one stays fast, and a database that is briefly down fails a request instead
+    of the worker. Concurrent first uses build it once, a failed build isn't cached so the next use tries again.
+    Call it to get the object.
+    """
+
+    def __init__(self, name, factory):
+        functools.update_wrapper(self, factory)
+        self.name = name
+        self.factory = factory
+        self.build_ms = None
+        self._lock = threading.Lock()
+        self._built = False
+        self._value = None
+        _resources.append(self)
+
+    def __call__(self):
+        if self._built:
+            return self._value
+        with self._lock:
+            if not self._built:
+                start = time.perf_counter()
+                self._value = self.factory()
+                self.build_ms = (time.perf_counter() - start) * 1000
+                self._built = True
+        return self._value
+
+    @property
+    def built(self):
+        return self._built
+
+
+def resource(name):
+    """declares a function as the factory of a Resource"""
+    def decorator(factory):
+        return Resource(name, factory)
+    return decorator
+
+
+def warm_up(*resources):
+    """builds resources that aren't built yet, returns {name: ms it took to build}. Raises the first build error"""
+    timings = {}
+    for resource in resources:
+        resource()
+        timings[resource.name] = round(resource.build_ms, 2)
+    return timings
+
+
+def stats():
+    """the build time in ms of every resource, None for the ones not built yet"""
+    return {resource.name: round(resource.build_ms, 2) if resource.built else None for resource in _resources}
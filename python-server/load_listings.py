@@ -0,0 +1,279 @@
+"""bulk loader for the Airbnb dataset, replacing the single `\\copy` of airbnb_listings_with_embeddings.csv.
+
+    python load_listings.py copy ../sql/airbnb_listings_with_embeddings.csv --workers 4
+streams the '^' delimited CSV in chunks of --chunk-rows listings and COPYs them over --workers connections, spread
+across the DB_HOST nodes. The secondary indexes of airbnb_listings are dropped before the load and built once after it.
+Finished chunks are written to --checkpoint, so an interrupted load continues where it stopped when run again.
+
+    python load_listings.py reembed --batch-size 100 --concurrency 4
+embeds the description of every listing without an embedding or whose description changed since it was embedded
+(needs sql/embedding_refresh.sql), in batches, with up to --concurrency batches at the embedding provider at a time.
+Run `curl -X POST -H "Authorization: Bearer $LISTINGS_REFRESH_TOKEN" http://127.0.0.1:8000/api/listings/refresh`
+afterwards to drop cached search results.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+from psycopg2.errors import UniqueViolation
+from psycopg2.extras import execute_values
+
+from db import ConnectionPool
+from embedding_cache import FakeEmbeddings
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "schema.sql")
+
+# listings without an embedding, or embedded from another description
+STALE_EMBEDDINGS = """
+    description IS NOT NULL
+    AND (description_embedding IS NULL OR description_embedding_hash IS DISTINCT FROM md5(description))
+"""
+
+
+def listing_columns(schema_path=SCHEMA):
+    """(name, type, not null) of each airbnb_listings column in schema.sql, in order. These are the columns of the
+    CSV, the migrations add more, so COPY names them explicitly"""
+    with open(schema_path) as f:
+        schema = f.read()
+    table = re.search(r"airbnb_listings \((.*?)PRIMARY KEY", schema, re.S).group(1)
+    return [(m.group(1), m.group(2).lower(), bool(m.group(3)))
+            for m in re.finditer(r"^\s*(\w+) ([\w ]+?(?: ?\([\d, ]+\))?)( NOT NULL)?,\s*$", table, re.M)]
+
+
+def read_chunks(path, chunk_rows):
+    """yields (chunk number, rows, CSV text) for every chunk_rows records of the CSV, passing the text through as is.
+    A record ends at a line break outside of quotes, quoted fields can span lines"""
+    with open(path, newline="", encoding="utf-8") as f:
+        lines, rows, quotes, number = [], 0, 0, 0
+        for line in f:
+            lines.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                rows += 1
+                quotes = 0
+                if rows == chunk_rows:
+                    yield number, rows, "".join(lines)
+                    lines, rows, number = [], 0, number + 1
+        if lines:
+            yield number, rows, "".join(lines)
+
+
+class Checkpoint:
+    """the finished chunks and dropped indexes of a load, saved to a JSON file after every chunk"""
+
+    def __init__(self, path, csv_path, chunk_rows):
+        self.path = path
+        self._lock = threading.Lock()
+        source = {"csv": os.path.abspath(csv_path), "size": os.path.getsize(csv_path), "chunk_rows": chunk_rows}
+        self.state = {**source, "done": [], "rows": 0, "indexes": None}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if any(state.get(key) != value for key, value in source.items()):
+                raise ValueError(f"{path} is the checkpoint of another load, delete it to start over")
+            self.state = state
+        self.done = set(self.state["done"])
+
+    def save(self):
+        with self._lock:
+            self.state["done"] = sorted(self.done)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.state, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def finish_chunk(self, number, rows):
+        with self._lock:
+            self.done.add(number)
+            self.state["rows"] += rows
+        self.save()
+
+
+def secondary_indexes(pool):
+    """(name, definition) of the airbnb_listings indexes that no constraint depends on"""
+    with pool.cursor() as cur:
+        cur.execute("""
+            SELECT indexname, indexdef FROM pg_indexes i
+            WHERE tablename = 'airbnb_listings' AND indexdef NOT LIKE 'CREATE UNIQUE%'
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+        """)
+        return [(row["indexname"], row["indexdef"]) for row in cur.fetchall()]
+
+
+def copy_chunk(pool, copy, columns, text):
+    with pool.connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(copy, io.StringIO(text))
+            return
+        except UniqueViolation:
+            # the chunk was loaded before the checkpoint was saved, load the listings that are missing
+            conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE listings_chunk (LIKE airbnb_listings) ON COMMIT DROP")
+            cur.copy_expert(copy.replace("airbnb_listings", "listings_chunk", 1), io.StringIO(text))
+            cur.execute(f"INSERT INTO airbnb_listings ({columns}) SELECT {columns} FROM listings_chunk ON CONFLICT (listing_id) DO NOTHING")
+
+
+def copy_listings(args):
+    checkpoint = Checkpoint(args.checkpoint, args.csv, args.chunk_rows)
+    pool = ConnectionPool.from_env(minconn=1, maxconn=args.workers)
+    columns = ",".join(name for name, _, _ in listing_columns())
+    copy = f"COPY airbnb_listings ({columns}) FROM STDIN WITH (FORMAT csv, DELIMITER '^')"
+
+    if checkpoint.state["indexes"] is None:
+        # building an index once is much faster than updating it for every row, HNSW indexes especially
+        checkpoint.state["indexes"] = secondary_indexes(pool)
+        checkpoint.save()
+        with pool.cursor() as cur:
+            for name, _ in checkpoint.state["indexes"]:
+                cur.execute(f"DROP INDEX IF EXISTS {name}")
+                print(f"dropped {name} until the load finishes")
+    if checkpoint.done:
+        print(f"resuming after {len(checkpoint.done)} loaded chunks, {checkpoint.state['rows']} listings")
+
+    start = time.perf_counter()
+    loaded = 0
+    lock = threading.Lock()
+    # at most two chunks per worker are read ahead, so memory stays bounded for any file size
+    slots = threading.BoundedSemaphore(args.workers * 2)
+    failures = []
+
+    def load(number, rows, text):
+        nonlocal loaded
+        try:
+            copy_chunk(pool, copy, columns, text)
+            checkpoint.finish_chunk(number, rows)
+            with lock:
+                loaded += rows
+                print(f"{checkpoint.state['rows']:>9} listings  {loaded / (time.perf_counter() - start):,.0f} rows/s", end="\r")
+        except Exception as e:
+            print(f"Failed to load chunk {number}:", e)
+            failures.append(number)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for number, rows, text in read_chunks(args.csv, args.chunk_rows):
+            if number in checkpoint.done:
+                continue
+            slots.acquire()
+            if failures:
+                slots.release()
+                break
+            executor.submit(load, number, rows, text)
+    elapsed = time.perf_counter() - start
+    print(f"\nloaded {loaded} listings in {elapsed:.1f}s, {loaded / elapsed if elapsed else 0:,.0f} rows/s")
+    if failures:
+        print("Run the same command again to resume the load")
+        sys.exit(1)
+
+    for name, definition in checkpoint.state["indexes"]:
+        index_start = time.perf_counter()
+        with pool.cursor() as cur:
+            if args.maintenance_work_mem:
+                cur.execute("SET maintenance_work_mem = %s", [args.maintenance_work_mem])
+            cur.execute(definition.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+        print(f"built {name} in {time.perf_counter() - index_start:.1f}s")
+    with pool.cursor() as cur:
+        cur.execute("""SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'airbnb_listings' AND column_name = 'description_embedding_hash'""")
+        if cur.fetchone():
+            # the embeddings of the dataset are up to date, see sql/embedding_refresh.sql
+            cur.execute("UPDATE airbnb_listings SET description_embedding_hash = md5(description) "
+                        "WHERE description_embedding IS NOT NULL AND description_embedding_hash IS NULL")
+        cur.execute("ANALYZE airbnb_listings")
+    pool.closeall()
+    os.remove(args.checkpoint)
+
+
+def reembed_listings(args):
+    if os.getenv("EMBEDDING_PROVIDER", "openai") == "fake":
+        embeddings = FakeEmbeddings()
+    else:
+        embeddings = OpenAIEmbeddings(model=os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002"))
+    pool = ConnectionPool.from_env(minconn=1, maxconn=args.concurrency + 1)
+
+    with pool.cursor() as cur:
+        cur.execute(f"SELECT count(*) AS stale FROM airbnb_listings WHERE {STALE_EMBEDDINGS}")
+        stale = cur.fetchone()["stale"]
+    print(f"{stale} listings to embed")
+
+    start = time.perf_counter()
+    counts = {"embedded": 0, "failed": 0}
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(args.concurrency)
+
+    def embed(batch):
+        try:
+            vectors = embeddings.embed_documents([description for _, description in batch])
+            values = [(listing_id, '[' + ','.join(map(str, vector)) + ']', description)
+                      for (listing_id, description), vector in zip(batch, vectors)]
+            with pool.cursor() as cur:
+                # a description changed in the meantime keeps its old hash and is embedded by the next run
+                execute_values(cur, """
+                    UPDATE airbnb_listings AS l
+                    SET description_embedding = v.embedding::vector, description_embedding_hash = md5(v.description)
+                    FROM (VALUES %s) AS v (listing_id, embedding, description)
+                    WHERE l.listing_id = v.listing_id AND l.description = v.description
+                """, values)
+            outcome = "embedded"
+        except Exception as e:
+            print("Failed to embed a batch of listings:", e)
+            outcome = "failed"
+        finally:
+            slots.release()
+        with lock:
+            counts[outcome] += len(batch)
+            done = counts["embedded"] + counts["failed"]
+            print(f"{done:>9}/{stale} listings  {done / (time.perf_counter() - start):,.1f} rows/s", end="\r")
+
+    last_id = -1
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        while True:
+            with pool.cursor() as cur:
+                cur.execute(f"""SELECT listing_id, description FROM airbnb_listings
+                                WHERE listing_id > %s AND {STALE_EMBEDDINGS} ORDER BY listing_id LIMIT %s""",
+                            [last_id, args.batch_size])
+                batch = [(row["listing_id"], row["description"]) for row in cur.fetchall()]
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            slots.acquire()
+            executor.submit(embed, batch)
+    print(f"\nembedded {counts['embedded']} listings in {time.perf_counter() - start:.1f}s, {counts['failed']} failed")
+    pool.closeall()
+    if counts["failed"]:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    copy = commands.add_parser("copy", help="load the listings CSV")
+    copy.add_argument("csv")
+    copy.add_argument("--workers", type=int, default=4)
+    copy.add_argument("--chunk-rows", type=int, default=1000)
+    copy.add_argument("--checkpoint", default="load_listings.checkpoint.json")
+    copy.add_argument("--maintenance-work-mem", help="for building the indexes, i.e. 1GB")
+    reembed = commands.add_parser("reembed", help="embed new and changed descriptions")
+    reembed.add_argument("--batch-size", type=int, default=100)
+    reembed.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.command == "copy":
+        copy_listings(args)
+    else:
+        reembed_listings(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# upper bounds of the histogram buckets in milliseconds, from a cache hit to a slow LLM call
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# latest samples per stage kept for p50/p95/p99
+RECENT_SAMPLES = 1024
+PREFIX = "booking_agent"
+
+# sent by app.py's tool calls so that api.py logs and times requests under the same trace
+TRACE_HEADER = "X-Trace-Id"
+# fraction of traces whose debug logs are printed, the decision is made per trace so a sampled trace is complete
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+# (stage, ms) recorded during the current request, for the Server-Timing header
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def start_trace(trace_id=None):
+    """starts timing a request under trace_id, or a new trace id, and returns the trace id"""
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    _timings.set([])
+    return trace_id
+
+
+def is_sampled(trace_id=None):
+    trace_id = trace_id or _trace_id.get()
+    if LOG_SAMPLE_RATE >= 1:
+        return True
+    if trace_id is None:
+        return random.random() < LOG_SAMPLE_RATE
+    return zlib.crc32(trace_id.encode("utf-8")) % 10000 < LOG_SAMPLE_RATE * 10000
+
+
+def log(event, **fields):
+    """prints a debug line as JSON for sampled traces only, replacing unconditional dumps of queries and rows"""
+    if is_sampled():
+        print(json.dumps({"trace_id": _trace_id.get(), "event": event, **fields}, default=str))
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, ms):
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        self.recent.append(ms)
+
+    def percentiles(self):
+        values = sorted(self.recent)
+        if not values:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+        return {f"p{p}": values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] for p in (50, 95, 99)}
+
+
+class Metrics:
+    """latency histograms per pipeline stage and counters, rendered in the Prometheus text format.
+
+    Stages are named like "llm", "tool.GetListings", "embedding" or "sql". Each observation takes a lock
+    and a few list operations, so it is cheap enough to leave on for every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, stage, ms):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(ms)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, ms))
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """count, total and p50/p95/p99 per stage"""
+        with self._lock:
+            return {stage: {"count": histogram.count, "sum_ms": histogram.sum, **histogram.percentiles()}
+                    for stage, histogram in self._histograms.items()}
+
+    def render(self, gauges=None):
+        """the Prometheus text exposition of the histograms, counters and `gauges` ({"group": {"name": number}})"""
+        lines = [f"# TYPE {PREFIX}_stage_duration_ms histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(BUCKETS_MS) + ["+Inf"], histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_stage_duration_ms_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_duration_ms_sum{{stage="{stage}"}} {histogram.sum:.3f}')
+                lines.append(f'{PREFIX}_stage_duration_ms_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f"# TYPE {PREFIX}_stage_duration_ms_quantile gauge")
+            for stage, histogram in sorted(self._histograms.items()):
+                for name, value in histogram.percentiles().items():
+                    lines.append(f'{PREFIX}_stage_duration_ms_quantile{{stage="{stage}",quantile="{int(name[1:]) / 100}"}} {value:.3f}')
+            for (name, labels), value in sorted(self._counters.items()):
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{PREFIX}_{name}_total{{{label_text}}} {value}")
+        for group, values in (gauges or {}).items():
+            for name, value in _flatten(values):
+                lines.append(f"{PREFIX}_{group}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        name = f"{prefix}{key}".replace(".", "_").replace(":", "_").replace("-", "_")
+        if isinstance(value, dict):
+            yield from _flatten(value, name + "_")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+metrics = Metrics()
+
+
+def server_timing(timings):
+    """the Server-Timing header value, with the durations of repeated stages added up"""
+    totals = {}
+    for stage, ms in timings:
+        totals[stage] = totals.get(stage, 0.0) + ms
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in totals.items())
+
+
+def instrument_app(app, gauges=None):
+    """adds trace ids, request timing, the Server-Timing header and a /metrics endpoint to a Flask app.
+
+    `gauges` is called on each scrape of /metrics and returns {"group": stats dict} to include, i.e. pool stats.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_trace():
+        g.trace_id = start_trace(request.headers.get(TRACE_HEADER))
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_trace(response):
+        if "request_start" not in g:
+            return response
+        elapsed = (time.perf_counter() - g.request_start) * 1000
+        metrics.observe(f"request.{request.endpoint}", elapsed)
+        metrics.inc("responses", endpoint=request.endpoint, status=response.status_code)
+        # stages that finish after the response starts, i.e. in a stream, aren't in the header
+        response.headers["Server-Timing"] = server_timing((_timings.get() or []) + [("total", elapsed)])
+        response.headers[TRACE_HEADER] = g.trace_id
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return Response(metrics.render(gauges() if gauges else None), mimetype="text/plain; version=0.0.4")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """times every LLM call and tool call of an agent run into the "llm" and "tool.<name>" stages"""
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = ("llm", time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = ("llm", time.perf_counter())
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = (f"tool.{serialized.get('name')}", time.perf_counter())
+
+    def _finish(self, run_id, error=False):
+        stage, start = self._starts.pop(run_id, (None, None))
+        if stage is None:
+            return
+        metrics.observe(stage, (time.perf_counter() - start) * 1000)
+        if error:
+            metrics.inc("errors", stage=stage)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=True)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=True)
@@ -0,0 +1,47 @@
+import base64
+import json
+
+from result_cache import cache_key
+
+
+def query_fingerprint(*parts):
+    """identifies the query a page token belongs to, so that it can't be used to continue another one"""
+    return cache_key(*parts)[:16]
+
+
+def encode_page_token(after, seen, fingerprint, depth=None):
+    """an opaque continuation token: the sort key of the last row returned, the rows returned so far and the query.
+    `depth` pins the candidates the first page was ranked from, so the later pages rank the same candidates"""
+    payload = {"a": after, "n": seen, "q": fingerprint}
+    if depth is not None:
+        payload["d"] = depth
+    payload = json.dumps(payload, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token, fingerprint):
+    """returns (sort key of the last row, rows returned so far, depth or None) of a token, raises ValueError if it is invalid
+    or belongs to another query. The sort key values are only ever bound as query params"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(str(token) + "=" * (-len(str(token)) % 4)))
+    except ValueError:
+        raise ValueError("Invalid page_token")
+    if not isinstance(payload, dict) or not isinstance(payload.get("a"), list) or not isinstance(payload.get("n"), int) \
+            or not all(isinstance(value, (int, float, str)) and not isinstance(value, bool) for value in payload["a"]) \
+            or not isinstance(payload.get("d", 0), int) or isinstance(payload.get("d"), bool):
+        raise ValueError("Invalid page_token")
+    if payload.get("q") != fingerprint:
+        raise ValueError("page_token belongs to another search, pass the same arguments as for the first page")
+    return payload["a"], payload["n"], payload.get("d")
+
+
+def parse_page_size(value, default, maximum):
+    if value is None:
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        page_size = 0
+    if isinstance(value, bool) or not 1 <= page_size <= maximum:
+        raise ValueError(f"page_size must be an integer between 1 and {maximum}")
+    return page_size
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import contextvars
+import threading
+import time
+from typing import Dict, List, Optional
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+
+# the actions of the step being executed by the current thread, see ParallelAgentExecutor._iter_next_step
+_step = threading.local()
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """an AgentExecutor that runs the tool calls of one step concurrently instead of one after another.
+
+    The OpenAI tools agent can ask for several tools in one step, i.e. GetListings and a web search.
+    Read-only tools run on a thread pool of up to max_parallel_tools threads. Tools in serial_tools change data,
+    they run alone and in the order the agent asked for them, after the calls before them finished.
+    Observations are returned in the order of the tool calls, so the agent sees the same steps as before.
+
+    A read-only tool that doesn't finish within its timeout (tool_timeouts, or tool_timeout) gets an observation
+    telling the agent it timed out. Its thread can't be interrupted, so it finishes in the background and its
+    result is dropped. Serial tools have no timeout, a booking that completes after being reported as failed
+    would mislead the agent.
+    """
+
+    max_parallel_tools: int = 4
+    tool_timeout: Optional[float] = 30
+    tool_timeouts: Dict[str, float] = {}
+    serial_tools: List[str] = ["CreateBooking", "DeleteBooking"]
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # AgentExecutor yields every action of a step before performing the first one,
+        # so all of them are known by the time _perform_agent_action is called
+        previous = getattr(_step, "state", None)
+        _step.state = {"actions": [], "steps": None}
+        try:
+            for output in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+                if isinstance(output, AgentAction):
+                    _step.state["actions"].append(output)
+                yield output
+        finally:
+            _step.state = previous
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        state = getattr(_step, "state", None)
+        if state is None or not any(action is agent_action for action in state["actions"]):
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+        # the first call runs the whole step, the others return their results
+        if state["steps"] is None:
+            state["steps"] = self._perform_step(name_to_tool_map, color_mapping, state["actions"], run_manager)
+        index = next(i for i, action in enumerate(state["actions"]) if action is agent_action)
+        return state["steps"][index]
+
+    def _perform_step(self, name_to_tool_map, color_mapping, actions, run_manager):
+        steps = [None] * len(actions)
+        batch = []
+        for index, action in enumerate(actions):
+            if action.tool in self.serial_tools:
+                self._perform_batch(name_to_tool_map, color_mapping, actions, batch, steps, run_manager)
+                batch = []
+                steps[index] = super()._perform_agent_action(name_to_tool_map, color_mapping, action, run_manager)
+            else:
+                batch.append(index)
+        self._perform_batch(name_to_tool_map, color_mapping, actions, batch, steps, run_manager)
+        return steps
+
+    def _perform_batch(self, name_to_tool_map, color_mapping, actions, batch, steps, run_manager):
+        """runs the actions at the `batch` indexes concurrently and stores their steps at the same indexes"""
+        if not batch:
+            return
+        perform = super()._perform_agent_action
+        pool = ThreadPoolExecutor(max_workers=min(self.max_parallel_tools, len(batch)))
+        start = time.monotonic()
+        try:
+            # each thread gets a copy of the context, which carries the callback and tracing state
+            futures = [(index, pool.submit(contextvars.copy_context().run, perform, name_to_tool_map, color_mapping, actions[index], run_manager))
+                       for index in batch]
+            for index, future in futures:
+                timeout = self.tool_timeouts.get(actions[index].tool, self.tool_timeout)
+                try:
+                    steps[index] = future.result(timeout=None if timeout is None else max(0, start + timeout - time.monotonic()))
+                except FuturesTimeoutError:
+                    future.cancel()
+                    print(f"{actions[index].tool} timed out after {timeout}s")
+                    steps[index] = AgentStep(action=actions[index],
+                                             observation=f"{actions[index].tool} did not respond within {timeout} seconds. Please try again.")
+        finally:
+            # on an error or a cancelled run, calls that haven't started are dropped
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,218 @@
+import re
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from filters import FILTER_COLUMNS
+from landmarks import ALIASES, LANDMARKS
+from metrics import log
+from tokens import count_message_tokens, count_tokens
+
+NEIGHBOURHOODS = (
+    "Alamo Square", "Balboa Terrace", "Bayview", "Bernal Heights", "Chinatown", "Civic Center", "Cole Valley", "Cow Hollow",
+    "Crocker Amazon", "Daly City", "Diamond Heights", "Dogpatch", "Downtown", "Duboce Triangle", "Excelsior",
+    "Financial District", "Fisherman's Wharf", "Forest Hill", "Glen Park", "Haight-Ashbury", "Hayes Valley", "Ingleside",
+    "Inner Sunset", "Japantown", "Lakeshore", "Lower Haight", "Marina", "Mission Bay", "Mission District", "Mission Terrace",
+    "Nob Hill", "Noe Valley", "North Beach", "Oceanview", "Outer Sunset", "Pacific Heights", "Parkside", "Portola",
+    "Potrero Hill", "Presidio", "Presidio Heights", "Richmond District", "Russian Hill", "Sea Cliff", "SoMa", "South Beach",
+    "Sunnyside", "Telegraph Hill", "Tenderloin", "The Castro", "Twin Peaks", "Union Square", "Visitacion Valley",
+    "West Portal", "Western Addition/NOPA",
+)
+
+# columns described in every prompt, the ones most searches filter on
+CORE_COLUMNS = ("neighbourhood", "price", "accommodates", "bedrooms", "room_type", "property_type")
+
+# words that make a column relevant to a turn, besides the words of the column name
+COLUMN_KEYWORDS = {
+    "price": ["cheap", "expensive", "budget", "cost", "afford", "affordable", "dollar", "dollars", "night"],
+    "weekly_price": ["week", "weekly"],
+    "monthly_price": ["month", "monthly"],
+    "security_deposit": ["deposit"],
+    "cleaning_fee": ["cleaning"],
+    "extra_people": ["guest", "guests", "people", "person"],
+    "accommodates": ["guest", "guests", "people", "person", "family", "group", "sleeps"],
+    "bedrooms": ["bedroom", "family", "group"],
+    "beds": ["bed"],
+    "bathrooms": ["bathroom", "bath", "baths"],
+    "amenities": ["wifi", "kitchen", "parking", "pool", "washer", "dryer", "gym", "pets", "pet", "tv"],
+    "host_is_superhost": ["superhost"],
+    "is_business_travel_ready": ["business", "work"],
+    "cancellation_policy": ["cancellation", "refund", "flexible", "strict"],
+    "minimum_nights": ["stay", "nights"],
+    "maximum_nights": ["stay", "nights"],
+    "review_scores_rating": ["review", "reviews", "rating", "rated", "best"],
+    "review_scores_cleanliness": ["clean"],
+    "review_scores_location": ["location"],
+    "availability_30": ["available", "availability"],
+    "has_availability": ["available", "availability"],
+    "room_type": ["private", "shared", "entire", "apartment"],
+    "property_type": ["house", "apartment", "condo", "loft"],
+}
+
+# words of column names too common or too vague to select a column
+COLUMN_STOPWORDS = {"has", "the", "type", "code", "extra", "minimum", "maximum", "nights", "avg", "ntm", "scores"}
+# words of neighbourhood names too common to identify one
+GENERIC_WORDS = {"the", "district", "valley", "heights", "hill", "square", "beach", "park", "west", "north", "south",
+                 "lower", "inner", "outer", "center", "city", "terrace", "bay", "view", "addition"}
+# words asking about neighbourhoods in general, which include the whole list
+NEIGHBOURHOOD_WORDS = {"neighbourhood", "neighbourhoods", "neighborhood", "neighborhoods", "area", "areas", "district", "districts"}
+
+# words asking for listings near a place, which include the location filter
+PROXIMITY_WORDS = {"near", "nearby", "close", "closest", "walk", "walking", "walkable", "distance", "blocks", "km", "miles"}
+
+
+def words(text):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _build_lookups():
+    """precomputes word -> columns and word -> neighbourhoods, so that matching a turn is a few set lookups"""
+    column_index = {}
+    for column in FILTER_COLUMNS:
+        for word in set(column.split("_")) | set(COLUMN_KEYWORDS.get(column, [])):
+            if len(word) > 2 and word not in COLUMN_STOPWORDS:
+                column_index.setdefault(word, set()).add(column)
+    # "nights" alone is too common to include all of the nights columns
+    for column in ("minimum_nights", "maximum_nights"):
+        column_index.setdefault("nights", set()).add(column)
+
+    neighbourhood_index = {}
+    for neighbourhood in NEIGHBOURHOODS:
+        for word in words(neighbourhood) - GENERIC_WORDS:
+            if len(word) > 2:
+                neighbourhood_index.setdefault(word, set()).add(neighbourhood)
+    landmark_words = set()
+    for landmark in list(LANDMARKS) + list(ALIASES):
+        landmark_words |= {word for word in words(landmark) - GENERIC_WORDS if len(word) > 3}
+    return column_index, neighbourhood_index, landmark_words
+
+
+COLUMN_INDEX, NEIGHBOURHOOD_INDEX, LANDMARK_WORDS = _build_lookups()
+
+
+def relevant_columns(text):
+    """the core columns plus the columns the text mentions, in schema order"""
+    matched = set(CORE_COLUMNS)
+    for word in words(text):
+        matched |= COLUMN_INDEX.get(word, set()) | COLUMN_INDEX.get(word.rstrip("s"), set())
+    return [column for column in FILTER_COLUMNS if column in matched]
+
+
+def relevant_neighbourhoods(text):
+    """the neighbourhoods the text names, or all of them if it asks about neighbourhoods in general"""
+    text_words = words(text)
+    matched = set()
+    for word in text_words:
+        matched |= NEIGHBOURHOOD_INDEX.get(word, set())
+    if not matched and text_words & NEIGHBOURHOOD_WORDS:
+        return list(NEIGHBOURHOODS)
+    return [neighbourhood for neighbourhood in NEIGHBOURHOODS if neighbourhood in matched]
+
+
+
+def mentions_location(text):
+    """whether the text asks for listings near a place or names a landmark"""
+    return bool(words(text) & (PROXIMITY_WORDS | LANDMARK_WORDS))
+
+
+SAMPLE_OUTPUT = '{"summary": "Here are the results I found. Can I help you with anything else?", "results_to_display": ARRAY_OF_RESULTS}'
+SAMPLE_GET_LISTINGS_CALL = """get_listings({'data': {'query_params': {'neighbourhood': {'value': 'Mission Bay', 'type': 'text'},'price': {'value': 200, 'type': 'currency', 'symbol': '<='}}, 'embedding_text': 'place near dining and nightlife.'}})"""
+SAMPLE_CREATE_BOOKING_CALL = """create_booking({'data': {listing_id: 123, customer_id: 1, start_date: '2024-01-01', end_date: '2024-01-07'}})"""
+
+INSTRUCTIONS = f"""You are a friendly travel agent, helping users to book accomodations and returning a single valid JSON object as output, with 2 keys:
+"summary" explains what is being returned in 1 short paragraph, plus any friendly and relevant follow-up text or question.
+"results_to_display" is a list of results, if applicable, i.e. listings or bookings returned from the database or web search results.
+Never use markdown or newline characters, and never include more than 1 JSON object in the output. Always return the output in this format:
+{SAMPLE_OUTPUT}
+If a user asks a question that cannot be answered using the database, access the internet to find information about the city and its neighborhoods.
+If a user asks for your functionality, describe your abilities under "summary"."""
+
+LISTINGS_INSTRUCTIONS = f"""To search listings, pass get_listings a JSON object with the keys "query_params" and "embedding_text" at its root. "embedding_text" must NEVER be nested inside "query_params".
+"embedding_text" is a string used to generate text embeddings, always use it to search for qualitative information about a listing.
+"query_params" maps database columns to objects with a "value" and a "type": "text", "number", "currency", "boolean" or "date", taken from the columns below. Number, currency and date filters also have a "symbol": "=", "<", "<=", ">" or ">=".
+Spell keys exactly as the columns below, i.e. "neighbourhood", NOT "neighborhood". Only filter on "neighbourhood" if you are sure the user is asking to book in it, using the values listed.
+For instance: {SAMPLE_GET_LISTINGS_CALL}
+When the user gave dates, also pass "dates": {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}} at the root to only get listings available then.
+For more results, repeat the call with the "page_token" it returned.
+Always keep the listing_id in the output, it is needed to create, edit or delete a booking."""
+
+BOOKINGS_INSTRUCTIONS = f"""Use create_booking with the listing_id, customer_id, start_date and end_date. The listing_id must come from listings previously returned by get_listings.
+Dates are in YYYY-MM-DD format, if none were given ask the user what dates they'd like to book. For instance: {SAMPLE_CREATE_BOOKING_CALL}
+The current customer is ID 1, always use it to get or delete bookings. When getting bookings, always include their dates."""
+
+LOCATION_INSTRUCTIONS = """To search near a place, add "location": {"type": "near", "value": "Union Square", "radius_km": 1} to "query_params". "value" is a landmark name or {"latitude": 37.78, "longitude": -122.41}. Walking distance is 1 km."""
+
+
+class PromptBuilder:
+    """builds the system message of a turn from sections, counting the tokens of each against a budget.
+
+    The instructions are always included. The columns and neighbourhood values are limited to the ones the turn
+    mentions, using the lookups above, and optional sections that don't fit in token_budget are left out.
+    """
+
+    def __init__(self, token_budget=1200):
+        self.token_budget = token_budget
+
+    def build(self, input_val, history=()):
+        """returns the system message for a turn and a report of the tokens per section"""
+        # the latest messages give context to follow-ups like "what about cheaper ones?"
+        text = " ".join([input_val] + [message.content for message in list(history)[-2:] if isinstance(message.content, str)])
+
+        columns = relevant_columns(text)
+        sections = [
+            ("instructions", INSTRUCTIONS, True),
+            ("listings", LISTINGS_INSTRUCTIONS, True),
+            ("bookings", BOOKINGS_INSTRUCTIONS, True),
+            ("columns", "Columns of airbnb_listings: " + ", ".join(f"{column} ({FILTER_COLUMNS[column]})" for column in columns), True),
+        ]
+        if mentions_location(text):
+            sections.append(("location", LOCATION_INSTRUCTIONS, False))
+        neighbourhoods = relevant_neighbourhoods(text)
+        if neighbourhoods:
+            sections.append(("neighbourhoods", "Neighbourhood values: " + ", ".join(neighbourhoods), False))
+
+        parts = []
+        report = {"sections": {}, "dropped": [], "budget": self.token_budget, "columns": len(columns), "neighbourhoods": len(neighbourhoods)}
+        total = 0
+        for name, content, required in sections:
+            tokens = count_tokens(content)
+            if not required and total + tokens > self.token_budget:
+                report["dropped"].append(name)
+                continue
+            parts.append(content)
+            report["sections"][name] = tokens
+            total += tokens
+        report["total"] = total
+        if total > self.token_budget:
+            log("system_message_over_budget", tokens=total, budget=self.token_budget)
+        return "\n\n".join(parts), report
+
+
+# notes stored after listing and booking searches, see handle_agent_input in agent.py
+ID_NOTE_PREFIX = "These are the corresponding"
+
+
+def summarize_messages(messages, token_budget):
+    """a short summary of messages that no longer fit in the history, instead of dropping them.
+
+    Extractive, so it costs no LLM call: keeps what the user asked for and the listing and booking ids the agent
+    noted, newest first until token_budget is used up. Returns None if nothing fits.
+    """
+    notes = [message.content for message in messages if isinstance(message, AIMessage) and message.content.startswith(ID_NOTE_PREFIX)]
+    asks = [message.content for message in messages if isinstance(message, HumanMessage)]
+    header = "Summary of the earlier conversation. "
+    tokens = count_tokens(header)
+    kept = []
+    # the latest ids matter most, they are what the user refers back to
+    for line in notes[-1:] + [f'The user asked: "{ask[:200]}"' for ask in reversed(asks)]:
+        line_tokens = count_tokens(line) + 1
+        if tokens + line_tokens > token_budget:
+            break
+        kept.append(line)
+        tokens += line_tokens
+    if not kept:
+        return None
+    return SystemMessage(content=header + " ".join(reversed(kept)))
+
+
+def history_tokens(messages):
+    return sum(count_message_tokens(message) for message in messages)
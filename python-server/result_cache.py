@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def cache_key(*parts):
+    """a stable key for JSON-serializable parts, independent of dict key order"""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SharedResultStore:
+    """optional SQLite tier so that several API workers on a host share cached results and the listings version"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                         "compute_ms REAL NOT NULL, expires_at REAL NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO meta VALUES ('listings_version', 0)")
+        self._db.commit()
+
+    def version(self):
+        with self._lock:
+            return self._db.execute("SELECT value FROM meta WHERE name = 'listings_version'").fetchone()[0]
+
+    def bump_version(self):
+        with self._lock:
+            self._db.execute("UPDATE meta SET value = value + 1 WHERE name = 'listings_version'")
+            # entries of older versions can never be read again
+            self._db.execute("DELETE FROM results")
+            self._db.commit()
+            return self._db.execute("SELECT value FROM meta WHERE name = 'listings_version'").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, compute_ms, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value, compute_ms, ttl):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, json.dumps(value), compute_ms, time.time() + ttl))
+            self._db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+
+class ResultCache:
+    """bounded LRU cache of listing search results with TTL and single-flight computation.
+
+    Keys include the listings version, so `invalidate()` makes every cached result stale at once. Only a shared
+    store carries the version to the other workers, without one `invalidate()` clears this process only and the
+    other workers serve their entries until they expire. Concurrent misses for the same key wait for a single
+    computation instead of all hitting the database.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, shared_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = SharedResultStore(shared_path) if shared_path else None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._version = 0
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0,
+                       "saved_ms": 0.0, "compute_ms": 0.0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def version(self):
+        return self.shared.version() if self.shared is not None else self._version
+
+    def invalidate(self):
+        """makes all cached results stale, call this whenever airbnb_listings changes"""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+        if self.shared is not None:
+            self.shared.bump_version()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, compute_ms, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["saved_ms"] += compute_ms
+                    return value
+                del self._entries[key]
+
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                value, compute_ms = entry
+                self._put(key, value, compute_ms)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                    self._stats["saved_ms"] += compute_ms
+                return value
+        return None
+
+    def _put(self, key, value, compute_ms):
+        with self._lock:
+            self._entries[key] = (value, compute_ms, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key_parts, compute):
+        """returns the cached result for key_parts, or computes it once with `compute` and caches it.
+        Results must be JSON data, i.e. the rows. Cached results are shared between callers, so don't modify them.
+        """
+        if not self.enabled:
+            return compute()
+
+        key = cache_key(self.version(), key_parts)
+        value = self._get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not is_leader:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            value = compute()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            compute_ms = (time.perf_counter() - start) * 1000
+            self._put(key, value, compute_ms)
+            if self.shared is not None:
+                self.shared.put(key, value, compute_ms, self.ttl)
+            with self._lock:
+                self._stats["compute_ms"] += compute_ms
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        version = self.version()
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["shared_hits"] + self._stats["misses"] + self._stats["coalesced"]
+            hits = lookups - self._stats["misses"]
+            return {
+                "version": version,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                **self._stats,
+            }
@@ -0,0 +1,103 @@
+"""production launcher for app.py and api.py, replacing the single process Flask development server.
+
+Runs gunicorn with several worker processes, each serving requests on a pool of threads. Chats spend nearly all
+their time waiting on the LLM and the database, so a worker handles many at once. Requests over the in-flight
+limit of a worker (CHAT_MAX_INFLIGHT, API_MAX_INFLIGHT) are answered with 429, see backpressure.py.
+On SIGTERM or SIGINT workers stop accepting connections and finish their requests for up to --graceful-timeout seconds.
+Each worker warms up (builds its clients and connections) before accepting requests, unless SERVER_WARM_UP=false.
+    python serve.py app --workers 4
+    python serve.py api --workers 2
+"""
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+from gunicorn.util import import_app
+
+SERVERS = {
+    "app": {"uri": "app:app", "port": 3000, "max_inflight": "CHAT_MAX_INFLIGHT", "default_inflight": 32},
+    "api": {"uri": "api:app", "port": 8000, "max_inflight": "API_MAX_INFLIGHT", "default_inflight": 64},
+}
+
+
+def post_worker_init(worker):
+    """with SERVER_WARM_UP, builds the clients and connections of a new worker before it accepts requests. If that
+    fails, i.e. the database is down, the worker starts anyway: /readyz fails and requests retry until it's back"""
+    if os.getenv("SERVER_WARM_UP", "true").lower() != "true":
+        return
+    module = sys.modules[worker.app.uri.split(":")[0]]
+    start = time.perf_counter()
+    try:
+        timings = module.warm_up()
+    except Exception as e:
+        print(f"Worker {worker.pid} failed to warm up:", e)
+        return
+    print(f"Worker {worker.pid} warmed up in {(time.perf_counter() - start) * 1000:.0f}ms: {timings}")
+
+
+def worker_exit(server, worker):
+    """closes the database connections of a stopping worker"""
+    api = sys.modules.get("api")
+    if api is not None and api.get_pool.built:
+        api.get_pool().closeall()
+
+
+class Server(BaseApplication):
+    def __init__(self, uri, options):
+        self.uri = uri
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # imported in each worker after the fork, or once in the master with --preload. Either way every worker
+        # opens its own database connections, nothing connects on import
+        return import_app(self.uri)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("server", choices=SERVERS)
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, help="threads per worker, by default a few more than the in-flight limit "
+                                                    "so that requests over it get a 429 right away instead of waiting for a thread")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30)))
+    parser.add_argument("--preload", action="store_true", help="import the app once in the master before forking the "
+                                                                "workers, which then start faster and share its memory")
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = SERVERS[args.server]
+    max_inflight = int(os.getenv(server["max_inflight"], server["default_inflight"]))
+    options = {
+        "bind": f"{args.host}:{args.port or server['port']}",
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.threads or max(max_inflight, 1) + 4,
+        "graceful_timeout": args.graceful_timeout,
+        # streamed chats are long requests, only restart workers that stop responding entirely
+        "timeout": 120,
+        "keepalive": 5,
+        "preload_app": args.preload,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+        "accesslog": "-",
+    }
+    if args.server == "api" and args.workers > 1 and not os.getenv("LISTINGS_CACHE_PATH"):
+        print("LISTINGS_CACHE_PATH is not set: /api/listings/refresh only clears the cached results of the worker that "
+              "handles it, the others serve theirs for up to LISTINGS_CACHE_TTL seconds")
+    print(f"Serving {server['uri']} on http://{options['bind']} with {args.workers} workers x {options['threads']} threads, "
+          f"{max_inflight or 'unlimited'} requests in flight per worker")
+    Server(server["uri"], options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from collections import OrderedDict, deque
+import os
+import sqlite3
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage
+import psycopg2
+
+from prompt_builder import summarize_messages
+from tokens import count_message_tokens
+
+MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage}
+# attempts of an append that raced another append to the same session for the next seq
+APPEND_ATTEMPTS = 3
+
+
+class SQLiteSessionBackend:
+    """persists chat messages in a local SQLite file, shared by the workers on one host"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_messages (session_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "message_type TEXT NOT NULL, content TEXT NOT NULL, PRIMARY KEY (session_id, seq))"
+        )
+        self._db.commit()
+
+    def load(self, session_id, after_seq, limit):
+        """the newest `limit` messages of a session after the seq after_seq, as (seq, type, content) oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, message_type, content FROM chat_messages WHERE session_id = ? AND seq > ? "
+                "ORDER BY seq DESC LIMIT ?", (session_id, after_seq, limit)).fetchall()
+        return rows[::-1]
+
+    def append(self, session_id, messages):
+        # the write transaction holds the lock of the file, so workers appending at once get consecutive seqs
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            last_seq = self._db.execute("SELECT coalesce(max(seq), 0) FROM chat_messages WHERE session_id = ?",
+                                        (session_id,)).fetchone()[0]
+            self._db.executemany("INSERT INTO chat_messages (session_id, seq, message_type, content) VALUES (?, ?, ?, ?)",
+                                 [(session_id, last_seq + offset, message.type, message.content)
+                                  for offset, message in enumerate(messages, 1)])
+
+
+class PostgresSessionBackend:
+    """persists chat messages in the chat_messages table of the YugabyteDB cluster (see sql/schema.sql),
+    so that any worker on any host can pick up any session.
+
+    Messages are numbered per session on insert. An id from a sequence wouldn't do, each node caches its own range
+    of the sequence, so the ids follow neither the order of the messages nor the order they were committed in.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def load(self, session_id, after_seq, limit):
+        with self.pool.cursor(cursor_factory=None) as cur:
+            cur.execute("SELECT seq, message_type, content FROM chat_messages WHERE session_id = %s AND seq > %s "
+                        "ORDER BY seq DESC LIMIT %s", [session_id, after_seq, limit])
+            rows = cur.fetchall()
+        return rows[::-1]
+
+    def append(self, session_id, messages):
+        # two appends to a session at once pick the same seq, the primary key lets one of them fail and retry
+        for attempt in range(APPEND_ATTEMPTS):
+            try:
+                with self.pool.cursor(cursor_factory=None) as cur:
+                    cur.execute("SELECT coalesce(max(seq), 0) FROM chat_messages WHERE session_id = %s", [session_id])
+                    last_seq = cur.fetchone()[0]
+                    for offset, message in enumerate(messages, 1):
+                        cur.execute("INSERT INTO chat_messages (session_id, seq, message_type, content) VALUES (%s, %s, %s, %s)",
+                                    [session_id, last_seq + offset, message.type, message.content])
+                return
+            except (psycopg2.IntegrityError, psycopg2.extensions.TransactionRollbackError):
+                if attempt == APPEND_ATTEMPTS - 1:
+                    raise
+
+
+class SessionStore:
+    """chat history per session, replacing a single global history shared by all users.
+
+    Each session keeps at most max_messages in a deque, and at most max_sessions are kept in memory,
+    evicting the least recently used. The history passed to the agent is trimmed to token_budget tokens,
+    newest messages first, and the older messages are replaced by a summary of up to summary_budget tokens.
+    With a backend, messages are persisted and loaded incrementally by their seq within the session, so evicted
+    sessions survive and any worker can continue any session.
+    """
+
+    def __init__(self, max_sessions=10000, max_messages=50, token_budget=2000, summary_budget=200, backend=None):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.backend = backend
+
+        self._lock = threading.Lock()
+        # session_id -> {"messages": deque of (message, tokens), "last_seq": seq of the last message loaded from the backend,
+        #                "lock": held while the messages are read from the backend}
+        self._sessions = OrderedDict()
+        self._stats = {"evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        """builds a store from the CHAT_* environment variables"""
+        backend = None
+        backend_name = os.getenv("CHAT_SESSION_BACKEND", "memory")
+        if backend_name == "sqlite":
+            backend = SQLiteSessionBackend(os.getenv("CHAT_SESSION_PATH", "chat_sessions.sqlite3"))
+        elif backend_name == "postgres":
+            # the pool of the process, also used by api.py when the agent calls it in-process
+            from db import get_pool
+            backend = PostgresSessionBackend(get_pool())
+        return cls(
+            max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", 10000)),
+            max_messages=int(os.getenv("CHAT_MAX_MESSAGES", 50)),
+            token_budget=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 2000)),
+            summary_budget=int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", 200)),
+            backend=backend,
+        )
+
+    def _session(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = {"messages": deque(maxlen=self.max_messages), "last_seq": 0, "lock": threading.Lock()}
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def get_history(self, session_id):
+        """the most recent messages of a session that fit in the token budget, oldest first,
+        preceded by a summary of the older ones"""
+        session = self._session(session_id)
+        # two requests of a session at once, i.e. a double submit, must not both append the rows after the same seq
+        with session["lock"]:
+            if self.backend is not None:
+                for seq, message_type, content in self.backend.load(session_id, session["last_seq"], self.max_messages):
+                    if seq <= session["last_seq"]:
+                        continue
+                    message = MESSAGE_TYPES[message_type](content=content)
+                    session["messages"].append((message, count_message_tokens(message)))
+                    session["last_seq"] = seq
+            messages = list(session["messages"])
+        history = []
+        tokens = 0
+        for message, message_tokens in reversed(messages):
+            if tokens + message_tokens > self.token_budget:
+                break
+            history.append(message)
+            tokens += message_tokens
+        history.reverse()
+
+        older = [message for message, _ in messages[:len(messages) - len(history)]]
+        if older and self.summary_budget > 0:
+            summary = summarize_messages(older, self.summary_budget)
+            if summary is not None:
+                history.insert(0, summary)
+        return history
+
+    def append(self, session_id, *messages):
+        if self.backend is not None:
+            # read back on the next get_history, which also picks up messages written by other workers
+            self.backend.append(session_id, messages)
+            return
+        session = self._session(session_id)
+        for message in messages:
+            session["messages"].append((message, count_message_tokens(message)))
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions, **self._stats}
@@ -0,0 +1,114 @@
+import contextvars
+import json
+import queue
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import metrics
+
+# seconds between keep-alive comments while the agent is busy, these also detect clients that went away
+HEARTBEAT_INTERVAL = 10
+
+
+class RunCancelled(Exception):
+    """raised inside the agent run to stop it once the client has disconnected"""
+
+
+class AgentEventHandler(BaseCallbackHandler):
+    """turns the callbacks of an agent run into events on a queue, and stops the run when `stop` is set"""
+
+    # without this, langchain logs exceptions raised by a handler instead of aborting the run
+    raise_error = True
+
+    def __init__(self, events, stop):
+        self.events = events
+        self.stop = stop
+
+    def _check_stop(self):
+        if self.stop.is_set():
+            raise RunCancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check_stop()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check_stop()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._check_stop()
+        if token:
+            self.events.put(("token", {"token": token}))
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check_stop()
+        self.events.put(("tool_start", {"tool": serialized.get("name"), "input": input_str}))
+
+    def on_tool_end(self, output, **kwargs):
+        name = kwargs.get("name")
+        self.events.put(("tool_end", {"tool": name}))
+        # listings are sent as soon as they are found, before the LLM has written its answer
+        if name == "GetListings" and isinstance(output, dict) and "data" in output:
+            self.events.put(("listings", {"data": output["data"]}))
+        self._check_stop()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def stream_agent_run(run):
+    """runs `run(callbacks)` in a background thread and yields its events as Server-Sent Events.
+
+    `run` must pass the callbacks to the agent executor and return a dict with the final "output".
+    Closing the generator, which the server does when the client disconnects, cancels the run.
+    The time to the first event of the run, a token or a tool call, is recorded as the "stream.first_event" stage
+    and sent as "first_event_ms" with the final event.
+    """
+    events = queue.Queue()
+    stop = threading.Event()
+    handler = AgentEventHandler(events, stop)
+
+    def target():
+        try:
+            result = run([handler])
+            if result is None:
+                events.put(("error", {"error": "The agent did not return a result"}))
+            else:
+                events.put(("final", {"output": result.get("output"), "data_to_display": result.get("data_to_display"),
+                                      "token_usage": result.get("token_usage")}))
+        except RunCancelled:
+            pass
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    # the run keeps the trace id and callbacks context of the request
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    start = time.monotonic()
+    first_event_ms = None
+    thread.start()
+    try:
+        # sent right away so the client sees the response open, it carries nothing and isn't the first event
+        yield format_sse("start", {})
+        while True:
+            try:
+                item = events.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                break
+            event, data = item
+            data["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+            if first_event_ms is None:
+                first_event_ms = data["elapsed_ms"]
+                metrics.observe("stream.first_event", first_event_ms)
+            if event == "final":
+                data["first_event_ms"] = first_event_ms
+            yield format_sse(event, data)
+    finally:
+        # reached on completion and on GeneratorExit when the client went away
+        stop.set()
@@ -0,0 +1,79 @@
+import json
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# the encoding used by gpt-3.5-turbo and text-embedding-ada-002
+ENCODING_NAME = "cl100k_base"
+# tokens added by the chat format for every message, on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_lock = threading.Lock()
+_encoding = None
+_encoding_unavailable = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_unavailable
+    if _encoding is not None or _encoding_unavailable:
+        return _encoding
+    with _lock:
+        if _encoding is None and not _encoding_unavailable:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception:
+                # tiktoken downloads the encoding on first use, fall back to an estimate when offline
+                _encoding_unavailable = True
+    return _encoding
+
+
+def count_tokens(text):
+    """the number of tokens in text, or an estimate of ~4 characters per token if tiktoken is unavailable"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message):
+    """the number of tokens a langchain message takes up in a chat prompt"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """records the input and output tokens of every LLM call of an agent run, counted locally.
+
+    Input tokens include the tool definitions sent along with the messages. Streaming responses don't report
+    usage, so the counts are the same estimate whether or not the provider returns one.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        tools = (kwargs.get("invocation_params") or {}).get("tools")
+        self.calls.append({
+            "input_tokens": sum(count_message_tokens(message) for message in messages[0]),
+            "tool_definition_tokens": count_tokens(json.dumps(tools)) if tools else 0,
+            "output_tokens": 0,
+        })
+
+    def on_llm_end(self, response, **kwargs):
+        if not self.calls:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                tool_calls = message.additional_kwargs.get("tool_calls") if message is not None else None
+                self.calls[-1]["output_tokens"] += count_tokens(generation.text) + (count_tokens(json.dumps(tool_calls)) if tool_calls else 0)
+
+    def totals(self):
+        return {
+            "llm_calls": len(self.calls),
+            "input_tokens": sum(call["input_tokens"] + call["tool_definition_tokens"] for call in self.calls),
+            "output_tokens": sum(call["output_tokens"] for call in self.calls),
+        }
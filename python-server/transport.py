@@ -0,0 +1,128 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import TRACE_HEADER, current_trace_id
+
+# returned when a request fails in a way that isn't the caller's fault, the same message the API sends for a 500
+UNEXPECTED_ERROR = "An unexpected error occurred"
+
+
+class InProcessTransport:
+    """calls the service functions of api.py directly, without the HTTP hop and without encoding the rows to JSON.
+    The agent process then owns the database pool and the caches, so run it with a single app.py process per host
+    or share the caches through LISTINGS_CACHE_PATH and EMBEDDING_CACHE_PATH.
+    """
+
+    def __init__(self):
+        # imported here so the HTTP transport doesn't load the API and its clients
+        import api
+        self.api = api
+
+    def warm_up(self):
+        """builds the database pool and the clients of api.py, see api.warm_up"""
+        return self.api.warm_up()
+
+    def _call(self, function, *args, paged=False):
+        try:
+            result = function(*args)
+            # paged functions already return {"data": rows, "next_page_token": token}
+            return result if paged else {"data": result}
+        except ValueError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            print("Error in the in-process API call:", e)
+            return {"error": UNEXPECTED_ERROR}
+
+    def get_listings(self, data):
+        return self._call(self.api.find_listings, data, paged=True)
+
+    def create_booking(self, data):
+        return self._call(self.api.insert_booking, data)
+
+    def get_bookings(self, customer_id):
+        return self._call(self.api.find_bookings, customer_id, paged=True)
+
+    def delete_booking(self, booking_id, customer_id):
+        return self._call(self.api.remove_booking, booking_id, customer_id)
+
+
+class HttpTransport:
+    """calls api.py over HTTP with one keep-alive session, so tool calls reuse pooled connections.
+
+    Every request has a connect and a read timeout. Connection failures are retried for all requests,
+    since nothing was sent yet. GET and DELETE requests are also retried on read errors and 502/503/504
+    responses; POST requests are not, as retrying a booking could create it twice.
+    """
+
+    def __init__(self, base_url="http://localhost:8000", timeout=30, connect_timeout=3, retries=2, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=[502, 503, 504], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def warm_up(self):
+        # api.py has its own /readyz, a chat worker doesn't wait for it
+        return {}
+
+    def _request(self, method, path, **kwargs):
+        # api.py times and logs the request under the trace of the chat that made it
+        trace_id = current_trace_id()
+        headers = {TRACE_HEADER: trace_id} if trace_id else None
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, headers=headers, **kwargs)
+        except requests.RequestException as e:
+            print(f"Failed to call {method} {path}:", e)
+            return {"error": f"The API could not be reached: {e}"}
+        try:
+            body = response.json()
+        except ValueError:
+            print(f"Failed to call {method} {path}: status {response.status_code}")
+            return {"error": UNEXPECTED_ERROR}
+        if response.status_code != 200:
+            print("Error:", body)
+            return {"error": body.get("error", UNEXPECTED_ERROR)}
+        # the same shape as the in-process transport, the "status" message is dropped
+        if "next_page_token" in body:
+            return {"data": body["data"], "next_page_token": body["next_page_token"]}
+        return {"data": body["data"]}
+
+    def get_listings(self, data):
+        return self._request("POST", "/api/listings", json=data)
+
+    def create_booking(self, data):
+        return self._request("POST", "/api/bookings", json=data)
+
+    def get_bookings(self, customer_id):
+        return self._request("GET", "/api/bookings", params={"customer_id": customer_id})
+
+    def delete_booking(self, booking_id, customer_id):
+        return self._request("DELETE", f"/api/bookings/{booking_id}", params={"customer_id": customer_id})
+
+    def close(self):
+        self.session.close()
+
+
+def create_transport(name=None):
+    """builds the transport named by AGENT_TRANSPORT: "http" (the default) or "inprocess".
+
+    Both return {"data": ...} with plain JSON data on success, plus the "next_page_token" of listings and bookings,
+    and {"error": message} on failure.
+    """
+    name = name or os.getenv("AGENT_TRANSPORT", "http")
+    if name == "inprocess":
+        return InProcessTransport()
+    if name == "http":
+        return HttpTransport(
+            base_url=os.getenv("API_URL", "http://localhost:8000"),
+            timeout=float(os.getenv("API_TIMEOUT", 30)),
+            connect_timeout=float(os.getenv("API_CONNECT_TIMEOUT", 3)),
+            retries=int(os.getenv("API_RETRIES", 2)),
+            pool_size=int(os.getenv("API_POOL_SIZE", 10)),
+        )
+    raise ValueError(f"Unknown AGENT_TRANSPORT {name}, use http or inprocess")
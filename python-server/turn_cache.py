@@ -0,0 +1,177 @@
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from metrics import log
+
+# tools whose results change with the data or depend on the customer, turns that used them are never cached
+UNCACHEABLE_TOOLS = {"CreateBooking", "DeleteBooking", "GetBookings"}
+
+
+class TurnCache:
+    """semantic cache of whole agent turns, answering repeated stateless questions without running the agent.
+
+    A turn is looked up by the embedding of its input: the most similar cached input with a cosine similarity
+    of at least `threshold` is a hit, and its output is returned as is. Identical inputs after normalize_text
+    are hits without an embedding call. Only turns without chat history are cached or answered, since a
+    follow-up depends on the conversation, and only turns that used no tool in UNCACHEABLE_TOOLS, searched no
+    dates and got no tool errors. A turn that called a tool with arguments, i.e. a GetListings search, is only
+    answered for the same input after normalize_text: "under $200" and "under $400" embed nearly alike but search
+    for other listings. At most max_entries turns are kept, the least recently used are evicted, each for ttl seconds.
+    `listings_version` returns the version of the listings, every cached turn is dropped when it changes.
+    A failing embedding call is a miss, the turn then runs the agent as if there was no cache.
+    """
+
+    def __init__(self, embed, threshold=0.95, max_entries=500, ttl=3600, listings_version=None):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.listings_version = listings_version
+
+        self._lock = threading.Lock()
+        # normalized input -> {"vector": None for turns only answered on the same input, "entry", "expires_at"}
+        self._entries = OrderedDict()
+        # the vectors of _entries stacked into a matrix, rebuilt after changes
+        self._matrix = None
+        self._keys = []
+        self._version = None
+        self._stats = {"lookups": 0, "hits": 0, "exact_hits": 0, "misses": 0, "stores": 0, "skipped": 0,
+                       "evictions": 0, "invalidations": 0, "errors": 0, "saved_ms": 0.0}
+
+    @staticmethod
+    def is_cacheable(result):
+        """whether a finished agent turn can be served to other users"""
+        for action, observation in result.get("intermediate_steps", []):
+            if action.tool in UNCACHEABLE_TOOLS:
+                return False
+            # availability for dates changes with every booking
+            if isinstance(action.tool_input, dict) and isinstance(action.tool_input.get("data"), dict) and action.tool_input["data"].get("dates"):
+                return False
+            if isinstance(observation, dict) and "error" in observation:
+                return False
+        return bool(result.get("output"))
+
+    @staticmethod
+    def used_tool_arguments(result):
+        """whether a turn called a tool with arguments, whose results depend on the exact wording of the input"""
+        return any(action.tool_input for action, _ in result.get("intermediate_steps", []))
+
+    def _vector(self, text):
+        """the normalized embedding of text, or None if the embedding call failed"""
+        try:
+            vector = np.asarray(self.embed(text), dtype=np.float32)
+        except Exception as e:
+            log("turn_cache_embedding_error", error=str(e))
+            with self._lock:
+                self._stats["errors"] += 1
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        """drops every cached turn if the listings changed since they were cached"""
+        if self.listings_version is None:
+            return
+        version = self.listings_version()
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self._stats["invalidations"] += 1
+                self._entries.clear()
+                self._matrix = None
+                self._version = version
+
+    def _expire(self, now):
+        expired = [key for key, item in self._entries.items() if item["expires_at"] < now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, input_val):
+        """the cached entry for a turn with this input, or None"""
+        if self.max_entries <= 0:
+            return None
+        self._check_version()
+        key = normalize_text(input_val)
+        now = time.monotonic()
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._expire(now)
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["exact_hits"] += 1
+                self._stats["saved_ms"] += item["entry"]["duration_ms"]
+                return item["entry"]
+            if not any(item["vector"] is not None for item in self._entries.values()):
+                # no cached turn can be answered by a similar input
+                self._stats["misses"] += 1
+                return None
+
+        vector = self._vector(key)
+        if vector is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            if self._matrix is None:
+                self._keys = [k for k, item in self._entries.items() if item["vector"] is not None]
+                self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys]) if self._keys else None
+            if self._matrix is not None:
+                similarities = self._matrix @ vector
+                best = int(np.argmax(similarities))
+                best_key = self._keys[best]
+                if similarities[best] >= self.threshold and best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+                    self._stats["hits"] += 1
+                    entry = self._entries[best_key]["entry"]
+                    self._stats["saved_ms"] += entry["duration_ms"]
+                    return entry
+            self._stats["misses"] += 1
+        return None
+
+    def store(self, input_val, result, notes, duration_ms):
+        """caches a finished turn if it is cacheable. notes are the messages the turn added to the chat history
+        besides the input and output, i.e. the listing IDs, and are added again on a hit"""
+        if self.max_entries <= 0:
+            return False
+        if not self.is_cacheable(result):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return False
+
+        self._check_version()
+        key = normalize_text(input_val)
+        vector = None
+        if not self.used_tool_arguments(result):
+            vector = self._vector(key)
+            if vector is None:
+                return False
+        entry = {"output": result["output"], "data_to_display": result.get("data_to_display"), "notes": list(notes),
+                 "duration_ms": duration_ms}
+        with self._lock:
+            self._entries[key] = {"vector": vector, "entry": entry, "expires_at": time.monotonic() + self.ttl}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+            self._stats["stores"] += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["lookups"]
+            return {"size": len(self._entries), "max_entries": self.max_entries, "threshold": self.threshold,
+                    "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0, **self._stats}
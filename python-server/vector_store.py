@@ -0,0 +1,247 @@
+import operator
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from filters import parse_boolean, parse_number
+
+# columns that can be filtered in memory, by the type used in "query_params"
+# a request filtering on any other column falls back to the SQL path
+COLUMNS = {
+    "neighbourhood": "text",
+    "city": "text",
+    "zipcode": "text",
+    "property_type": "text",
+    "room_type": "text",
+    "bed_type": "text",
+    "cancellation_policy": "text",
+    "accommodates": "number",
+    "bathrooms": "number",
+    "bedrooms": "number",
+    "beds": "number",
+    "minimum_nights": "number",
+    "maximum_nights": "number",
+    "availability_30": "number",
+    "availability_60": "number",
+    "availability_90": "number",
+    "availability_365": "number",
+    "review_scores_rating": "number",
+    "review_scores_location": "number",
+    "review_scores_value": "number",
+    "price": "currency",
+    "weekly_price": "currency",
+    "monthly_price": "currency",
+    "security_deposit": "currency",
+    "cleaning_fee": "currency",
+    "extra_people": "currency",
+    "host_is_superhost": "boolean",
+    "has_availability": "boolean",
+    "is_business_travel_ready": "boolean",
+}
+
+SYMBOLS = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# same default as pg_trgm.similarity_threshold, used by the % operator in the SQL path
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(text):
+    """the set of trigrams of text, computed the same way as pg_trgm"""
+    result = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def trigram_similarity(a, b):
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def parse_currency(value):
+    if value is None:
+        return np.nan
+    try:
+        return float(str(value).replace("$", "").replace(",", ""))
+    except ValueError:
+        return np.nan
+
+
+class NumpyVectorStore:
+    """in-process cosine search over all listing embeddings.
+
+    Embeddings are stored as a normalized, memory-mapped matrix next to a listing_id array and the filterable
+    COLUMNS as columnar arrays. Several API workers can map the same files, and a rebuild writes a new version
+    directory that every worker picks up on its next search.
+    """
+
+    def __init__(self, path, dtype="float32"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+
+    def _current_file(self):
+        return os.path.join(self.path, "CURRENT")
+
+    def build(self, pool, batch_size=1000):
+        """loads every listing from the database into a new version of the store and makes it current"""
+        os.makedirs(self.path, exist_ok=True)
+        version = f"v{time.time_ns()}"
+        directory = os.path.join(self.path, version)
+        os.makedirs(directory)
+
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                # one snapshot for the count and the rows, so the matrix size matches what is read
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cur.execute("SELECT count(*), max(vector_dims(description_embedding)) FROM airbnb_listings")
+                count, dims = cur.fetchone()
+
+            vectors = np.lib.format.open_memmap(os.path.join(directory, "vectors.npy"), mode="w+",
+                                                dtype=self.dtype, shape=(count, dims or 0))
+            ids = np.zeros(count, dtype=np.int64)
+            has_embedding = np.zeros(count, dtype=bool)
+            raw_columns = {name: [] for name in COLUMNS}
+
+            # a named cursor streams the rows instead of materializing all embeddings at once
+            with conn.cursor(name="vector_store_build") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"SELECT listing_id, description_embedding::text, {', '.join(COLUMNS)} "
+                            "FROM airbnb_listings ORDER BY listing_id")
+                for i, row in enumerate(cur):
+                    ids[i] = row[0]
+                    if row[1] is not None:
+                        vector = np.array(row[1][1:-1].split(","), dtype=np.float32)
+                        norm = np.linalg.norm(vector)
+                        if norm > 0:
+                            vectors[i] = vector / norm
+                            has_embedding[i] = True
+                    for name, value in zip(COLUMNS, row[2:]):
+                        raw_columns[name].append(value)
+            vectors.flush()
+            del vectors
+
+        np.save(os.path.join(directory, "ids.npy"), ids)
+        columns = {"__has_embedding": has_embedding}
+        for name, column_type in COLUMNS.items():
+            values = raw_columns[name]
+            if column_type == "text":
+                # dictionary encoded, text filters are evaluated once per distinct value
+                categories, codes = np.unique(np.array([v or "" for v in values], dtype=object).astype(str),
+                                              return_inverse=True)
+                columns[f"{name}__categories"] = categories
+                columns[name] = codes.astype(np.int32)
+            elif column_type == "boolean":
+                columns[name] = np.array([-1 if v is None else int(v) for v in values], dtype=np.int8)
+            elif column_type == "currency":
+                columns[name] = np.array([parse_currency(v) for v in values], dtype=np.float64)
+            else:
+                columns[name] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+        np.savez(os.path.join(directory, "columns.npz"), **columns)
+
+        # swapping CURRENT is atomic, so readers always see a complete version
+        tmp_file = self._current_file() + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(version)
+        os.replace(tmp_file, self._current_file())
+        self._remove_old_versions(keep=version)
+        self.reload_if_changed()
+        return count
+
+    def _remove_old_versions(self, keep):
+        for entry in os.listdir(self.path):
+            if entry.startswith("v") and entry != keep:
+                # other workers may still have the old files mapped, which is fine on POSIX
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def exists(self):
+        return os.path.exists(self._current_file())
+
+    def reload_if_changed(self):
+        """maps the current version of the store if it changed since the last call"""
+        try:
+            with open(self._current_file()) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if version == self._version:
+            return False
+        directory = os.path.join(self.path, version)
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(directory, "ids.npy"))
+        with np.load(os.path.join(directory, "columns.npz"), allow_pickle=False) as npz:
+            columns = {name: npz[name] for name in npz.files}
+        with self._lock:
+            self._data = (vectors, ids, columns)
+            self._version = version
+        return True
+
+    def supports(self, filters):
+        return all(key in COLUMNS and isinstance(value, dict) and "value" in value for key, value in filters.items())
+
+    def _filter_mask(self, columns, filters, size):
+        mask = np.ones(size, dtype=bool)
+        for key, value in filters.items():
+            column = columns[key]
+            # like filters.compile_filters, the column decides how a filter is applied, not the type in the request
+            column_type = COLUMNS[key]
+            if column_type == "text":
+                categories = columns[f"{key}__categories"]
+                matching = [i for i, category in enumerate(categories)
+                            if trigram_similarity(category, str(value["value"])) >= TRIGRAM_SIMILARITY_THRESHOLD]
+                mask &= np.isin(column, matching)
+            elif column_type == "boolean":
+                mask &= column == int(parse_boolean(value["value"]))
+            else:
+                compare = SYMBOLS[value.get("symbol", "=")]
+                # comparisons against NaN are False, like NULL in SQL
+                with np.errstate(invalid="ignore"):
+                    mask &= compare(column, float(parse_number(key, value["value"])))
+        return mask
+
+    def search(self, embedding, filters, k=5):
+        """returns the listing_ids of the top k matches, or None if the store can't answer this request"""
+        self.reload_if_changed()
+        if self._data is None or not self.supports(filters):
+            return None
+        vectors, ids, columns = self._data
+
+        candidates = np.flatnonzero(self._filter_mask(columns, filters, len(ids)))
+        if embedding is None or len(candidates) == 0:
+            return ids[candidates[:k]].tolist()
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query)
+        if len(candidates) == len(ids):
+            scores = vectors @ query.astype(vectors.dtype)
+        else:
+            scores = vectors[candidates] @ query.astype(vectors.dtype)
+        # listings without an embedding sort last, like NULL distances in the SQL path
+        scores = np.where(columns["__has_embedding"][candidates], scores.astype(np.float32), -np.inf)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return ids[candidates[top]].tolist()
+
+    def stats(self):
+        if self._data is None:
+            return {"version": None}
+        vectors, ids, _ = self._data
+        return {"version": self._version, "listings": len(ids), "dims": vectors.shape[1], "dtype": str(vectors.dtype),
+                "bytes": vectors.nbytes}
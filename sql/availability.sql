@@ -0,0 +1,9 @@
+-- Index for the availability filter of /api/listings ("dates") and the overlap check of POST /api/bookings.
+-- Both look for bookings of a listing that end after the requested start date, so past bookings are never read
+-- and the search stays fast as the bookings table grows. start_date is included to answer the check from the index.
+-- YugabyteDB has no GiST indexes, so a daterange exclusion constraint isn't an option; api.py instead locks the
+-- listing row while checking for overlaps, which makes concurrent bookings of a listing wait for each other.
+
+CREATE INDEX IF NOT EXISTS bookings_listing_end_date_idx ON bookings (listing_id, end_date) INCLUDE (start_date);
+
+ANALYZE bookings;
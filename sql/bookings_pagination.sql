@@ -0,0 +1,7 @@
+-- Index for the pages of GET /api/bookings?customer_id=... (page_token), which continue after the last booking_id
+-- of the previous page. Every page then starts with an index seek, instead of reading the customer's earlier bookings.
+-- The pages of all bookings use the primary key.
+
+CREATE INDEX IF NOT EXISTS bookings_customer_booking_idx ON bookings (customer_id, booking_id);
+
+ANALYZE bookings;
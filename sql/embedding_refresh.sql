@@ -0,0 +1,14 @@
+-- Tracks which description each embedding was generated from, for `python load_listings.py reembed`.
+-- Listings whose md5(description) no longer matches description_embedding_hash, or without an embedding, are re-embedded.
+-- Run this after loading the Airbnb dataset, the embeddings of the dataset are taken to be up to date.
+-- NOTE: the extra column means the CSV must be loaded with an explicit column list from then on.
+
+ALTER TABLE airbnb_listings
+ADD COLUMN IF NOT EXISTS description_embedding_hash text;
+
+UPDATE airbnb_listings
+SET
+    description_embedding_hash = md5(description)
+WHERE
+    description_embedding IS NOT NULL
+    AND description_embedding_hash IS NULL;
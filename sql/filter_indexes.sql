@@ -0,0 +1,66 @@
+-- Typed columns and indexes for the query_params filters compiled by filters.py.
+-- Run this after loading the Airbnb dataset, api.py filters currency columns on the *_numeric columns added here.
+-- NOTE: the extra columns mean the CSV must be loaded with an explicit column list from then on.
+
+-- Currency columns are stored as text like "$1,200.00". Casting them on every row (price::MONEY::NUMERIC)
+-- can't use an index, so each gets a numeric copy.
+ALTER TABLE airbnb_listings
+ADD COLUMN IF NOT EXISTS price_numeric NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS weekly_price_numeric NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS monthly_price_numeric NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS security_deposit_numeric NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS cleaning_fee_numeric NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS extra_people_numeric NUMERIC(10, 2);
+
+CREATE OR REPLACE FUNCTION currency_to_numeric (value text) RETURNS NUMERIC AS $$
+    SELECT NULLIF(regexp_replace(value, '[$,]', '', 'g'), '')::NUMERIC;
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE airbnb_listings
+SET
+    price_numeric = currency_to_numeric (price),
+    weekly_price_numeric = currency_to_numeric (weekly_price),
+    monthly_price_numeric = currency_to_numeric (monthly_price),
+    security_deposit_numeric = currency_to_numeric (security_deposit),
+    cleaning_fee_numeric = currency_to_numeric (cleaning_fee),
+    extra_people_numeric = currency_to_numeric (extra_people);
+
+-- keeps the numeric copies in sync when listings are inserted or updated
+CREATE OR REPLACE FUNCTION airbnb_listings_normalize_currency () RETURNS trigger AS $$
+BEGIN
+    NEW.price_numeric := currency_to_numeric(NEW.price);
+    NEW.weekly_price_numeric := currency_to_numeric(NEW.weekly_price);
+    NEW.monthly_price_numeric := currency_to_numeric(NEW.monthly_price);
+    NEW.security_deposit_numeric := currency_to_numeric(NEW.security_deposit);
+    NEW.cleaning_fee_numeric := currency_to_numeric(NEW.cleaning_fee);
+    NEW.extra_people_numeric := currency_to_numeric(NEW.extra_people);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS airbnb_listings_normalize_currency ON airbnb_listings;
+
+CREATE TRIGGER airbnb_listings_normalize_currency BEFORE INSERT
+OR
+UPDATE ON airbnb_listings FOR EACH ROW
+EXECUTE FUNCTION airbnb_listings_normalize_currency ();
+
+-- B-tree indexes for the range filters the agent uses most
+CREATE INDEX IF NOT EXISTS airbnb_listings_price_numeric_idx ON airbnb_listings (price_numeric);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_bedrooms_idx ON airbnb_listings (bedrooms);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_accommodates_idx ON airbnb_listings (accommodates);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_review_scores_rating_idx ON airbnb_listings (review_scores_rating);
+
+-- GIN trigram indexes for the pg_trgm similarity (%) text filters
+CREATE INDEX IF NOT EXISTS airbnb_listings_neighbourhood_trgm_idx ON airbnb_listings USING gin (neighbourhood gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_name_trgm_idx ON airbnb_listings USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_property_type_trgm_idx ON airbnb_listings USING gin (property_type gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_room_type_trgm_idx ON airbnb_listings USING gin (room_type gin_trgm_ops);
+
+ANALYZE airbnb_listings;
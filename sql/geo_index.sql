@@ -0,0 +1,38 @@
+-- Grid cell column and index for the "location" filter of /api/listings (near a landmark or point, or in a box).
+-- Run this after filter_indexes.sql, location filters compiled by filters.py need the location_cell column.
+-- NOTE: the extra column means the CSV must be loaded with an explicit column list from then on.
+
+-- YugabyteDB has no GiST indexes, so PostGIS-style spatial indexes aren't an option. Instead every listing gets the
+-- cell of a 0.01 degree grid it lies in (about 1.1km by 0.9km in San Francisco). A search looks up the few cells
+-- covering its area with an index, and computes the exact distance only for the listings in them.
+-- Must match location_cell() in filters.py.
+CREATE OR REPLACE FUNCTION location_cell (latitude NUMERIC, longitude NUMERIC) RETURNS INTEGER AS $$
+    SELECT (floor((latitude + 90) * 100) * 36000 + floor((longitude + 180) * 100))::INTEGER;
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE airbnb_listings
+ADD COLUMN IF NOT EXISTS location_cell INTEGER;
+
+UPDATE airbnb_listings
+SET
+    location_cell = location_cell (latitude, longitude);
+
+-- keeps the cell in sync when listings are inserted or moved
+CREATE OR REPLACE FUNCTION airbnb_listings_location_cell () RETURNS trigger AS $$
+BEGIN
+    NEW.location_cell := location_cell(NEW.latitude, NEW.longitude);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS airbnb_listings_location_cell ON airbnb_listings;
+
+CREATE TRIGGER airbnb_listings_location_cell BEFORE INSERT
+OR
+UPDATE ON airbnb_listings FOR EACH ROW
+EXECUTE FUNCTION airbnb_listings_location_cell ();
+
+-- the cell is looked up by equality, the latitude range then narrows each cell down within the index
+CREATE INDEX IF NOT EXISTS airbnb_listings_location_cell_idx ON airbnb_listings (location_cell, latitude, longitude);
+
+ANALYZE airbnb_listings;
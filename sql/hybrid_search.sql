@@ -0,0 +1,12 @@
+-- Full-text index for the "hybrid" search mode in api.py.
+-- The expression must match LISTING_DOCUMENT in api.py for the index to be used.
+-- The trigram indexes used by the same mode are created in filter_indexes.sql.
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_document_fts_idx ON airbnb_listings USING gin (
+    to_tsvector(
+        'english',
+        coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || neighbourhood
+    )
+);
+
+ANALYZE airbnb_listings;
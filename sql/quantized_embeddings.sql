@@ -0,0 +1,45 @@
+-- Compact copies of description_embedding for the two-stage "halfvec" and "binary" search modes in api.py.
+-- The candidate scan runs over the compact codes and only the top candidates are re-ranked against the full embedding.
+-- Requires pgvector 0.7.0 or later. Run this after loading the Airbnb dataset.
+-- NOTE: the extra columns mean the CSV must be loaded with an explicit column list from then on.
+-- The filters of a search run inside the candidate scan, so like the index in vector_index.sql these indexes return
+-- at most hnsw.ef_search rows before filtering. api.py raises ef_search to the number of candidates and sets
+-- hnsw.iterative_scan for filtered searches (pgvector 0.8 or later), or scans the compact codes exactly on older versions.
+
+ALTER TABLE airbnb_listings
+ADD COLUMN IF NOT EXISTS description_embedding_half halfvec (1536),
+ADD COLUMN IF NOT EXISTS description_embedding_bits bit(1536);
+
+UPDATE airbnb_listings
+SET
+    description_embedding_half = description_embedding::halfvec (1536),
+    description_embedding_bits = binary_quantize (description_embedding)::bit(1536)
+WHERE
+    description_embedding IS NOT NULL;
+
+-- keeps the compact codes in sync when listings are inserted or their embedding changes
+CREATE OR REPLACE FUNCTION airbnb_listings_quantize_embedding () RETURNS trigger AS $$
+BEGIN
+    IF NEW.description_embedding IS NULL THEN
+        NEW.description_embedding_half := NULL;
+        NEW.description_embedding_bits := NULL;
+    ELSE
+        NEW.description_embedding_half := NEW.description_embedding::halfvec(1536);
+        NEW.description_embedding_bits := binary_quantize(NEW.description_embedding)::bit(1536);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS airbnb_listings_quantize_embedding ON airbnb_listings;
+
+CREATE TRIGGER airbnb_listings_quantize_embedding BEFORE INSERT
+OR
+UPDATE OF description_embedding ON airbnb_listings FOR EACH ROW
+EXECUTE FUNCTION airbnb_listings_quantize_embedding ();
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_description_embedding_half_hnsw_idx ON airbnb_listings USING hnsw (description_embedding_half halfvec_cosine_ops);
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_description_embedding_bits_hnsw_idx ON airbnb_listings USING hnsw (description_embedding_bits bit_hamming_ops);
+
+ANALYZE airbnb_listings;
@@ -8,6 +8,8 @@ DROP TABLE IF EXISTS bookings CASCADE;
 
 DROP TABLE IF EXISTS customers CASCADE;
 
+DROP TABLE IF EXISTS chat_messages CASCADE;
+
 CREATE TABLE
     airbnb_listings (
         listing_id bigint NOT NULL,
@@ -142,4 +144,17 @@ CREATE TABLE
         created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (NOW() AT TIME ZONE 'utc'),
         FOREIGN KEY (listing_id) REFERENCES airbnb_listings (listing_id), -- Assume your property table is named airbnb_listing
         FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
-    );
\ No newline at end of file
+    );
+
+-- chat history of the agent per session, used with CHAT_SESSION_BACKEND=postgres
+CREATE TABLE
+    chat_messages (
+        session_id VARCHAR(255) NOT NULL,
+        -- position of the message in its session, assigned on insert. A BIGSERIAL wouldn't follow the order of the
+        -- messages, each node caches its own range of the sequence
+        seq INTEGER NOT NULL,
+        message_type VARCHAR(10) NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT (NOW() AT TIME ZONE 'utc'),
+        PRIMARY KEY (session_id, seq)
+    );
@@ -0,0 +1,24 @@
+-- Approximate nearest neighbour index for the semantic search in api.py (ORDER BY description_embedding <=> ...).
+-- Run this after loading the Airbnb dataset. The index is maintained automatically on INSERT and UPDATE.
+-- Without it every semantic search is an exact scan over all 1536-dim embeddings.
+
+-- HNSW gives the best recall/latency trade-off and can be tuned per request with hnsw.ef_search
+-- (the "ef_search" search param of /api/listings).
+-- The index returns at most ef_search rows before the WHERE conditions run, so a filtered search, i.e. price <= 200
+-- in Mission Bay, could find a single listing where hundreds match. api.py therefore sets hnsw.iterative_scan for
+-- searches with filters, dates or a page token, which keeps scanning the index until enough rows pass (pgvector 0.8
+-- or later, bounded by hnsw.max_scan_tuples), and scans exactly on older versions.
+-- python -m benchmarks.filtered_recall checks that filtered searches find the same listings as an exact scan.
+DROP INDEX IF EXISTS airbnb_listings_description_embedding_ivfflat_idx;
+
+CREATE INDEX IF NOT EXISTS airbnb_listings_description_embedding_hnsw_idx ON airbnb_listings USING hnsw (description_embedding vector_cosine_ops)
+WITH
+    (m = 16, ef_construction = 64);
+
+-- IVFFlat builds faster and uses less memory, tuned per request with ivfflat.probes (the "probes" search param).
+-- It has no strictly ordered iterative scan, so filtered searches need more probes to keep their recall.
+-- To use it instead, drop the HNSW index and build this one once the data is loaded, lists ~ rows / 1000:
+-- DROP INDEX IF EXISTS airbnb_listings_description_embedding_hnsw_idx;
+-- CREATE INDEX airbnb_listings_description_embedding_ivfflat_idx ON airbnb_listings USING ivfflat (description_embedding vector_cosine_ops) WITH (lists = 100);
+
+ANALYZE airbnb_listings;